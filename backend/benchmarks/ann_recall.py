@@ -0,0 +1,68 @@
+# backend/benchmarks/ann_recall.py
+"""
+Recall@k and latency of the corpus IVF index against brute force.
+
+Runs on synthetic clustered unit vectors, so no models are needed:
+
+    cd backend
+    python -m benchmarks.ann_recall --vectors 200000 --dim 384 --k 10 --nprobe 1 4 8 16 32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from core.ann import IVFIndex
+
+def make_corpus(n_vectors: int, dim: int, n_docs: int, n_topics: int, seed: int):
+    """Clustered vectors (roughly what chunk embeddings look like), split into documents."""
+    rng = np.random.default_rng(seed)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    data = topics[rng.integers(n_topics, size=n_vectors)] + 0.6 * rng.standard_normal((n_vectors, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    bounds = np.linspace(0, n_vectors, n_docs + 1).astype(int)
+    docs = {f"doc-{i}.pdf": data[bounds[i]:bounds[i + 1]] for i in range(n_docs)}
+
+    queries = topics[rng.integers(n_topics, size=200)] + 0.6 * rng.standard_normal((200, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return docs, queries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--docs", type=int, default=500)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    docs, queries = make_corpus(args.vectors, args.dim, args.docs, args.topics, args.seed)
+    queries = queries[:args.queries]
+
+    # Add everything untrained, then fit the quantizer once.
+    index = IVFIndex(nlist=args.nlist, exact_threshold=args.vectors + 1)
+    started = time.perf_counter()
+    for doc, matrix in docs.items():
+        index.add(doc, matrix)
+    index.train(seed=args.seed)
+    index.exact_threshold = 0
+    print(f"Indexed {len(index)} vectors in {time.perf_counter() - started:.2f}s: {index.stats()}")
+
+    started = time.perf_counter()
+    truth = [{(d, c) for d, c, _ in index.search(q, top_k=args.k, exact=True)} for q in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    print(f"{'brute force':>12}  recall@{args.k}=1.000  {exact_ms:8.2f} ms/query")
+
+    for nprobe in args.nprobe:
+        started = time.perf_counter()
+        found = [{(d, c) for d, c, _ in index.search(q, top_k=args.k, nprobe=nprobe)} for q in queries]
+        ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        print(f"{'nprobe=' + str(nprobe):>12}  recall@{args.k}={recall:.3f}  {ms:8.2f} ms/query  ({exact_ms / ms:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+# backend/benchmarks/pipeline.py
+"""
+End-to-end benchmark of the ingest, search and analysis pipeline.
+
+Generates synthetic PDFs of a controlled size with PyMuPDF, then measures
+each stage on them in a scratch directory (its own database, store and
+caches, so every run starts cold):
+
+    extract   core.parser.extract_text_from_pdf
+    chunk     core.processor.preprocess_and_chunk
+    embed     core.search.generate_and_store_embeddings
+    search    core.search.semantic_search, one query at a time
+    analyze   core.worker.analyze_entire_document
+    load      concurrent GET /search/{filename} and status polls against the
+              FastAPI app, through an in-process ASGI client
+
+and reports throughput, p50/p95/p99 latency and peak RSS (of the process
+so far) after every stage. By default the embedding models, cross-encoders,
+summarizer and KeyBERT are replaced by tiny deterministic stand-ins
+(benchmarks/standins.py), so it runs fully offline; spaCy is whatever
+NLP_SPACY_MODEL names (use a small pipeline such as en_core_web_sm for
+quick runs).
+
+    cd backend
+    NLP_SPACY_MODEL=en_core_web_sm python -m benchmarks.pipeline --docs 3 --pages 20 --output run.json
+    NLP_SPACY_MODEL=en_core_web_sm python -m benchmarks.pipeline --docs 3 --pages 20 --compare run.json
+
+With --compare, metrics more than --threshold worse than the baseline run are
+reported as regressions and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VOCABULARY = (
+    "system data model analysis network protocol storage memory cache index query latency throughput "
+    "contract clause party agreement payment invoice delivery warranty liability termination notice "
+    "patient clinical trial dose treatment outcome study cohort protein gene expression sample "
+    "revenue margin forecast quarter growth market customer segment pricing strategy report "
+    "the of and to in for with on by from that this is are was were be has have will can may"
+).split()
+
+# --- Synthetic documents ---
+
+def _sentence(rng, min_words: int = 8, max_words: int = 20) -> str:
+    words = list(rng.choice(VOCABULARY, size=int(rng.integers(min_words, max_words + 1))))
+    if rng.random() < 0.2:
+        words.insert(int(rng.integers(len(words))), f"XJ-{int(rng.integers(1000, 9999))}")
+    return " ".join(words).capitalize() + "."
+
+def make_pdf(path: str, pages: int, words_per_page: int, tables_per_page: int, seed: int) -> int:
+    """
+    Writes a PDF of 'pages' pages of generated prose (about words_per_page
+    words each) and tables_per_page small grid tables. Returns the number of
+    words written.
+    """
+    import fitz
+
+    rng = np.random.default_rng(seed)
+    document = fitz.open()
+    total_words = 0
+    for _ in range(pages):
+        page = document.new_page()
+        width, height = page.rect.width, page.rect.height
+        table_height = 70 * tables_per_page
+        sentences, words = [], 0
+        while words < words_per_page:
+            sentence = _sentence(rng)
+            sentences.append(sentence)
+            words += len(sentence.split())
+        text_rect = fitz.Rect(50, 50, width - 50, height - 50 - table_height)
+        page.insert_textbox(text_rect, " ".join(sentences), fontsize=8)
+        total_words += words
+
+        top = height - 50 - table_height
+        for _ in range(tables_per_page):
+            rows, cols = 4, 4
+            cell_width, cell_height = (width - 100) / cols, 14
+            for row in range(rows):
+                for col in range(cols):
+                    cell = fitz.Rect(50 + col * cell_width, top + row * cell_height,
+                                     50 + (col + 1) * cell_width, top + (row + 1) * cell_height)
+                    page.draw_rect(cell, width=0.5)
+                    label = str(rng.choice(VOCABULARY)) if row == 0 else f"{rng.random() * 1000:.2f}"
+                    page.insert_text((cell.x0 + 2, cell.y1 - 4), label, fontsize=7)
+            top += 70
+    document.save(path)
+    document.close()
+    return total_words
+
+# --- Measurement helpers ---
+
+def peak_rss_bytes() -> int:
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS).
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def latency_stats(seconds: list[float]) -> dict:
+    if not seconds:
+        return {}
+    ms = np.array(seconds) * 1000
+    return {
+        "count": len(seconds),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+class Stage:
+    """Collects the timings and work units of one stage."""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.seconds = []
+        self.units = 0
+
+    def time(self, fn, *args, units: int = 1, **kwargs):
+        started = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.seconds.append(time.perf_counter() - started)
+        self.units += units
+        return result
+
+    def report(self) -> dict:
+        total = sum(self.seconds)
+        return {
+            "total_seconds": round(total, 4),
+            "throughput": round(self.units / total, 3) if total else None,
+            "throughput_unit": f"{self.unit}/s",
+            "latency": latency_stats(self.seconds),
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+# --- Stages ---
+
+def run_ingest(paths: list[str], args) -> tuple[dict, list[str]]:
+    from core.parser import extract_text_from_pdf
+    from core.processor import preprocess_and_chunk
+    from core.search import generate_and_store_embeddings
+
+    extract, chunk, embed = Stage("extract", "pages"), Stage("chunk", "words"), Stage("embed", "chunks")
+    doc_ids = []
+    for path in paths:
+        doc_id = os.path.basename(path)
+        text = extract.time(extract_text_from_pdf, path, units=args.pages)
+        chunks, spans, sentences = chunk.time(
+            preprocess_and_chunk, text, with_spans=True, with_sentences=True, units=len(text.split()),
+        )
+        embed.time(
+            generate_and_store_embeddings, doc_id=doc_id, chunks=chunks, spans=spans, sentences=sentences,
+            units=len(chunks),
+        )
+        doc_ids.append(doc_id)
+    return {stage.name: stage.report() for stage in (extract, chunk, embed)}, doc_ids
+
+def make_queries(count: int, seed: int) -> list[str]:
+    rng = np.random.default_rng(seed + 1)
+    return [" ".join(rng.choice(VOCABULARY, size=int(rng.integers(2, 7)))) for _ in range(count)]
+
+def run_search(doc_ids: list[str], queries: list[str]) -> dict:
+    from core.config import settings
+    from core.search import semantic_search
+
+    search = Stage("search", "queries")
+    for i, query in enumerate(queries):
+        search.time(semantic_search, doc_ids[i % len(doc_ids)], query, settings.default_embedding_model, units=1)
+    return search.report()
+
+def run_analyze(doc_ids: list[str]) -> dict:
+    from core.database import SessionLocal, Document
+    from core.worker import analyze_entire_document
+
+    analyze = Stage("analyze", "documents")
+    db = SessionLocal()
+    try:
+        rows = []
+        for doc_id in doc_ids:
+            row = Document(filename=doc_id, status="analyzing")
+            db.add(row)
+            rows.append(row)
+        db.commit()
+        ids = [row.id for row in rows]
+    finally:
+        db.close()
+    for doc_id, row_id in zip(doc_ids, ids):
+        analyze.time(analyze_entire_document, doc_id, row_id, units=1)
+    return analyze.report()
+
+async def _load(doc_ids: list[str], queries: list[str], requests: int, concurrency: int) -> dict:
+    import httpx
+    import main
+
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        for name, make_request in (
+            ("search", lambda i: client.get(f"/search/{doc_ids[i % len(doc_ids)]}", params={"query": queries[i % len(queries)]})),
+            ("status", lambda i: client.get(f"/document/{doc_ids[i % len(doc_ids)]}/status")),
+        ):
+            semaphore = asyncio.Semaphore(concurrency)
+            seconds, errors = [], 0
+
+            async def one(i):
+                nonlocal errors
+                async with semaphore:
+                    started = time.perf_counter()
+                    response = await make_request(i)
+                    seconds.append(time.perf_counter() - started)
+                    errors += response.status_code >= 400
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests)))
+            wall = time.perf_counter() - started
+            results[f"load_{name}"] = {
+                "total_seconds": round(wall, 4),
+                "throughput": round(requests / wall, 3),
+                "throughput_unit": "requests/s",
+                "concurrency": concurrency,
+                "errors": errors,
+                "latency": latency_stats(seconds),
+                "peak_rss_bytes": peak_rss_bytes(),
+            }
+    return results
+
+# --- Comparison ---
+
+# Per metric: whether lower values are better.
+COMPARED_METRICS = {
+    "throughput": False, "p50_ms": True, "p95_ms": True, "p99_ms": True, "peak_rss_bytes": True,
+}
+
+def _metrics(stage: dict) -> dict:
+    values = {"throughput": stage.get("throughput"), "peak_rss_bytes": stage.get("peak_rss_bytes")}
+    values.update({key: stage.get("latency", {}).get(key) for key in ("p50_ms", "p95_ms", "p99_ms")})
+    return {key: value for key, value in values.items() if value is not None}
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[dict]:
+    """The metrics of 'current' more than 'threshold' (a fraction) worse than 'baseline'."""
+    regressions = []
+    for name, stage in current["stages"].items():
+        base_stage = baseline.get("stages", {}).get(name)
+        if not base_stage:
+            continue
+        base_metrics = _metrics(base_stage)
+        for metric, value in _metrics(stage).items():
+            base = base_metrics.get(metric)
+            if not base:
+                continue
+            change = (value - base) / base
+            worse = change > threshold if COMPARED_METRICS[metric] else change < -threshold
+            if worse:
+                regressions.append({"stage": name, "metric": metric, "baseline": base, "current": value,
+                                    "change": round(change, 4)})
+    return regressions
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=2)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--tables-per-page", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint in the load stage.")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--stages", nargs="+", default=["search", "analyze", "load"],
+                        choices=["search", "analyze", "load"], help="Stages to run after ingest.")
+    parser.add_argument("--real-models", action="store_true", help="Use the configured models instead of stand-ins.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="Scratch directory (default: a new temporary one).")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="A previous --output file to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression.")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Everything the app writes (database, store, caches, uploads) goes to
+    # relative paths, so run from a scratch directory.
+    workdir = args.workdir or tempfile.mkdtemp(prefix="nlp-benchmark-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ.setdefault("NLP_JOB_WORKERS", "0")
+
+    from core.config import settings
+    if not args.real_models:
+        from benchmarks import standins
+        standins.install()
+    from core.database import create_db_and_tables
+    create_db_and_tables()
+
+    os.makedirs(settings.upload_directory, exist_ok=True)
+    paths, words = [], 0
+    for i in range(args.docs):
+        path = os.path.join(settings.upload_directory, f"benchmark-{i}.pdf")
+        words += make_pdf(path, args.pages, args.words_per_page, args.tables_per_page, args.seed + i)
+        paths.append(path)
+    print(f"Generated {args.docs} PDFs of {args.pages} pages ({words} words) in {workdir}")
+
+    stages = {}
+    doc_ids = [os.path.basename(path) for path in paths]
+    queries = make_queries(args.queries, args.seed)
+    # The other stages need ingested documents, so ingest always runs.
+    ingest, doc_ids = run_ingest(paths, args)
+    stages.update(ingest)
+    if "search" in args.stages:
+        stages["search"] = run_search(doc_ids, queries)
+    if "analyze" in args.stages:
+        stages["analyze"] = run_analyze(doc_ids)
+    if "load" in args.stages:
+        stages.update(asyncio.run(_load(doc_ids, queries, args.requests, args.concurrency)))
+
+    result = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_commit": _git_commit(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "models": "configured" if args.real_models else "stand-ins",
+            "spacy_model": settings.spacy_model,
+            "default_embedding_model": settings.default_embedding_model,
+        },
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "workdir")},
+        "stages": stages,
+    }
+
+    for name, stage in stages.items():
+        latency = stage["latency"]
+        print(f"{name:>12}  {stage['throughput'] or 0:10.2f} {stage['throughput_unit']:<12}  "
+              f"p50 {latency.get('p50_ms', 0):9.2f} ms  p95 {latency.get('p95_ms', 0):9.2f} ms  "
+              f"p99 {latency.get('p99_ms', 0):9.2f} ms  peak RSS {stage['peak_rss_bytes'] / 2**20:7.1f} MiB")
+
+    if baseline is not None:
+        result["regressions"] = compare(baseline, result, args.threshold)
+        for regression in result["regressions"]:
+            print(f"REGRESSION {regression['stage']}.{regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})")
+        if not result["regressions"]:
+            print(f"No regressions beyond {args.threshold:.0%} against {args.compare}.")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {output}")
+    if baseline is not None and result["regressions"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
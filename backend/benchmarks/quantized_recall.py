@@ -0,0 +1,50 @@
+# backend/benchmarks/quantized_recall.py
+"""
+Recall@k, latency and resident bytes of quantized embeddings with exact
+rescoring (core/quantize.py) against plain float32 search.
+
+Runs on synthetic clustered unit vectors, so no models are needed:
+
+    cd backend
+    python -m benchmarks.quantized_recall --vectors 200000 --dim 384 --k 10 --factor 1 2 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.ann_recall import make_corpus
+from core.ann import top_k_indices
+from core.quantize import QuantizedMatrix, rescored_top_k
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--factor", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    docs, queries = make_corpus(args.vectors, args.dim, 1, args.topics, args.seed)
+    matrix = next(iter(docs.values()))
+    queries = queries[:args.queries]
+
+    started = time.perf_counter()
+    truth = [set(top_k_indices(matrix @ q, args.k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    print(f"{'float32':>8}  {matrix.nbytes / 2**20:8.1f} MiB  recall@{args.k}=1.000  {exact_ms:8.2f} ms/query")
+
+    quantized = QuantizedMatrix.from_float(matrix, "int8")
+    for factor in args.factor:
+        started = time.perf_counter()
+        found = [set(rescored_top_k(quantized, matrix, q, args.k, factor)[0].tolist()) for q in queries]
+        ms = (time.perf_counter() - started) * 1000 / len(queries)
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        print(f"{'int8':>8}  {quantized.nbytes / 2**20:8.1f} MiB  recall@{args.k}={recall:.3f}  "
+              f"{ms:8.2f} ms/query  (rescore factor {factor})")
+
+if __name__ == "__main__":
+    main()
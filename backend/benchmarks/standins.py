@@ -0,0 +1,104 @@
+# backend/benchmarks/standins.py
+"""
+Tiny, deterministic stand-ins for the heavy models, for offline benchmarks.
+
+install() registers them in the model registry (core/models.py) under the
+names the application asks for, so the pipeline runs unchanged but without
+downloading or running the transformers:
+
+  * embedding models: hashed bag-of-words vectors (same dimension as the
+    real model, unit length, similar texts get similar vectors);
+  * cross-encoders: word overlap between query and passage;
+  * summarizer: the opening words of every input, with a word tokenizer;
+  * KeyBERT: the real KeyBERT over the stand-in embeddings.
+
+spaCy has no useful stand-in (sentence splitting, NER and TextRank are part
+of what is measured), so point NLP_SPACY_MODEL at a small installed
+pipeline such as en_core_web_sm instead of the transformer one.
+"""
+import re
+import zlib
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+class WordTokenizer:
+    """Enough of a Hugging Face tokenizer for core/tokens.py: one token per word."""
+
+    def __call__(self, texts, add_special_tokens=False, verbose=False, **kwargs):
+        return {"input_ids": [list(range(len(_WORD_RE.findall(text)))) for text in texts]}
+
+class HashEmbedder:
+    """Hashed bag-of-words sentence embeddings with a SentenceTransformer-like encode()."""
+
+    def __init__(self, dim: int = 384, max_seq_length: int = 256):
+        self.dim = dim
+        self.max_seq_length = max_seq_length
+        self.tokenizer = WordTokenizer()
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = _WORD_RE.findall(text.lower())[:self.max_seq_length]
+        for word in words:
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, convert_to_numpy: bool = True, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        embeddings = np.stack([self._embed(text) for text in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+class OverlapCrossEncoder:
+    def predict(self, pairs, batch_size: int = 32, **kwargs):
+        scores = []
+        for query, passage in pairs:
+            query_words = set(_WORD_RE.findall(query.lower()))
+            passage_words = set(_WORD_RE.findall(passage.lower()))
+            scores.append(len(query_words & passage_words) / max(len(query_words), 1))
+        return np.array(scores, dtype=np.float32)
+
+class LeadSummarizer:
+    """A summarization 'pipeline' that returns the first max_length words of each input."""
+
+    def __call__(self, texts, max_length: int = 150, min_length: int = 0, **kwargs):
+        single = isinstance(texts, str)
+        outputs = [{"summary_text": " ".join(text.split()[:max_length])} for text in ([texts] if single else texts)]
+        return outputs[0] if single else outputs
+
+def _keybert_loader(embedder: HashEmbedder):
+    def load():
+        from keybert import KeyBERT
+        from keybert.backend import BaseEmbedder
+
+        class Backend(BaseEmbedder):
+            def embed(self, documents, verbose=False):
+                return embedder.encode(documents)
+
+        return KeyBERT(model=Backend())
+    return load
+
+def install(dims: dict | None = None) -> None:
+    """
+    Registers the stand-ins for every configured embedding model,
+    cross-encoder, the summarizer and KeyBERT. 'dims' overrides the
+    embedding dimension per model name (default 384).
+    """
+    from core.config import settings
+    from core.models import registry
+
+    dims = dims or {}
+    embedders = {name: HashEmbedder(dims.get(name, 384)) for name in settings.embedding_models}
+    for name, embedder in embedders.items():
+        registry.register(name, lambda embedder=embedder: embedder)
+    for name in settings.cross_encoder_models:
+        registry.register(name, OverlapCrossEncoder)
+    registry.register("summarizer", LeadSummarizer)
+    registry.register("summarizer_tokenizer", WordTokenizer)
+    registry.register("keybert", _keybert_loader(embedders[settings.default_embedding_model]))
@@ -1,28 +1,38 @@
 # core/analysis.py
-import spacy
-from .models import nlp, summarizer # Import our shared spaCy model instance
-from sklearn.feature_extraction.text import TfidfVectorizer
-from .models import nlp, embedding_models
-from sklearn.metrics.pairwise import cosine_similarity
+# spaCy and scikit-learn are imported inside the functions that use them,
+# and the models come from the lazy registry, so importing this is cheap.
+from .models import get_nlp, get_embedding_model
+from .config import settings
+from .parsing import parse_text
+from .summarize import summarize_document
+from .cache import LRUCache, SingleFlight, AsyncSingleFlight
+from .inference import mode_tag
+from . import metrics
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import os
+import anyio
 import numpy as np
 
-def extract_entities(text: str) -> list[dict]:
+def extract_entities(text: str, parsed=None) -> list[dict]:
     """
     Extracts Named Entities from a given text using the spaCy model.
 
     Args:
         text: The input string to process.
+        parsed: An existing parse of the text (see core/parsing.py) to reuse.
 
     Returns:
         A list of dictionaries, where each dictionary represents an entity.
     """
-    if nlp is None:
+    if get_nlp() is None:
         return []
+    import spacy
 
-    doc = nlp(text)
+    parsed = parsed or parse_text(text, {"ner"})
 
     entities = []
-    for ent in doc.ents:
+    for ent in parsed.entities():
         entities.append({
             "text": ent.text,
             "label": ent.label_,
@@ -30,18 +40,20 @@ def extract_entities(text: str) -> list[dict]:
         })
     return entities
 
-def extract_keywords(text: str) -> dict:
+def extract_keywords(text: str, parsed=None) -> dict:
     """
     Extracts keywords and keyphrases using two methods: TextRank and TF-IDF.
 
     Args:
         text: The input string to process.
+        parsed: An existing parse of the text (see core/parsing.py) to reuse.
 
     Returns:
         A dictionary containing lists of keywords from both methods.
     """
-    if nlp is None:
+    if get_nlp() is None:
         return {}
+    from sklearn.feature_extraction.text import TfidfVectorizer
 
     results = {
         "textrank": [],
@@ -49,9 +61,9 @@ def extract_keywords(text: str) -> dict:
     }
 
     # --- Method 1: TextRank for contextual keyphrases ---
-    doc = nlp(text)
+    parsed = parsed or parse_text(text, {"textrank"})
     # Access the top 10 ranked phrases from the custom '._.' attribute
-    for phrase in doc._.phrases[:10]:
+    for phrase in parsed.phrases(limit=10):
         results["textrank"].append({
             "text": phrase.text,
             "rank": phrase.rank
@@ -86,15 +98,109 @@ def extract_keywords(text: str) -> dict:
     return results
 
 
+def _phrase_cache_path(cache_key: str) -> str:
+    # int8 and float32 vectors of the same model differ, so each mode has its own entries.
+    key = f"{settings.default_embedding_model}|{mode_tag('embedding')}|{cache_key}"
+    return os.path.join(settings.phrase_cache_directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz")
+
+def _load_phrase_embeddings(cache_key: str) -> dict:
+    try:
+        with np.load(_phrase_cache_path(cache_key), allow_pickle=False) as cached:
+            return dict(zip(cached["phrases"].tolist(), cached["embeddings"]))
+    except (OSError, ValueError, KeyError):
+        return {}
+
+def _store_phrase_embeddings(cache_key: str, phrases: list[str], embeddings: np.ndarray) -> None:
+    path = _phrase_cache_path(cache_key)
+    try:
+        os.makedirs(settings.phrase_cache_directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp_path, phrases=np.array(phrases), embeddings=embeddings)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache KeyBERT candidate embeddings: {e}")
+
+def _candidate_embeddings(model, candidates: list[str], cache_key: str | None) -> np.ndarray:
+    """
+    Embeddings of the KeyBERT candidates. With a cache key (the document),
+    only candidates that the document's previous version didn't have are
+    encoded, and this version's are cached for the next one.
+    """
+    from .batching import encode_bucketed
+
+    if not cache_key:
+        return encode_bucketed(model, candidates)
+    known = _load_phrase_embeddings(cache_key)
+    missing = [i for i, candidate in enumerate(candidates) if candidate not in known]
+    metrics.cache_events.inc(len(candidates) - len(missing), cache="keybert_candidates", result="hit")
+    metrics.cache_events.inc(len(missing), cache="keybert_candidates", result="miss")
+    encoded = encode_bucketed(model, [candidates[i] for i in missing]) if missing else None
+    dim = encoded.shape[1] if encoded is not None else len(next(iter(known.values())))
+    embeddings = np.empty((len(candidates), dim), dtype=np.float32)
+    for i, candidate in enumerate(candidates):
+        if candidate in known:
+            embeddings[i] = known[candidate]
+    if missing:
+        embeddings[missing] = encoded
+    _store_phrase_embeddings(cache_key, candidates, embeddings)
+    return embeddings
+
+def extract_keybert_keywords(
+    text: str, sentence_embeddings: dict | None = None, top_n: int = 15, cache_key: str | None = None,
+) -> list[str]:
+    """
+    Extracts keyphrases with the shared KeyBERT model.
+
+    Args:
+        text: The input string to process.
+        sentence_embeddings: Stored unit-length sentence embeddings (see
+            search.get_sentence_embeddings). Their centroid is used as the
+            document embedding, which covers the whole document rather than
+            the first max_seq_length tokens, and costs no encoding.
+        top_n: The number of keyphrases to return.
+        cache_key: A key under which the candidate embeddings are cached
+            (the document), so a new version of it only encodes new candidates.
+
+    Returns:
+        The keyphrases, best first.
+    """
+    from .models import get_keybert
+    kw_model = get_keybert()
+    model = get_embedding_model(settings.default_embedding_model)
+    if kw_model is None or model is None:
+        return []
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    # KeyBERT takes precomputed inputs; the candidates are encoded in
+    # length-sorted batches, in the order of the vectorizer's vocabulary.
+    vectorizer = CountVectorizer(ngram_range=(1, 3), stop_words="english")
+    try:
+        candidates = list(vectorizer.fit([text]).get_feature_names_out())
+    except ValueError:
+        # Nothing left after stop word removal.
+        return []
+    word_embeddings = _candidate_embeddings(model, candidates, cache_key)
+    doc_embeddings = None
+    if sentence_embeddings:
+        centroid = np.mean(np.stack(list(sentence_embeddings.values())), axis=0)
+        doc_embeddings = centroid.reshape(1, -1)
+    with metrics.timer("keybert"):
+        keywords = kw_model.extract_keywords(
+            text, vectorizer=vectorizer, top_n=top_n,
+            doc_embeddings=doc_embeddings, word_embeddings=word_embeddings,
+        )
+    return [keyword for keyword, _ in keywords]
+
 # core/analysis.py (This is the corrected function to use)
 
-def generate_summary(text: str, num_extractive_sentences: int = 3) -> dict:
+def generate_summary(text: str, num_extractive_sentences: int = 3, parsed=None) -> dict:
     """
     Generates both extractive and abstractive summaries for a given text.
 
     Args:
         text: The input string to process.
         num_extractive_sentences: The number of sentences for the extractive summary.
+        parsed: An existing parse of the text (see core/parsing.py) to reuse.
 
     Returns:
         A dictionary containing both summary types.
@@ -105,61 +211,77 @@ def generate_summary(text: str, num_extractive_sentences: int = 3) -> dict:
     }
 
     # --- Extractive Summary using pytextrank ---
-    if nlp:
-        doc = nlp(text)
+    if get_nlp():
+        parsed = parsed or parse_text(text, {"textrank"})
         # --- THIS IS THE FIX: Access summary through 'doc._.textrank' ---
         try:
-            extracted_sentences = [sent.text for sent in doc._.textrank.summary(limit_sentences=num_extractive_sentences)]
+            extracted_sentences = parsed.textrank_summary(limit_sentences=num_extractive_sentences)
             results["extractive"] = " ".join(extracted_sentences)
         except AttributeError:
              print("Could not generate extractive summary. Is 'pytextrank' in the spaCy pipeline?")
              results["extractive"] = "Could not be generated."
 
 
-    # --- Abstractive Summary using transformers ---
-    if summarizer:
-        max_chunk_length = 1024
-        truncated_text = text[:max_chunk_length*4] 
-
-        try:
-            summary_list = summarizer(truncated_text, max_length=150, min_length=30, do_sample=False)
-            if summary_list:
-                results["abstractive"] = summary_list[0]['summary_text']
-        except Exception as e:
-            print(f"Error during abstractive summarization: {e}")
-            results["abstractive"] = "Could not be generated."
+    # --- Abstractive Summary using transformers (map-reduce, see core/summarize.py) ---
+    try:
+        sentences = parsed.sentences() if parsed is not None else None
+        summary, _ = summarize_document(
+            text, sentences=sentences, max_length=150, min_length=30,
+            time_budget=settings.summary_interactive_time_budget_seconds,
+        )
+        if summary is not None:
+            results["abstractive"] = summary
+    except Exception as e:
+        print(f"Error during abstractive summarization: {e}")
+        results["abstractive"] = "Could not be generated."
     
     return results
 
-def generate_semantic_extractive_summary(full_text: str, num_sentences: int = 7) -> str:
+def generate_semantic_extractive_summary(
+    full_text: str, num_sentences: int = 7, parsed=None, sentence_embeddings: dict | None = None,
+) -> str:
     """
     Generates a coherent extractive summary by finding sentences closest to the document's central meaning.
+
+    Args:
+        sentence_embeddings: Unit-length embeddings of the sentences keyed by
+            their (start, end) span (see search.get_sentence_embeddings);
+            only sentences missing from it are encoded.
     """
-    if nlp is None or not embedding_models:
+    if get_nlp() is None:
         return "Models not available for summary."
 
-    model = embedding_models.get('all-MiniLM-L6-v2')
+    model = get_embedding_model(settings.default_embedding_model)
     if not model:
         return "Embedding model not found."
+    from .batching import encode_bucketed
+    from .store import normalize_rows
 
-    doc = nlp(full_text)
+    parsed = parsed or parse_text(full_text, {"sentences"})
     # Get all sentences that have a reasonable length
-    sentences = [sent.text for sent in doc.sents if len(sent.text.split()) > 5] 
+    spans = [(start, end, sent) for start, end, sent in parsed.sentences() if len(sent.split()) > 5]
+    sentences = [sent for _, _, sent in spans]
     
     if len(sentences) < num_sentences:
         return " ".join(sentences) # Return all if document is too short
 
-    # 1. Get embeddings for all sentences
-    sentence_embeddings = model.encode(sentences)
+    # 1. Get embeddings for all sentences (stored ones are reused)
+    stored = sentence_embeddings or {}
+    missing = [i for i, (start, end, _) in enumerate(spans) if (start, end) not in stored]
+    encoded = normalize_rows(encode_bucketed(model, [sentences[i] for i in missing])) if missing else None
+    rows = dict(zip(missing, encoded)) if missing else {}
+    embeddings = np.stack([
+        rows[i] if i in rows else stored[(start, end)] for i, (start, end, _) in enumerate(spans)
+    ])
     
     # 2. Calculate the centroid (average vector of all sentences)
-    centroid = np.mean(sentence_embeddings, axis=0)
+    centroid = embeddings.mean(axis=0)
     
-    # 3. Calculate similarity of each sentence to the centroid
-    similarities = cosine_similarity(sentence_embeddings, centroid.reshape(1, -1))
+    # 3. Calculate similarity of each sentence to the centroid (rows are unit length)
+    similarities = embeddings @ (centroid / max(float(np.linalg.norm(centroid)), 1e-12))
     
     # 4. Get the indices of the top N most similar sentences
-    top_indices = np.argsort(similarities.flatten())[::-1][:num_sentences]
+    top_indices = np.argsort(similarities)[::-1][:num_sentences]
     
     # 5. Sort these top indices to maintain original document order for readability
     top_indices_sorted = sorted(top_indices)
@@ -167,4 +289,69 @@ def generate_semantic_extractive_summary(full_text: str, num_sentences: int = 7)
     # 6. Join the sentences to form the final, coherent summary
     summary = " ".join([sentences[i] for i in top_indices_sorted])
     
-    return summary
\ No newline at end of file
+    return summary
+
+INTERACTIVE_TASKS = ("ner", "keywords", "summary")
+
+# Results of interactive analyses, keyed on (text hash, tasks, settings), and
+# the pool their tasks run on. Identical requests in flight are computed once.
+analysis_cache = LRUCache(settings.analysis_cache_size)
+_analysis_executor = ThreadPoolExecutor(max_workers=settings.analysis_workers, thread_name_prefix="analysis")
+_analysis_flight = SingleFlight()
+_async_analysis_flight = AsyncSingleFlight()
+
+def _analysis_settings() -> tuple:
+    # Everything configurable that changes the results. The model names stand
+    # in for their versions, and int8 models give (slightly) different output.
+    return (
+        settings.spacy_model, settings.summarizer_model, settings.default_embedding_model,
+        settings.inference_mode, tuple(settings.int8_model_kinds) if settings.inference_mode == "int8" else (),
+        settings.parse_segment_chars, settings.incremental_reprocessing,
+        settings.summary_section_tokens, settings.summary_section_max_length, settings.summary_section_min_length,
+        settings.summary_max_levels, settings.summary_interactive_time_budget_seconds,
+    )
+
+def _analysis_key(text: str, tasks: list[str]) -> tuple:
+    return (hashlib.sha256(text.encode("utf-8")).hexdigest(), tuple(tasks), _analysis_settings())
+
+def _requested_tasks(tasks) -> list[str]:
+    return [task for task in INTERACTIVE_TASKS if task in tasks]
+
+def _compute_analysis(text: str, tasks: list[str], key: tuple) -> dict:
+    from .engine import run_analysis
+    results = run_analysis(text, tasks, executor=_analysis_executor)
+    analysis_cache.put(key, results)
+    return results
+
+def run_analysis_tasks(text: str, tasks: list[str]) -> dict:
+    """
+    Runs the requested interactive analyses ('ner', 'keywords', 'summary') on
+    a text, sharing a single parse between them. The tasks run concurrently
+    and results are cached (see analysis_cache).
+    Used by /analyze/ and by queued 'analyze_text' jobs.
+    """
+    tasks = _requested_tasks(tasks)
+    if not tasks:
+        return {}
+    key = _analysis_key(text, tasks)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached
+    return _analysis_flight.do(key, lambda: _compute_analysis(text, tasks, key))
+
+async def analyze_text(text: str, tasks: list[str]) -> dict:
+    """
+    run_analysis_tasks() for the event loop: cache hits return at once,
+    misses run off the loop, and concurrent identical requests share one run.
+    """
+    tasks = _requested_tasks(tasks)
+    if not tasks:
+        return {}
+    key = _analysis_key(text, tasks)
+    cached = analysis_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def compute():
+        return await anyio.to_thread.run_sync(run_analysis_tasks, text, tasks)
+    return await _async_analysis_flight.do(key, compute)
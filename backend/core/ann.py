@@ -0,0 +1,243 @@
+# backend/core/ann.py
+"""
+Pure-NumPy inverted-file (IVF) index for corpus-wide nearest-neighbour search.
+
+Vectors are expected to be L2-normalised (see store.normalize_rows), so the
+inner product is the cosine similarity. A spherical k-means coarse quantizer
+splits the corpus into 'nlist' cells; a query only scans the 'nprobe' cells
+whose centroids are closest to it. Below 'exact_threshold' vectors the index
+isn't trained at all and every search is an exact scan.
+
+Every vector is tagged with (document key, chunk index) so results can be
+mapped back to chunks, and documents can be added or removed incrementally.
+
+The inverted lists hold int8 codes (core/quantize.py), a quarter of the
+float32 size. The probed lists are scored approximately and the best
+top_k * rescore_factor candidates are rescored exactly against the
+documents' own matrices, which the index only references (for the corpus
+index, the memory-mapped files of the store).
+"""
+import threading
+
+import numpy as np
+
+from . import quantize
+
+def _kmeans(data: np.ndarray, k: int, iterations: int = 12, seed: int = 0) -> np.ndarray:
+    """Spherical k-means (cosine) seeded from random points. Returns unit centroids."""
+    rng = np.random.default_rng(seed)
+    n = data.shape[0]
+    centroids = data[rng.choice(n, k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assignment = np.argmax(data @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=k)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(data[order], starts[filled])
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # Re-seed empty cells with random points so no list is wasted.
+        sums[empty] = data[rng.integers(n, size=int(empty.sum()))]
+        norms[empty] = 1.0
+        centroids = (sums / norms).astype(np.float32)
+    return centroids
+
+class IVFIndex:
+    """
+    Args:
+        nlist: Number of coarse cells. 0 picks ~4*sqrt(N) when training.
+        nprobe: Default number of cells scanned per query.
+        exact_threshold: Below this many vectors, search is always exact.
+        rescore_factor: Candidates rescored exactly per result.
+    """
+
+    def __init__(self, nlist: int = 0, nprobe: int = 8, exact_threshold: int = 20000, rescore_factor: int = 4):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.rescore_factor = rescore_factor
+        self._lock = threading.RLock()
+        # doc key -> (version, matrix); the source of truth for exact search and retraining.
+        self._docs = {}
+        self._doc_slots = {}
+        self._slot_docs = {}
+        self._next_slot = 0
+        self._centroids = None
+        self._list_codes = []
+        self._list_refs = []
+        self._trained_size = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(matrix.shape[0] for _, matrix in self._docs.values())
+
+    @property
+    def is_trained(self) -> bool:
+        return self._centroids is not None
+
+    def versions(self) -> dict:
+        """Returns {doc key: version} of every indexed document."""
+        with self._lock:
+            return {doc: version for doc, (version, _) in self._docs.items()}
+
+    def add(self, doc: str, matrix: np.ndarray, version: int = 0) -> None:
+        """Adds (or replaces) all chunk vectors of one document."""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        with self._lock:
+            if doc in self._docs:
+                self.remove(doc)
+            slot = self._next_slot
+            self._next_slot += 1
+            self._doc_slots[doc] = slot
+            self._slot_docs[slot] = doc
+            self._docs[doc] = (version, matrix)
+
+            if self.is_trained:
+                self._assign(slot, matrix)
+            if self._needs_training():
+                self.train()
+
+    def remove(self, doc: str) -> None:
+        with self._lock:
+            if doc not in self._docs:
+                return
+            del self._docs[doc]
+            slot = self._doc_slots.pop(doc)
+            del self._slot_docs[slot]
+            if self.is_trained:
+                for i, refs in enumerate(self._list_refs):
+                    keep = refs[:, 0] != slot
+                    if not keep.all():
+                        self._list_refs[i] = refs[keep]
+                        self._list_codes[i] = self._list_codes[i].take(keep)
+
+    def _needs_training(self) -> bool:
+        size = len(self)
+        if size < self.exact_threshold:
+            return False
+        # Retrain once the corpus has grown well past what the cells were fitted on.
+        return not self.is_trained or size > 4 * self._trained_size
+
+    def train(self, seed: int = 0) -> None:
+        """Fits the coarse quantizer on the current corpus and rebuilds the inverted lists."""
+        with self._lock:
+            size = len(self)
+            if size == 0:
+                return
+            nlist = self.nlist or max(1, int(4 * np.sqrt(size)))
+            nlist = min(nlist, size)
+            matrices = [matrix for _, matrix in self._docs.values()]
+            rng = np.random.default_rng(seed)
+            sample_size = min(size, 64 * nlist)
+            # Only the sample is copied together; the documents are encoded one at a time.
+            if sample_size < size:
+                offsets = np.cumsum([0] + [matrix.shape[0] for matrix in matrices])
+                picked = np.sort(rng.choice(size, sample_size, replace=False))
+                owners = np.searchsorted(offsets, picked, side="right") - 1
+                sample = np.concatenate([
+                    matrices[i][picked[owners == i] - offsets[i]] for i in np.unique(owners)
+                ])
+            else:
+                sample = np.concatenate(matrices)
+
+            self._centroids = _kmeans(np.asarray(sample, dtype=np.float32), nlist, seed=seed)
+            refs = np.concatenate([
+                np.stack([np.full(matrix.shape[0], self._doc_slots[doc]), np.arange(matrix.shape[0])], axis=1)
+                for doc, (_, matrix) in self._docs.items()
+            ])
+            cells = np.concatenate([self._cells(matrix) for matrix in matrices])
+            codes = quantize.QuantizedMatrix.concatenate([
+                quantize.QuantizedMatrix.from_float(matrix, "int8") for matrix in matrices
+            ])
+            order = np.argsort(cells, kind="stable")
+            bounds = np.searchsorted(cells[order], np.arange(nlist + 1))
+            self._list_codes = [codes.take(order[bounds[c]:bounds[c + 1]]) for c in range(nlist)]
+            self._list_refs = [refs[order[bounds[c]:bounds[c + 1]]] for c in range(nlist)]
+            self._trained_size = size
+
+    def _cells(self, matrix: np.ndarray) -> np.ndarray:
+        # Nearest centroid of every row, a block of rows at a time.
+        cells = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], 8192):
+            cells[start:start + 8192] = np.argmax(matrix[start:start + 8192] @ self._centroids.T, axis=1)
+        return cells
+
+    def _assign(self, slot: int, matrix: np.ndarray) -> None:
+        if matrix.shape[0] == 0:
+            return
+        cells = self._cells(matrix)
+        codes = quantize.QuantizedMatrix.from_float(matrix, "int8")
+        refs = np.stack([np.full(len(cells), slot), np.arange(len(cells))], axis=1)
+        for cell in np.unique(cells):
+            mask = cells == cell
+            self._list_codes[cell] = quantize.QuantizedMatrix.concatenate([self._list_codes[cell], codes.take(mask)])
+            self._list_refs[cell] = np.concatenate([self._list_refs[cell], refs[mask]])
+
+    def search(self, query: np.ndarray, top_k: int = 10, nprobe: int | None = None, exact: bool = False) -> list[tuple[str, int, float]]:
+        """
+        Returns up to top_k (doc key, chunk index, score) tuples, best first.
+
+        Args:
+            query: A unit-length query vector.
+            nprobe: Cells to scan; more means better recall and slower queries.
+            exact: Force a brute-force scan over every vector.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if exact or not self.is_trained or len(self) < self.exact_threshold:
+                return self._search_exact(query, top_k)
+
+            nprobe = max(1, min(nprobe or self.nprobe, len(self._list_codes)))
+            cells = np.argpartition(self._centroids @ query, -nprobe)[-nprobe:]
+            # Score each probed list in place rather than copying them together.
+            approximate = np.concatenate([self._list_codes[c].scores(query) for c in cells])
+            refs = np.concatenate([self._list_refs[c] for c in cells])
+            slot_docs = dict(self._slot_docs)
+            docs = dict(self._docs)
+
+        if len(refs) == 0:
+            return []
+        candidates = refs[top_k_indices(approximate, top_k * self.rescore_factor)]
+        scores = np.empty(len(candidates), dtype=np.float32)
+        for slot in np.unique(candidates[:, 0]):
+            mask = candidates[:, 0] == slot
+            rows = candidates[mask, 1]
+            _, matrix = docs[slot_docs[int(slot)]]
+            scores[mask] = matrix[rows] @ query
+        best = top_k_indices(scores, top_k)
+        return [(slot_docs[int(candidates[i, 0])], int(candidates[i, 1]), float(scores[i])) for i in best]
+
+    def _search_exact(self, query: np.ndarray, top_k: int) -> list[tuple[str, int, float]]:
+        hits = []
+        for doc, (_, matrix) in self._docs.items():
+            if matrix.shape[0] == 0:
+                continue
+            scores = matrix @ query
+            for i in top_k_indices(scores, top_k):
+                hits.append((doc, int(i), float(scores[i])))
+        hits.sort(key=lambda hit: hit[2], reverse=True)
+        return hits[:top_k]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "documents": len(self._docs),
+                "vectors": len(self),
+                "trained": self.is_trained,
+                "nlist": len(self._list_codes),
+                "list_bytes": sum(codes.nbytes + refs.nbytes for codes, refs in zip(self._list_codes, self._list_refs)),
+                "nprobe": self.nprobe,
+                "exact_threshold": self.exact_threshold,
+            }
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the top_k highest scores, best first (none if top_k <= 0)."""
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k >= len(scores):
+        return np.argsort(scores)[::-1]
+    candidates = np.argpartition(scores, -top_k)[-top_k:]
+    return candidates[np.argsort(scores[candidates])[::-1]]
@@ -0,0 +1,183 @@
+# backend/core/batching.py
+"""
+Micro-batching query encoder.
+
+Searches used to call model.encode([query]) one query at a time, which
+under concurrent load means many batch-of-1 forward passes. Here every
+model gets one background thread that collects the queries arriving within
+a short window (up to a maximum batch size) and encodes them in a single
+call. Encoded queries also go into an LRU cache, so repeated and popular
+queries never reach the model.
+
+Embeddings are returned L2-normalised, like the stored chunk matrices.
+
+encode_bucketed() is the document-side counterpart: chunks are sorted by
+token length and encoded in batches sized to a token budget, so long
+chunks go in small batches, short chunks in large ones, and little time is
+spent on padding. pool_spans() turns the embeddings of a document's
+sentences into those of its chunks, so a document is encoded only once.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from .cache import LRUCache
+from .config import settings
+from . import metrics
+from .models import get_embedding_model
+from .tokens import token_counter
+from . import store
+
+query_cache = LRUCache(settings.query_cache_size)
+
+class QueryEncoder:
+    def __init__(self, model_name: str, window_seconds: float, max_batch_size: int):
+        self.model_name = model_name
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._pending = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"query-encoder-{model_name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, query: str) -> Future:
+        future = Future()
+        self._pending.put((query, future))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self._pending.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                # Identical queries in the same window are encoded once.
+                texts = list(dict.fromkeys(query for query, _ in batch))
+                embeddings = encode_uncached(self.model_name, texts)
+                by_text = dict(zip(texts, embeddings))
+                for query, future in batch:
+                    future.set_result(by_text[query])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+def _encoder(model_name: str) -> QueryEncoder:
+    with _encoders_lock:
+        if model_name not in _encoders:
+            _encoders[model_name] = QueryEncoder(
+                model_name, settings.query_batch_window_ms / 1000, settings.query_batch_max_size
+            )
+        return _encoders[model_name]
+
+def encode_uncached(model_name: str, queries: list[str]) -> np.ndarray:
+    """Encodes queries in one model call and caches them. Returns a (len(queries), dim) matrix."""
+    model = get_embedding_model(model_name)
+    if model is None:
+        raise ValueError(f"Model '{model_name}' could not be loaded.")
+    with metrics.timer("query_encode"):
+        embeddings = store.normalize_rows(model.encode(queries, show_progress_bar=False))
+    for query, embedding in zip(queries, embeddings):
+        query_cache.put((model_name, query), embedding)
+    return embeddings
+
+def encode_query(model_name: str, query: str) -> np.ndarray:
+    """
+    Returns the unit-length embedding of one query, from the cache or
+    through the model's micro-batcher.
+    """
+    cached = query_cache.get((model_name, query))
+    if cached is not None:
+        return cached
+    return _encoder(model_name).submit(query).result()
+
+def encode_queries(model_name: str, queries: list[str]) -> np.ndarray:
+    """
+    Returns a (len(queries), dim) matrix of unit-length query embeddings.
+    Cached queries are looked up; the rest are encoded in a single call.
+    """
+    cached = [query_cache.get((model_name, query)) for query in queries]
+    missing = list(dict.fromkeys(q for q, e in zip(queries, cached) if e is None))
+    if missing:
+        encoded = dict(zip(missing, encode_uncached(model_name, missing)))
+        cached = [e if e is not None else encoded[q] for q, e in zip(queries, cached)]
+    return np.stack(cached)
+
+def length_buckets(lengths: list[int], batch_tokens: int, max_batch_size: int) -> list[list[int]]:
+    """
+    Groups indices into batches of similar length, longest first, so that
+    len(batch) * longest length stays within 'batch_tokens'.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches, batch = [], []
+    for i in order:
+        # The first index of a batch is its longest.
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * max(lengths[batch[0]], 1) > batch_tokens):
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def encode_bucketed(model, texts: list[str], show_progress_bar: bool = False) -> np.ndarray:
+    """
+    Encodes texts in length-sorted, token-budgeted batches (see
+    settings.embed_batch_tokens). Returns the rows in the original order.
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32)
+    lengths = token_counter(model)(texts)
+    batches = length_buckets(lengths, settings.embed_batch_tokens, settings.embed_max_batch_size)
+    embeddings = None
+    for done, batch in enumerate(batches, start=1):
+        with metrics.timer("embed"):
+            encoded = np.asarray(model.encode([texts[i] for i in batch], batch_size=len(batch), show_progress_bar=False))
+        if embeddings is None:
+            embeddings = np.empty((len(texts), encoded.shape[1]), dtype=np.float32)
+        embeddings[batch] = encoded
+        if show_progress_bar:
+            print(f"Encoded batch {done}/{len(batches)} ({len(batch)} chunks of <= {lengths[batch[0]]} tokens)")
+    return embeddings
+
+def pool_spans(spans: list, embeddings: np.ndarray, pooled_spans: list) -> tuple[np.ndarray, list[int]]:
+    """
+    Embeds every [start, end] span of 'pooled_spans' (e.g. chunks) as the
+    mean of the unit-length 'embeddings' of the 'spans' (e.g. sentences,
+    sorted by start) it overlaps, weighted by the overlapping characters.
+
+    Returns:
+        (the pooled rows, L2-normalised; the indices of spans that overlap
+        nothing, whose rows are zero and must be encoded instead).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    starts = np.array([start for start, _ in spans], dtype=np.int64)
+    ends = np.array([end for _, end in spans], dtype=np.int64)
+    pooled = np.zeros((len(pooled_spans), embeddings.shape[1]), dtype=np.float32)
+    missing = []
+    for i, (start, end) in enumerate(pooled_spans):
+        lo = int(np.searchsorted(ends, start, side="right"))
+        hi = int(np.searchsorted(starts, end, side="left"))
+        weights = np.minimum(ends[lo:hi], end) - np.maximum(starts[lo:hi], start)
+        if hi <= lo or weights.max() <= 0:
+            missing.append(i)
+            continue
+        row = np.clip(weights, 0, None).astype(np.float32) @ embeddings[lo:hi]
+        pooled[i] = row / max(float(np.linalg.norm(row)), 1e-12)
+    return pooled, missing
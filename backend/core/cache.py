@@ -0,0 +1,154 @@
+# backend/core/cache.py
+"""
+Small, thread-safe caching helpers shared by the search and analysis code.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    """
+    A least-recently-used cache bounded by a total size budget.
+
+    Args:
+        max_size: The budget, in whatever unit 'sizeof' returns.
+        sizeof: Returns the size of a value. Defaults to 1 per entry, which
+            turns max_size into a plain entry count.
+    """
+
+    def __init__(self, max_size: int, sizeof=None):
+        self.max_size = max_size
+        self._sizeof = sizeof or (lambda value: 1)
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key][0]
+
+    def put(self, key, value) -> None:
+        size = self._sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._entries.pop(key)[1]
+            if size > self.max_size:
+                # Never cache something that would evict everything else.
+                return
+            self._entries[key] = (value, size)
+            self._size += size
+            while self._size > self.max_size:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+
+    def pop(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self._size -= size
+            return value
+
+    def refresh(self, key) -> None:
+        """Re-measures an entry whose value grew (or shrank) in place, evicting others if needed."""
+        with self._lock:
+            if key not in self._entries:
+                return
+            value, size = self._entries[key]
+            new_size = self._sizeof(value)
+            self._entries[key] = (value, new_size)
+            self._size += new_size - size
+            while self._size > self.max_size and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                if oldest == key:
+                    self._entries.move_to_end(key)
+                    continue
+                self._size -= self._entries.pop(oldest)[1]
+
+    def items(self) -> list:
+        """A snapshot of the (key, value) pairs, least recently used first."""
+        with self._lock:
+            return [(key, value) for key, (value, _) in self._entries.items()]
+
+    def discard(self, predicate) -> None:
+        """Drops every entry whose key matches the predicate."""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._size -= self._entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into one execution.
+
+    The first caller runs the function; everyone else arriving while it is
+    in flight waits for it and receives the same result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines: concurrent awaits of the same key on one
+    event loop share a single execution, and waiting costs no thread.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, make_coroutine):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(make_coroutine())
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        # A caller that goes away (e.g. a closed connection) doesn't cancel
+        # the others' computation.
+        return await asyncio.shield(task)
@@ -0,0 +1,208 @@
+# backend/core/config.py
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+class Settings(BaseSettings):
+    """
+    Runtime configuration for the backend.
+
+    Every field can be overridden with an environment variable prefixed with
+    'NLP_' (e.g. NLP_STORE_DIRECTORY=/data/embeddings) or from a '.env' file
+    in the backend directory.
+    """
+    model_config = SettingsConfigDict(env_prefix="NLP_", env_file=".env", extra="ignore")
+
+    # Where uploaded PDFs are written.
+    upload_directory: str = "./uploads"
+    # Uploads are copied in blocks of upload_chunk_bytes and rejected once
+    # they exceed max_upload_bytes (0 = no limit).
+    upload_chunk_bytes: int = 1024 * 1024
+    max_upload_bytes: int = 200 * 1024 * 1024
+
+    # Root of the disk-backed embedding store (see core/store.py).
+    store_directory: str = "./embeddings"
+
+    # The model whose embeddings are generated for every processed document.
+    default_embedding_model: str = "all-MiniLM-L6-v2"
+
+    # Models (core/models.py). All of them are loaded lazily, on first use.
+    spacy_model: str = "en_core_web_trf"
+    embedding_models: list[str] = ["all-MiniLM-L6-v2", "all-mpnet-base-v2"]
+    summarizer_model: str = "facebook/bart-large-cnn"
+    # Least recently used models are unloaded above this budget (0 = unlimited).
+    model_memory_budget_bytes: int = 0
+    # Models to load in the background at startup, e.g. ["spacy", "all-MiniLM-L6-v2"].
+    warmup_models: list[str] = []
+    # A model that failed to load is tried again after model_retry_base_seconds,
+    # doubling with every further failure up to model_retry_max_seconds.
+    model_retry_base_seconds: float = 30.0
+    model_retry_max_seconds: float = 900.0
+
+    # What each process keeps resident of the default model's embeddings
+    # (core/quantize.py): 'float32' (the memory-mapped matrix itself) or
+    # 'int8'. Quantized searches rescore the top
+    # top_k * rescore_factor candidates exactly against the float32 matrix.
+    embedding_storage: str = "float32"
+    rescore_factor: int = 4
+
+    # Chunking (core/processor.py): 'tokens' packs sentences up to
+    # chunk_max_tokens tokens of the embedding model (0 = the model's own
+    # max_seq_length), repeating up to chunk_overlap_tokens between chunks;
+    # 'sentences' groups a fixed number of sentences.
+    chunking: str = "tokens"
+    chunk_max_tokens: int = 0
+    chunk_overlap_tokens: int = 0
+
+    # Embedding batches (core/batching.py): chunks are sorted by length and
+    # batched so that batch size * longest chunk stays within
+    # embed_batch_tokens, with at most embed_max_batch_size chunks per batch.
+    embed_batch_tokens: int = 8192
+    embed_max_batch_size: int = 128
+
+    # Every sentence of a document is encoded once at /process and stored;
+    # the extractive summary and KeyBERT reuse those embeddings. With
+    # chunk_embeddings 'pooled', chunk embeddings are the length-weighted mean
+    # of their sentences' (no second encoding pass); 'encoded' encodes the
+    # chunk text itself, which is slower but closer to what queries are
+    # matched against.
+    chunk_embeddings: str = "pooled"
+
+    # Incremental reprocessing of re-uploaded PDFs. With it on, parse
+    # segments and chunks never span pages and parses are cached per
+    # segment, so only the pages whose content changed are extracted,
+    # parsed and embedded again; the rest keep their text, parse and
+    # embeddings (matched by per-page fingerprints). Summary sections are
+    # cut at content-defined sentences (one in summary_anchor_period on
+    # average) once they hold three quarters of summary_section_tokens, so
+    # sections after an edit line up with the previous ones and hit the
+    # summary cache. KeyBERT candidate embeddings are cached per document.
+    incremental_reprocessing: bool = True
+    summary_anchor_period: int = 8
+    phrase_cache_directory: str = "./cache/phrases"
+
+    # Memory budget of the per-process cache of loaded documents (their
+    # resident embeddings, chunk texts and BM25 index) and of the other
+    # models' embeddings.
+    embedding_cache_bytes: int = 512 * 1024 * 1024
+
+    # Extra models whose embeddings /process computes in the background, so
+    # the first search with them doesn't pay for encoding the whole document.
+    prewarm_models: list[str] = []
+
+    # Two-stage search (mode=rerank): how many candidates the default model
+    # recalls, and which model rescores them. The reranker can be any loaded
+    # embedding model or one of the cross-encoders listed below.
+    rerank_candidates: int = 50
+    rerank_model: str = "all-mpnet-base-v2"
+    cross_encoder_models: list[str] = ["cross-encoder/ms-marco-MiniLM-L-6-v2"]
+
+    # Hybrid search (mode=hybrid): BM25 and dense scores are fused with
+    # reciprocal rank fusion ('rrf', constant hybrid_rrf_k) or a weighted sum
+    # of min-max normalised scores ('weighted', hybrid_alpha = dense weight),
+    # over the top hybrid_depth chunks of each ranking. In documents with at
+    # least hybrid_prune_min_chunks chunks, only the top
+    # hybrid_lexical_candidates BM25 chunks are scored densely.
+    hybrid_fusion: str = "rrf"
+    hybrid_alpha: float = 0.5
+    hybrid_rrf_k: int = 60
+    hybrid_depth: int = 100
+    hybrid_prune_min_chunks: int = 20000
+    hybrid_lexical_candidates: int = 2000
+
+    # Corpus-wide search (/search). Below corpus_exact_threshold vectors the
+    # search is a brute-force scan; above it, an IVF index with corpus_nlist
+    # cells (0 = ~4*sqrt(N)) of which corpus_nprobe are scanned per query.
+    corpus_nlist: int = 0
+    corpus_nprobe: int = 8
+    corpus_exact_threshold: int = 20000
+    corpus_sync_interval: float = 2.0
+
+    # How many documents /process ingests (parse, chunk, embed, analyze) at
+    # the same time. Further requests queue instead of oversubscribing the CPU.
+    ingest_concurrency: int = 2
+
+    # Durable job queue (core/jobs.py). The API starts 'job_workers' worker
+    # processes itself; set it to 0 and run 'python job_worker.py --workers N'
+    # to scale them separately.
+    job_workers: int = 1
+    job_poll_interval: float = 1.0
+    job_lease_seconds: int = 60
+    job_max_attempts: int = 3
+    job_retry_base_seconds: float = 5.0
+    job_retry_max_seconds: float = 300.0
+
+    # spaCy parsing (core/parsing.py): texts are parsed in segments of at most
+    # parse_segment_chars through nlp.pipe, and the parsed segments are
+    # cached so the ingest pipeline and the analysis worker share one parse.
+    parse_segment_chars: int = 100000
+    parse_batch_size: int = 4
+    parse_cache_directory: str = "./cache/parses"
+
+    # PDF extraction (core/parser.py): PDFs with at least pdf_parallel_min_pages
+    # pages (0 = never) are extracted by a pool of pdf_extract_workers
+    # processes (0 = one per CPU). Extracted text is cached per upload.
+    pdf_parallel_min_pages: int = 200
+    pdf_extract_workers: int = 0
+    text_cache_directory: str = "./cache/text"
+
+    # Abstractive summaries (core/summarize.py): the text is split into
+    # sections of at most summary_section_tokens summarizer tokens, which are
+    # summarized summary_batch_size at a time and then reduced recursively
+    # (at most summary_max_levels times). Section summaries are cached.
+    # After summary_time_budget_seconds (0 = no limit) the sections left are
+    # represented by their opening sentences.
+    summary_section_tokens: int = 900
+    summary_section_max_length: int = 150
+    summary_section_min_length: int = 40
+    summary_batch_size: int = 4
+    summary_max_levels: int = 4
+    summary_time_budget_seconds: float = 600.0
+    summary_interactive_time_budget_seconds: float = 30.0
+    summary_cache_directory: str = "./cache/summaries"
+
+    # Query encoding (core/batching.py): queries arriving within the window
+    # are encoded together, up to the batch size; encoded queries are cached.
+    query_batch_window_ms: float = 5.0
+    query_batch_max_size: int = 32
+    query_cache_size: int = 10000
+
+    # Interactive analyses (/analyze/): results are cached for the last
+    # analysis_cache_size (text, tasks, models) combinations, and the tasks of
+    # one request run concurrently on analysis_workers threads.
+    analysis_cache_size: int = 256
+    analysis_workers: int = 3
+
+    # Document status (core/status.py): long-polls and event streams check
+    # for changes every status_poll_interval seconds, for at most
+    # status_max_wait_seconds. Analysis results are also stored gzip-compressed
+    # when compress_results is set.
+    status_poll_interval: float = 0.5
+    status_max_wait_seconds: float = 60.0
+    compress_results: bool = True
+
+    # Instrumentation (core/metrics.py): requests sending 'X-Trace: 1' (or
+    # every request, with trace_all_requests) get a Server-Timing header with
+    # their stage breakdown. profile_interval_ms > 0 starts a sampling
+    # profiler of the timed stages (GET /metrics/profile).
+    trace_all_requests: bool = False
+    profile_interval_ms: float = 0.0
+
+    # CPU inference (core/inference.py). With inference_mode 'int8', the
+    # linear layers of the model kinds in int8_model_kinds are dynamically
+    # quantized. Unless int8_validate is off, a quantized model must agree
+    # with the float one on a probe set (embedding cosine, top-k neighbour
+    # overlap, summary word F1) or it is served in float32. Quantized models
+    # are cached in quantized_model_directory. torch_threads (0 = one per
+    # core) is each API process's intra-op thread count and
+    # job_worker_torch_threads each job worker's (0 = torch_threads).
+    inference_mode: str = "float32"
+    int8_model_kinds: list[str] = ["embedding", "cross_encoder", "summarizer"]
+    int8_validate: bool = True
+    int8_min_cosine: float = 0.97
+    int8_min_overlap: float = 0.8
+    int8_min_summary_overlap: float = 0.6
+    quantized_model_directory: str = "./cache/models"
+    torch_threads: int = 0
+    torch_interop_threads: int = 0
+    job_worker_torch_threads: int = 0
+
+settings = Settings()
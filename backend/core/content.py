@@ -0,0 +1,54 @@
+# backend/core/content.py
+"""
+Content hashes of uploaded PDFs, and lookups of work already done for a
+given content.
+
+Every upload is hashed (SHA-256) while it is written. The hash keys the
+extracted-text cache (core/parser.py) and is recorded on the document and
+on its embedding sets (core/store.py), so a PDF that has been processed
+before, under any filename, reuses its chunks, embeddings and analysis
+report instead of running the models again.
+"""
+import hashlib
+
+from .database import SessionLocal, Document
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def new_hasher():
+    return hashlib.sha256()
+
+def hash_file(file_path: str) -> str:
+    """SHA-256 of a file, read in fixed-size blocks."""
+    hasher = new_hasher()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def find_analysis(content_hash: str | None) -> str | None:
+    """
+    Returns the stored analysis report (a JSON string) of any document with
+    this content, or None if no such report exists yet.
+    """
+    if not content_hash:
+        return None
+    db = SessionLocal()
+    try:
+        donor = db.query(Document).filter(
+            Document.content_hash == content_hash, Document.analysis_results.isnot(None)
+        ).first()
+        return donor.analysis_results if donor else None
+    finally:
+        db.close()
+
+def find_duplicate(content_hash: str, filename: str) -> str | None:
+    """The filename of another document with the same content, if any."""
+    db = SessionLocal()
+    try:
+        other = db.query(Document).filter(
+            Document.content_hash == content_hash, Document.filename != filename
+        ).first()
+        return other.filename if other else None
+    finally:
+        db.close()
@@ -1,10 +1,13 @@
 # backend/core/database.py
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, LargeBinary, Boolean, UniqueConstraint, inspect, text, event
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
+import gzip
 import json
 
+from .config import settings
+
 # Define the SQLite database URL.
 # 'sqlite:///./sql_app.db' means the database will be a file named 'sql_app.db'
 # in the current directory (which will be 'backend/').
@@ -15,6 +18,15 @@ engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
 )
 
+# The API and the job worker processes share this file, so use WAL (readers
+# don't block the writer) and wait for locks instead of failing immediately.
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=10000")
+    cursor.close()
+
 # Each instance of SessionLocal will be a database session.
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -27,14 +39,138 @@ class Document(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     filename = Column(String, unique=True, index=True)
+    # (uploaded ->) queued -> parsed -> chunked -> embedded -> analyzing -> complete
+    # (or failed; or cancelled, before 'complete')
     status = Column(String, default="processing")
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Id of the latest ingest job, returned by /process.
+    job_id = Column(String, nullable=True, index=True)
+    # SHA-256 of the uploaded PDF. Documents with the same content share
+    # their embeddings and analysis results.
+    content_hash = Column(String, nullable=True, index=True)
 
     # We will store the complex analysis results as a JSON string in a Text column.
     analysis_results = Column(Text, nullable=True)
+    # The same JSON, gzip-compressed, so /document/{filename}/results can
+    # send it as stored (settings.compress_results).
+    analysis_results_gzip = Column(LargeBinary, nullable=True)
+    # Bumped whenever the status, job or results change; status responses
+    # carry it as their ETag (see core/status.py).
+    version = Column(Integer, default=1)
+    # Last status change, or heartbeat of the process running the ingest
+    # job; ingest jobs not heard from for a lease are recovered elsewhere
+    # (see core/pipeline.py).
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# Columns whose changes clients polling the status should see.
+_VERSIONED_COLUMNS = ("status", "job_id", "analysis_results")
+
+@event.listens_for(Document, "before_insert")
+@event.listens_for(Document, "before_update")
+def _track_document_changes(mapper, connection, target):
+    state = inspect(target)
+    changed = [name for name in _VERSIONED_COLUMNS if state.attrs[name].history.has_changes()]
+    if not changed:
+        return
+    target.updated_at = datetime.utcnow()
+    if state.has_identity:
+        target.version = (target.version or 0) + 1
+    if "analysis_results" in changed:
+        results = target.analysis_results
+        target.analysis_results_gzip = (
+            gzip.compress(results.encode("utf-8"), compresslevel=6) if results and settings.compress_results else None
+        )
+
+# --- Manifest of the disk-backed embedding store (see core/store.py) ---
+class EmbeddingSet(Base):
+    __tablename__ = "embedding_sets"
+    __table_args__ = (UniqueConstraint("doc_id", "model_name"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    doc_id = Column(String, index=True)
+    model_name = Column(String)
+    # Paths are relative to settings.store_directory.
+    matrix_path = Column(String)
+    chunks_path = Column(String)
+    # Sentence embeddings of the text, stored with the default model's set only.
+    sentences_path = Column(String, nullable=True)
+    rows = Column(Integer)
+    dim = Column(Integer)
+    # Bumped every time the document is re-embedded, so other processes can
+    # tell that their memory-mapped copy is stale.
+    version = Column(Integer, default=1)
+    # SHA-256 of the PDF the chunks came from (see Document.content_hash).
+    content_hash = Column(String, nullable=True, index=True)
+    # Set when the document was re-uploaded with other content: the set is
+    # no longer searched, but kept until the new version replaces it (which
+    # reuses its unchanged pages).
+    stale = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+# --- Durable job queue (see core/jobs.py) ---
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String, primary_key=True)
+    kind = Column(String, index=True)
+    payload = Column(Text)
+    # Higher runs first.
+    priority = Column(Integer, default=0, index=True)
+    # queued -> running -> succeeded | failed | cancelled
+    status = Column(String, default="queued", index=True)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+def update_document_status(doc_id: int, status: str, job_id: str | None = None, statuses=None, **fields) -> bool:
+    """
+    Sets a document's status (and any other columns) in its own short session,
+    so pipeline stages running in worker threads can report progress.
+
+    If 'job_id' is given, the update is skipped (and False returned) when the
+    document has been re-queued under a newer job in the meantime; if
+    'statuses' is given, also when its status is not one of them (e.g. the
+    job was cancelled).
+    """
+    db = SessionLocal()
+    try:
+        db_document = db.query(Document).filter(Document.id == doc_id).first()
+        if db_document is None or (job_id is not None and db_document.job_id != job_id):
+            return False
+        if statuses is not None and db_document.status not in statuses:
+            return False
+        db_document.status = status
+        db_document.updated_at = datetime.utcnow()
+        for name, value in fields.items():
+            setattr(db_document, name, value)
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def _add_missing_columns():
+    # create_all() never alters existing tables, so columns added to the
+    # models after a database file was created are added here.
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'))
 
 def create_db_and_tables():
     # This function creates the database file and the 'documents' table
     # if they don't already exist.
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
     print("Database and tables created successfully (if they didn't exist).")
\ No newline at end of file
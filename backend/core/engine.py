@@ -0,0 +1,159 @@
+# backend/core/engine.py
+"""
+Analysis engine: runs a set of analysis tasks over a single shared parse.
+
+Every task declares the parse capabilities it needs (see core/parsing.py)
+and the tasks it depends on. run_analysis() resolves the dependency graph,
+enables only the spaCy components the requested tasks actually need,
+parses the text once and feeds the result to every task.
+"""
+import contextvars
+
+from .config import settings
+from .parsing import parse_text
+from . import metrics
+
+class Task:
+    def __init__(self, name: str, run, needs=(), depends=()):
+        self.name = name
+        self.run = run
+        # Parse capabilities this task reads ('sentences', 'ner', 'textrank').
+        self.needs = tuple(needs)
+        # Other tasks whose results this task reads.
+        self.depends = tuple(depends)
+
+    def timed_run(self, ctx):
+        with metrics.timer(self.name):
+            return self.run(ctx)
+
+TASKS = {}
+
+def task(name: str, needs=(), depends=()):
+    def register(run):
+        TASKS[name] = Task(name, run, needs, depends)
+        return run
+    return register
+
+class AnalysisContext:
+    def __init__(self, text: str, parsed, options: dict):
+        self.text = text
+        self.parsed = parsed
+        self.options = options
+        self.results = {}
+
+# --- Task definitions ---
+# The analysis functions are imported lazily so this module can be imported
+# by core/analysis.py and core/processor.py without a cycle.
+
+@task("sentences", needs=("sentences",))
+def _sentences(ctx):
+    return ctx.parsed.sentences() if ctx.parsed else []
+
+@task("chunk_spans", depends=("sentences",))
+def _chunk_spans(ctx):
+    from .processor import chunk_bounds
+    return chunk_bounds(ctx.results["sentences"], ctx.options)
+
+@task("chunks", depends=("chunk_spans",))
+def _chunks(ctx):
+    # The text is cleaned (single spaces), so a span reads like the joined sentences.
+    return [ctx.text[start:end] for start, end in ctx.results["chunk_spans"]]
+
+@task("ner", needs=("ner",))
+def _ner(ctx):
+    from .analysis import extract_entities
+    return extract_entities(ctx.text, parsed=ctx.parsed)
+
+@task("keywords", needs=("textrank",))
+def _keywords(ctx):
+    from .analysis import extract_keywords
+    return extract_keywords(ctx.text, parsed=ctx.parsed)
+
+@task("summary", needs=("textrank",))
+def _summary(ctx):
+    from .analysis import generate_summary
+    return generate_summary(ctx.text, parsed=ctx.parsed)
+
+@task("semantic_summary", depends=("sentences",))
+def _semantic_summary(ctx):
+    from .analysis import generate_semantic_extractive_summary
+    return generate_semantic_extractive_summary(
+        ctx.text, num_sentences=ctx.options.get("num_sentences", 7), parsed=ctx.parsed,
+        sentence_embeddings=ctx.options.get("sentence_embeddings"),
+    )
+
+def resolve(tasks) -> list[str]:
+    """Returns the requested tasks plus their dependencies, in dependency order."""
+    ordered = []
+    def visit(name, path=()):
+        if name in ordered:
+            return
+        if name not in TASKS:
+            raise ValueError(f"Unknown analysis task '{name}'.")
+        if name in path:
+            raise ValueError(f"Cyclic analysis task dependency: {' -> '.join(path + (name,))}")
+        for dependency in TASKS[name].depends:
+            visit(dependency, path + (name,))
+        ordered.append(name)
+    for name in tasks:
+        visit(name)
+    return ordered
+
+def required_capabilities(tasks) -> set[str]:
+    return {need for name in resolve(tasks) for need in TASKS[name].needs}
+
+def run_analysis(
+    text: str, tasks, options: dict | None = None, cache: bool = False, parse_for=None, executor=None,
+    page_starts: list | None = None,
+) -> dict:
+    """
+    Runs the requested tasks over one parse of 'text'.
+
+    Args:
+        tasks: Task names, e.g. ["ner", "keywords", "summary"].
+        options: Task options (chunk_size_sentences, max_tokens, num_sentences, ...).
+        cache: Use the on-disk parse cache (for whole documents).
+        parse_for: Extra tasks to parse for (and cache) now, so that a later
+            run_analysis() of those tasks on the same text skips the parse.
+        executor: A concurrent.futures executor to run the tasks on. Tasks
+            whose dependencies are done run concurrently, sharing the parse.
+        page_starts: The page offsets of a document. With
+            settings.incremental_reprocessing, neither parse segments nor
+            chunks span pages, so unchanged pages reuse their cached parse.
+
+    Returns:
+        {task name: result} for the requested tasks only.
+    """
+    order = resolve(tasks)
+    capabilities = required_capabilities(tasks)
+    cache_capabilities = capabilities | required_capabilities(parse_for) if parse_for else None
+
+    options = dict(options or {})
+    if page_starts and settings.incremental_reprocessing:
+        options["page_starts"] = page_starts
+    else:
+        page_starts = None
+
+    parsed = None
+    if capabilities or cache_capabilities:
+        parsed = parse_text(
+            text, capabilities, cache=cache, cache_capabilities=cache_capabilities, boundaries=page_starts,
+        )
+
+    ctx = AnalysisContext(text, parsed, options)
+    if executor is None:
+        for name in order:
+            ctx.results[name] = TASKS[name].timed_run(ctx)
+    else:
+        pending = order
+        while pending:
+            ready = [name for name in pending if all(d in ctx.results for d in TASKS[name].depends)]
+            # Each task runs in a copy of this context, so it lands in the caller's trace.
+            futures = {name: executor.submit(contextvars.copy_context().run, TASKS[name].timed_run, ctx) for name in ready}
+            for name, future in futures.items():
+                ctx.results[name] = future.result()
+            pending = [name for name in pending if name not in futures]
+    return {name: ctx.results[name] for name in tasks}
+
+# The tasks of the background worker's full report that read the parse.
+DOCUMENT_REPORT_TASKS = ("ner", "keywords", "semantic_summary")
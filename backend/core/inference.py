@@ -0,0 +1,228 @@
+# backend/core/inference.py
+"""
+CPU inference settings and int8 dynamic quantization of the torch models.
+
+With settings.inference_mode == "int8", the loaders in core/models.py pass
+the embedding models, cross-encoders and the summarizer (whichever kinds
+are listed in settings.int8_model_kinds) through load_quantized(): every
+nn.Linear is replaced by a dynamically quantized int8 one (weights stored
+as int8, activations quantized on the fly), which is typically 2-4x faster
+on CPU and much smaller.
+
+When a model is quantized, its outputs are checked against the float
+model's on a fixed probe set (embedding cosine agreement and top-k
+neighbour overlap, score rank agreement, or summary word overlap). A model
+below the thresholds is rejected and served in float32. The quantized
+model (or the rejection) is cached on disk, together with the validation
+report, so later startups skip both the float load and the quantization.
+The cache is keyed on the validation settings too: turning validation on
+or changing a threshold validates the model again.
+
+The cache holds pickled torch modules (torch.load(weights_only=False)):
+only point settings.quantized_model_directory at a directory this service
+owns.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from .config import settings
+
+PROBE_SENTENCES = [
+    "The contract may be terminated by either party with thirty days written notice.",
+    "Payment is due within 45 days of the invoice date.",
+    "The supplier warrants that the goods are free from defects for one year.",
+    "Patients in the treatment arm received a daily dose of 20 mg.",
+    "The primary outcome was the change in blood pressure after twelve weeks.",
+    "Adverse events were reported in 12 percent of the cohort.",
+    "Quarterly revenue grew by 8 percent driven by the enterprise segment.",
+    "Operating margin declined due to higher logistics costs.",
+    "The company expects growth to slow in the second half of the year.",
+    "The cache stores recently used query embeddings in memory.",
+    "Requests are routed to the least loaded worker process.",
+    "The index is rebuilt whenever a document is reprocessed.",
+    "Heavy rain caused flooding in several coastal towns.",
+    "The museum reopened after a two year renovation.",
+    "The team won the championship in the final minute.",
+    "Photosynthesis converts light energy into chemical energy.",
+]
+
+PROBE_DOCUMENT = " ".join(PROBE_SENTENCES[:9])
+
+_torch_lock = threading.Lock()
+_torch_configured = False
+
+def configure_torch(threads: int | None = None) -> None:
+    """
+    Sets torch's intra-op (and inter-op) thread counts for this process,
+    once: 'threads' or settings.torch_threads (0 = torch's default, one per
+    core). Processes sharing a node should split the cores between them.
+    """
+    global _torch_configured
+    with _torch_lock:
+        if _torch_configured:
+            return
+        _torch_configured = True
+        threads = settings.torch_threads if threads is None else threads
+        if not threads and not settings.torch_interop_threads:
+            return
+        import torch
+        if threads:
+            torch.set_num_threads(threads)
+        if settings.torch_interop_threads:
+            try:
+                torch.set_num_interop_threads(settings.torch_interop_threads)
+            except RuntimeError as e:
+                # Only possible before torch has started any parallel work.
+                print(f"Could not set torch inter-op threads: {e}")
+        print(f"torch uses {torch.get_num_threads()} intra-op threads in this process.")
+
+def wants_int8(kind: str) -> bool:
+    """Whether models of this kind ('embedding', 'cross_encoder', 'summarizer') are served in int8."""
+    return settings.inference_mode == "int8" and kind in settings.int8_model_kinds
+
+def mode_tag(kind: str) -> str:
+    """'int8' or 'float32': how models of this kind currently compute, for keying what they produce."""
+    return "int8" if wants_int8(kind) else "float32"
+
+def quantize_linear(module):
+    """A copy of a torch module with every nn.Linear dynamically quantized to int8."""
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+def has_float_linear(module) -> bool:
+    """Whether a torch module still holds float nn.Linear layers (i.e. wasn't quantized in place)."""
+    import torch
+    return any(
+        isinstance(m, torch.nn.Linear) and m.weight.dtype.is_floating_point for m in module.modules()
+    )
+
+# --- Validation against the float model ---
+
+def _unit(rows) -> np.ndarray:
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.maximum(np.linalg.norm(rows, axis=1, keepdims=True), 1e-12)
+
+def embedding_agreement(float_model, quantized_model, k: int = 3) -> dict:
+    """
+    Mean cosine between the float and int8 embeddings of the probe
+    sentences, and the mean overlap of each probe's top-k neighbours.
+    """
+    a = _unit(float_model.encode(PROBE_SENTENCES, show_progress_bar=False))
+    b = _unit(quantized_model.encode(PROBE_SENTENCES, show_progress_bar=False))
+    cosine = float(np.mean(np.sum(a * b, axis=1)))
+
+    def neighbours(rows):
+        similarities = rows @ rows.T
+        np.fill_diagonal(similarities, -np.inf)
+        return np.argsort(-similarities, axis=1)[:, :k]
+
+    overlap = float(np.mean([len(set(x) & set(y)) / k for x, y in zip(neighbours(a), neighbours(b))]))
+    passed = cosine >= settings.int8_min_cosine and overlap >= settings.int8_min_overlap
+    return {"cosine": round(cosine, 4), f"overlap_at_{k}": round(overlap, 4), "passed": passed}
+
+def cross_encoder_agreement(float_model, quantized_model, k: int = 3) -> dict:
+    """Overlap of the top-k passages per probe query under the float and int8 scores."""
+    overlaps = []
+    for query in PROBE_SENTENCES[::4]:
+        pairs = [(query, passage) for passage in PROBE_SENTENCES]
+        a = np.argsort(-np.asarray(float_model.predict(pairs)))[:k]
+        b = np.argsort(-np.asarray(quantized_model.predict(pairs)))[:k]
+        overlaps.append(len(set(a) & set(b)) / k)
+    overlap = float(np.mean(overlaps))
+    return {f"overlap_at_{k}": round(overlap, 4), "passed": overlap >= settings.int8_min_overlap}
+
+def summary_agreement(float_pipeline, quantized_pipeline) -> dict:
+    """Word-level F1 between the float and int8 summaries of the probe document."""
+    arguments = {"max_length": 60, "min_length": 20, "do_sample": False, "truncation": True}
+    a = float_pipeline(PROBE_DOCUMENT, **arguments)[0]["summary_text"].lower().split()
+    b = quantized_pipeline(PROBE_DOCUMENT, **arguments)[0]["summary_text"].lower().split()
+    common = sum(min(a.count(word), b.count(word)) for word in set(a))
+    f1 = 2 * common / max(len(a) + len(b), 1)
+    return {"word_f1": round(f1, 4), "passed": f1 >= settings.int8_min_summary_overlap}
+
+# --- On-disk cache ---
+
+def _validation_key() -> str:
+    if not settings.int8_validate:
+        return "unvalidated"
+    return (
+        f"cosine>={settings.int8_min_cosine}|overlap>={settings.int8_min_overlap}"
+        f"|summary>={settings.int8_min_summary_overlap}"
+    )
+
+def _cache_paths(name: str) -> tuple[str, str]:
+    import torch
+    key = f"{name}|int8-dynamic-linear|torch {torch.__version__}|{_validation_key()}"
+    slug = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    base = os.path.join(settings.quantized_model_directory, f"{slug}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}")
+    return base + ".pt", base + ".json"
+
+def _read_report(report_path: str) -> dict | None:
+    try:
+        with open(report_path, "rb") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+
+def _write_cache(model_path: str, report_path: str, cached, report: dict) -> None:
+    import torch
+    try:
+        os.makedirs(settings.quantized_model_directory, exist_ok=True)
+        if cached is not None:
+            tmp_path = f"{model_path}.tmp{os.getpid()}"
+            torch.save(cached, tmp_path)
+            os.replace(tmp_path, model_path)
+        tmp_path = f"{report_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(report, f)
+        os.replace(tmp_path, report_path)
+    except Exception as e:
+        print(f"Could not cache the int8 model: {e}")
+
+def load_quantized(name: str, load_float, quantize, agreement, to_cache=None, from_cache=None):
+    """
+    Returns the int8 version of a model, or the float model if int8 failed
+    validation.
+
+    Args:
+        name: Cache key of the model (e.g. the model name).
+        load_float: Loads the float model.
+        quantize: Returns the int8 copy of a float model.
+        agreement: (float model, int8 model) -> validation report with a
+            'passed' flag.
+        to_cache, from_cache: Turn the int8 model into the object pickled
+            on disk and back (default: the model itself).
+    """
+    to_cache = to_cache or (lambda model: model)
+    from_cache = from_cache or (lambda cached: cached)
+    model_path, report_path = _cache_paths(name)
+
+    report = _read_report(report_path)
+    if report is not None and settings.int8_validate and not report.get("validated", True):
+        report = None
+    if report is not None:
+        if not report.get("passed"):
+            print(f"int8 '{name}' failed validation earlier ({report}); using float32.")
+            return load_float()
+        try:
+            import torch
+            model = from_cache(torch.load(model_path, weights_only=False))
+            print(f"Loaded int8 '{name}' from {model_path} (validation: {report}).")
+            return model
+        except Exception as e:
+            print(f"Could not load the cached int8 '{name}', quantizing again: {e}")
+
+    float_model = load_float()
+    quantized = quantize(float_model)
+    report = agreement(float_model, quantized) if settings.int8_validate else {"passed": True, "validated": False}
+    if not report["passed"]:
+        print(f"int8 '{name}' disagrees with float32 ({report}); using float32.")
+        _write_cache(model_path, report_path, None, report)
+        return float_model
+    print(f"Quantized '{name}' to int8 (validation: {report}).")
+    _write_cache(model_path, report_path, to_cache(quantized), report)
+    return quantized
@@ -0,0 +1,231 @@
+# backend/core/jobs.py
+"""
+Durable, SQLite-backed job queue.
+
+Jobs survive restarts of both the API and the workers. A worker claims a
+job by taking a time-limited lease on it and keeps extending the lease
+with heartbeats while it runs; if a worker dies, its lease expires and
+another worker picks the job up again. Failed jobs are retried with
+exponential backoff until 'max_attempts' is reached. Higher 'priority'
+jobs are claimed first, so interactive work overtakes bulk reports.
+
+The worker processes themselves live in job_worker.py.
+"""
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_, func
+
+from .config import settings
+from .database import SessionLocal, Job
+
+PRIORITY_BULK = 0
+PRIORITY_INTERACTIVE = 10
+
+ACTIVE_STATUSES = ("queued", "running")
+
+class JobCancelled(Exception):
+    """Raised inside a job handler when the job was cancelled (or its lease lost)."""
+
+def enqueue(kind: str, payload: dict, priority: int = PRIORITY_BULK, max_attempts: int | None = None) -> str:
+    """Adds a job to the queue and returns its id."""
+    db = SessionLocal()
+    try:
+        job = Job(
+            id=uuid.uuid4().hex, kind=kind, payload=json.dumps(payload), priority=priority,
+            status="queued", max_attempts=max_attempts or settings.job_max_attempts,
+            run_after=datetime.utcnow(),
+        )
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+def enqueue_many(kind: str, payloads: list[dict], priority: int = PRIORITY_BULK) -> list[str]:
+    """Adds one job per payload in a single transaction and returns their ids."""
+    if not payloads:
+        return []
+    now = datetime.utcnow()
+    jobs = [
+        Job(
+            id=uuid.uuid4().hex, kind=kind, payload=json.dumps(payload), priority=priority,
+            status="queued", max_attempts=settings.job_max_attempts, run_after=now,
+        )
+        for payload in payloads
+    ]
+    db = SessionLocal()
+    try:
+        db.add_all(jobs)
+        db.commit()
+        return [job.id for job in jobs]
+    finally:
+        db.close()
+
+def claim(worker_id: str, kinds: list[str] | None = None) -> dict | None:
+    """
+    Leases the next runnable job to 'worker_id', or returns None.
+
+    Runnable means queued and past its backoff, or running with an expired
+    lease (its worker died). The lease is taken with a conditional UPDATE, so
+    two workers racing for the same job can't both win.
+    """
+    db = SessionLocal()
+    try:
+        # Jobs whose worker died on every attempt are given up on rather
+        # than handed to yet another worker.
+        db.query(Job).filter(
+            Job.status == "running", Job.lease_expires_at < datetime.utcnow(),
+            Job.attempts >= Job.max_attempts,
+        ).update({Job.status: "failed", Job.error: "Lease expired on the final attempt."}, synchronize_session=False)
+        db.commit()
+
+        for _ in range(5):
+            now = datetime.utcnow()
+            query = db.query(Job.id).filter(or_(
+                and_(Job.status == "queued", Job.run_after <= now),
+                and_(Job.status == "running", Job.lease_expires_at < now),
+            ))
+            if kinds:
+                query = query.filter(Job.kind.in_(kinds))
+            candidate = query.order_by(Job.priority.desc(), Job.created_at).first()
+            if candidate is None:
+                return None
+
+            won = db.query(Job).filter(
+                Job.id == candidate.id,
+                or_(
+                    and_(Job.status == "queued", Job.run_after <= now),
+                    and_(Job.status == "running", Job.lease_expires_at < now),
+                ),
+            ).update({
+                Job.status: "running",
+                Job.lease_owner: worker_id,
+                Job.lease_expires_at: now + timedelta(seconds=settings.job_lease_seconds),
+                Job.attempts: Job.attempts + 1,
+                Job.updated_at: now,
+            }, synchronize_session=False)
+            db.commit()
+            if won:
+                return _as_dict(db.query(Job).filter(Job.id == candidate.id).first())
+        return None
+    finally:
+        db.close()
+
+def heartbeat(job_id: str, worker_id: str) -> bool:
+    """
+    Extends the lease. Returns False if the job is no longer ours to run
+    (cancelled, or the lease expired and someone else took it).
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        updated = db.query(Job).filter(
+            Job.id == job_id, Job.lease_owner == worker_id, Job.status == "running"
+        ).update({
+            Job.lease_expires_at: now + timedelta(seconds=settings.job_lease_seconds),
+            Job.updated_at: now,
+        }, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+def complete(job_id: str, worker_id: str, result=None) -> bool:
+    """Marks a job succeeded. Ignored if the worker no longer holds the lease."""
+    db = SessionLocal()
+    try:
+        updated = db.query(Job).filter(
+            Job.id == job_id, Job.lease_owner == worker_id, Job.status == "running"
+        ).update({
+            Job.status: "succeeded",
+            Job.result: json.dumps(result) if result is not None else None,
+            Job.lease_expires_at: None,
+            Job.updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+def fail(job_id: str, worker_id: str, error: str) -> str | None:
+    """
+    Records a failed attempt. The job is re-queued with exponential backoff
+    unless it has used up its attempts.
+
+    Returns:
+        The job's new status ('queued' or 'failed'), or None if the worker
+        no longer held the lease.
+    """
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(
+            Job.id == job_id, Job.lease_owner == worker_id, Job.status == "running"
+        ).first()
+        if job is None:
+            return None
+        now = datetime.utcnow()
+        job.error = error
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.updated_at = now
+        if job.attempts < job.max_attempts:
+            delay = min(settings.job_retry_base_seconds * 2 ** (job.attempts - 1), settings.job_retry_max_seconds)
+            job.status = "queued"
+            job.run_after = now + timedelta(seconds=delay)
+        else:
+            job.status = "failed"
+        db.commit()
+        return job.status
+    finally:
+        db.close()
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancels a queued or running job. A running job notices at its next
+    heartbeat and stops at the next point its handler checks.
+    """
+    db = SessionLocal()
+    try:
+        updated = db.query(Job).filter(
+            Job.id == job_id, Job.status.in_(ACTIVE_STATUSES)
+        ).update({
+            Job.status: "cancelled",
+            Job.updated_at: datetime.utcnow(),
+        }, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    finally:
+        db.close()
+
+def get(job_id: str) -> dict | None:
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        return _as_dict(job) if job else None
+    finally:
+        db.close()
+
+def queue_depth() -> dict:
+    """Number of jobs per status."""
+    db = SessionLocal()
+    try:
+        return dict(db.query(Job.status, func.count(Job.id)).group_by(Job.status).all())
+    finally:
+        db.close()
+
+def _as_dict(job: Job) -> dict:
+    return {
+        "job_id": job.id,
+        "kind": job.kind,
+        "payload": json.loads(job.payload) if job.payload else {},
+        "priority": job.priority,
+        "status": job.status,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+    }
@@ -0,0 +1,142 @@
+# backend/core/lexical.py
+"""
+Compact per-document inverted index with BM25 scoring.
+
+Dense embeddings are poor at exact identifiers, part numbers and rare
+terms, so every document also gets a small lexical index over its chunks
+(built during /process and stored next to the chunk sidecar, see
+core/store.py). Postings are kept in CSR form: one sorted vocabulary, an
+offsets array into flat (chunk index, term frequency) arrays, and the
+length of every chunk. The vocabulary itself is one buffer of
+concatenated UTF-8 terms plus their offsets (a fixed-width unicode array
+would pad every term to the longest one), searched by bisection. That is a
+few NumPy arrays per document and can be saved with np.savez without
+pickling.
+"""
+import bisect
+import re
+
+import numpy as np
+
+# Words, plus identifiers joined by '-', '.', '/' or '_' (e.g. 'XJ-199',
+# 'v2.1'). Compound tokens are indexed both whole and as their parts.
+_TOKEN_RE = re.compile(r"\w+(?:[-./]\w+)*")
+_SPLIT_RE = re.compile(r"[-./_]")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = [part for part in _SPLIT_RE.split(token) if part]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def _pack_terms(terms: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    # Sorted terms as one UTF-8 buffer plus offsets. Code point order is
+    # UTF-8 byte order, so the encoded terms stay sorted.
+    encoded = [term.encode("utf-8") for term in terms]
+    term_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in encoded], out=term_offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8).copy(), term_offsets
+
+class _Vocabulary:
+    """Read-only sequence view of the sorted terms (as UTF-8 bytes), for bisect."""
+    def __init__(self, term_bytes: np.ndarray, term_offsets: np.ndarray):
+        self.term_bytes = term_bytes
+        self.term_offsets = term_offsets
+
+    def __len__(self) -> int:
+        return len(self.term_offsets) - 1
+
+    def __getitem__(self, i: int) -> bytes:
+        return self.term_bytes[self.term_offsets[i]:self.term_offsets[i + 1]].tobytes()
+
+class LexicalIndex:
+    def __init__(self, term_bytes: np.ndarray, term_offsets: np.ndarray, offsets: np.ndarray, postings: np.ndarray,
+                 frequencies: np.ndarray, lengths: np.ndarray):
+        # Sorted vocabulary: term i is term_bytes[term_offsets[i]:term_offsets[i + 1]]
+        # (UTF-8), and its postings are [offsets[i], offsets[i + 1]).
+        self.term_bytes = term_bytes
+        self.term_offsets = term_offsets
+        self.vocabulary = _Vocabulary(term_bytes, term_offsets)
+        self.offsets = offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.num_chunks = int(lengths.shape[0])
+        self.average_length = float(lengths.mean()) if self.num_chunks else 0.0
+
+    @classmethod
+    def build(cls, chunks: list[str]) -> "LexicalIndex":
+        counts = {}
+        lengths = np.zeros(len(chunks), dtype=np.int32)
+        for chunk_index, chunk in enumerate(chunks):
+            tokens = tokenize(chunk)
+            lengths[chunk_index] = len(tokens)
+            for token in tokens:
+                per_chunk = counts.setdefault(token, {})
+                per_chunk[chunk_index] = per_chunk.get(chunk_index, 0) + 1
+
+        terms = sorted(counts)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        postings, frequencies = [], []
+        for i, term in enumerate(terms):
+            per_chunk = counts[term]
+            postings.extend(per_chunk)
+            frequencies.extend(per_chunk.values())
+            offsets[i + 1] = offsets[i] + len(per_chunk)
+        return cls(
+            *_pack_terms(terms),
+            offsets,
+            np.array(postings, dtype=np.int32),
+            np.array(frequencies, dtype=np.int32),
+            lengths,
+        )
+
+    def save(self, f) -> None:
+        np.savez(f, term_bytes=self.term_bytes, term_offsets=self.term_offsets, offsets=self.offsets,
+                 postings=self.postings, frequencies=self.frequencies, lengths=self.lengths)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path, allow_pickle=False) as data:
+            if "terms" in data:
+                # Saved with the vocabulary as a fixed-width unicode array.
+                term_bytes, term_offsets = _pack_terms([str(term) for term in data["terms"]])
+            else:
+                term_bytes, term_offsets = data["term_bytes"], data["term_offsets"]
+            return cls(term_bytes, term_offsets, data["offsets"], data["postings"], data["frequencies"], data["lengths"])
+
+    def _term_id(self, term: str) -> int | None:
+        key = term.encode("utf-8")
+        i = bisect.bisect_left(self.vocabulary, key)
+        if i < len(self.vocabulary) and self.vocabulary[i] == key:
+            return i
+        return None
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every chunk for the query (zero for chunks without any query term)."""
+        scores = np.zeros(self.num_chunks, dtype=np.float32)
+        if not self.num_chunks:
+            return scores
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(self.average_length, 1e-9))
+        for term in dict.fromkeys(tokenize(query)):
+            term_id = self._term_id(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            rows = self.postings[start:end]
+            tf = self.frequencies[start:end].astype(np.float32)
+            df = end - start
+            idf = np.log(1 + (self.num_chunks - df + 0.5) / (df + 0.5))
+            scores[rows] += idf * tf * (BM25_K1 + 1) / (tf + length_norm[rows])
+        return scores
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (
+            self.term_bytes, self.term_offsets, self.offsets, self.postings, self.frequencies, self.lengths,
+        ))
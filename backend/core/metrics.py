@@ -0,0 +1,244 @@
+# backend/core/metrics.py
+"""
+Lightweight in-process instrumentation, exposed as Prometheus text on /metrics.
+
+    with metrics.timer("embed"):
+        ...
+
+records the duration in the 'nlp_stage_seconds' histogram (labelled with
+the stage), and, if the current request asked for a trace (see
+start_trace), in that trace too, which main.py returns as a Server-Timing
+header. Counters count cache hits and misses and re-embedding fallbacks;
+collectors registered with register_collector() add gauges (queue depth,
+model memory, cache sizes) when /metrics is scraped.
+
+Metrics are per process: the job worker processes keep their own, which
+the API's /metrics does not include (the queue depth it reports is global).
+
+The optional sampling profiler (settings.profile_interval_ms) records, for
+every thread inside a timed stage, the stage and the innermost frames, so a
+slowdown can be attributed to a specific model call (/metrics/profile).
+"""
+import bisect
+import contextvars
+import functools
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextlib import contextmanager
+
+from .config import settings
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(labels)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.name}_bucket{_label_text(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_label_text(labels)} {total}")
+                lines.append(f"{self.name}_count{_label_text(labels)} {count}")
+        return lines
+
+stage_seconds = Histogram("nlp_stage_seconds", "Duration of pipeline and request stages.")
+cache_events = Counter("nlp_cache_events_total", "Cache lookups by cache and result (hit or miss).")
+reembed_fallbacks = Counter("nlp_reembed_fallbacks_total", "Embeddings or indexes recomputed because no stored copy was usable.")
+http_requests = Histogram("nlp_http_request_seconds", "Duration of HTTP requests by route template.")
+
+_metrics = [stage_seconds, cache_events, reembed_fallbacks, http_requests]
+_collectors = []
+
+def register_collector(collect) -> None:
+    """
+    Registers a function called on every scrape that returns
+    [(name, help, type, [(labels dict, value), ...]), ...] (type 'gauge' or 'counter').
+    """
+    _collectors.append(collect)
+
+def cache_event(cache: str, hit: bool) -> None:
+    cache_events.inc(cache=cache, result="hit" if hit else "miss")
+
+# --- Per-request traces ---
+
+_trace = contextvars.ContextVar("nlp_trace", default=None)
+
+def start_trace():
+    """Starts collecting the stages of the current request (or task); returns the token for end_trace()."""
+    return _trace.set([])
+
+def end_trace(token) -> list[tuple[str, float]]:
+    stages = _trace.get() or []
+    _trace.reset(token)
+    return stages
+
+def server_timing(stages: list[tuple[str, float]], total: float | None = None) -> str:
+    """A Server-Timing header value; repeated stages are summed, in first-seen order."""
+    durations = {}
+    for stage, seconds in stages:
+        durations[stage] = durations.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+# --- Timers ---
+
+# Stages each thread is in right now, innermost last (read by the profiler).
+_active_stages = {}
+
+@contextmanager
+def timer(stage: str):
+    thread_id = threading.get_ident()
+    stack = _active_stages.setdefault(thread_id, [])
+    stack.append(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        # Coroutines on the event loop thread may finish out of order.
+        del stack[len(stack) - 1 - stack[::-1].index(stage)]
+        if not stack:
+            _active_stages.pop(thread_id, None)
+        stage_seconds.observe(seconds, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.append((stage, seconds))
+
+def timed(stage: str):
+    """Decorator form of timer()."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# --- Sampling profiler ---
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread that is inside a timed stage every
+    'interval' seconds and counts (stage, innermost frames) pairs.
+    """
+
+    def __init__(self, interval: float, depth: int = 8):
+        self.interval = interval
+        self.depth = depth
+        self.samples = _Tally()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            for thread_id, stages in list(_active_stages.items()):
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_id or not stages:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                with self._lock:
+                    self.samples[(";".join(stages), ";".join(reversed(stack)))] += 1
+
+    def report(self, top: int = 50) -> dict:
+        with self._lock:
+            samples = self.samples.most_common(top)
+            total = sum(self.samples.values())
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": total,
+            # Collapsed stacks (outermost first), e.g. for flamegraph tools.
+            "top": [{"stages": stages, "stack": stack, "samples": count} for (stages, stack), count in samples],
+        }
+
+profiler = SamplingProfiler(settings.profile_interval_ms / 1000) if settings.profile_interval_ms > 0 else None
+
+def start_profiler() -> None:
+    if profiler is not None:
+        profiler.start()
+
+# --- Exposition ---
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"Metrics collector {getattr(collect, '__name__', collect)} failed: {e}")
+            continue
+        for name, help, metric_type, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_label_text(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
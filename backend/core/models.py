@@ -1,40 +1,309 @@
-# backend/core/models.py (Updated with Multiple Search Models)
-import spacy
-from sentence_transformers import SentenceTransformer
-import pytextrank
-from transformers import pipeline, AutoTokenizer
+# backend/core/models.py (Lazy Model Registry)
+"""
+Every NLP model is loaded on first use through 'registry', never at import
+time, so a process that only serves searches doesn't pay for spaCy or BART
+and the API starts serving immediately.
 
-print("Loading NLP models...")
+Each model is loaded once per process under its own lock. The registry
+records how long each load took and roughly how much memory the model
+holds, and when settings.model_memory_budget_bytes is exceeded it evicts
+the least recently used models. A model that wraps another one (KeyBERT
+and the embedding model) is registered as depending on it: it is evicted
+together with it, and keeps it from being evicted while it's in use. A
+model that failed to load is tried again after a backoff.
+settings.warmup_models lists models to load in the background at startup.
 
-# SpaCy Model (using the better transformer version)
-try:
-    nlp = spacy.load("en_core_web_trf")
+Heavy libraries (spaCy, sentence-transformers, transformers) are imported
+inside the loaders for the same reason. With settings.inference_mode
+'int8', the transformer loaders return dynamically quantized models (see
+core/inference.py).
+"""
+import copy
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import inference
+from .config import settings
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _parameter_bytes(model) -> int:
+    """Bytes held by the torch parameters/buffers reachable from a model, if any."""
+    for module in (model, getattr(model, "model", None)):
+        if hasattr(module, "parameters") and hasattr(module, "buffers"):
+            return sum(t.numel() * t.element_size() for t in list(module.parameters()) + list(module.buffers()))
+    return 0
+
+class ModelRegistry:
+    def __init__(self, memory_budget_bytes: int = 0):
+        # 0 means unlimited.
+        self.memory_budget_bytes = memory_budget_bytes
+        self._loaders = {}
+        self._dependencies = {}
+        self._models = OrderedDict()
+        self._info = {}
+        self._failed = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, loader, depends_on: tuple = ()) -> None:
+        """
+        Registers a zero-argument function that loads (and returns) a model.
+        'depends_on' names the models the loaded one holds on to.
+        """
+        with self._lock:
+            self._loaders[name] = loader
+            self._dependencies[name] = tuple(depends_on)
+            self._locks.setdefault(name, threading.Lock())
+
+    def is_registered(self, name: str) -> bool:
+        return name in self._loaders
+
+    def get(self, name: str):
+        """
+        Returns the model, loading it on first use. Returns None if it can't
+        be loaded; the error is remembered and the load only tried again
+        after a backoff (settings.model_retry_base_seconds).
+        """
+        with self._lock:
+            if name in self._models:
+                self._touch(name)
+                return self._models[name]
+            failure = self._failed.get(name)
+            if failure is not None and time.time() < failure["retry_at"]:
+                return None
+            if name not in self._loaders:
+                raise KeyError(f"Model '{name}' is not registered.")
+            lock = self._locks[name]
+
+        with lock:
+            with self._lock:
+                if name in self._models:
+                    return self._models[name]
+            print(f"Loading model '{name}'...")
+            rss_before = _rss_bytes()
+            started = time.perf_counter()
+            try:
+                model = self._loaders[name]()
+            except Exception as e:
+                with self._lock:
+                    attempts = self._failed.get(name, {}).get("attempts", 0) + 1
+                    delay = min(
+                        settings.model_retry_base_seconds * 2 ** (attempts - 1), settings.model_retry_max_seconds,
+                    )
+                    self._failed[name] = {"error": str(e), "attempts": attempts, "retry_at": time.time() + delay}
+                print(f"Error loading model '{name}': {e} (retrying in {delay:.0f}s)")
+                return None
+            load_seconds = time.perf_counter() - started
+            size = _parameter_bytes(model) or max(_rss_bytes() - rss_before, 0)
+            print(f"Model '{name}' loaded in {load_seconds:.1f}s (~{size / 2**20:.0f} MiB).")
+
+            with self._lock:
+                self._failed.pop(name, None)
+                self._models[name] = model
+                self._info[name] = {"load_seconds": round(load_seconds, 3), "bytes": size, "last_used": time.time()}
+                self._touch(name)
+                self._evict_over_budget(keep=name)
+            return model
+
+    def _requirements(self, name: str) -> set:
+        # The model and everything it depends on, transitively.
+        required, pending = set(), [name]
+        while pending:
+            current = pending.pop()
+            if current not in required:
+                required.add(current)
+                pending.extend(self._dependencies.get(current, ()))
+        return required
+
+    def _touch(self, name: str) -> None:
+        # Marks the model, and the models it holds, as just used.
+        now = time.time()
+        for required in self._requirements(name):
+            if required in self._models:
+                self._models.move_to_end(required)
+                self._info[required]["last_used"] = now
+        self._models.move_to_end(name)
+
+    def _drop(self, name: str) -> list:
+        # Forgets the model and every loaded model that holds it. Callers that
+        # still hold one keep it alive until they're done.
+        dropped = []
+        for dependent in [n for n in self._models if n != name and name in self._requirements(n)]:
+            if dependent in self._models:
+                dropped.extend(self._drop(dependent))
+        if self._models.pop(name, None) is not None:
+            dropped.append(name)
+        self._info.pop(name, None)
+        return dropped
+
+    def _evict_over_budget(self, keep: str) -> None:
+        if not self.memory_budget_bytes:
+            return
+        protected = self._requirements(keep)
+        evicted = False
+        while self.resident_bytes() > self.memory_budget_bytes:
+            victim = next((n for n in self._models if n not in protected), None)
+            if victim is None:
+                break
+            for name in self._drop(victim):
+                print(f"Evicted model '{name}' to stay within the memory budget.")
+            evicted = True
+        if evicted:
+            gc.collect()
+
+    def resident_bytes(self) -> int:
+        return sum(info["bytes"] for info in self._info.values())
+
+    def unload(self, name: str) -> None:
+        """Unloads a model (and the models that hold it) and forgets any failure to load it."""
+        with self._lock:
+            self._drop(name)
+            self._failed.pop(name, None)
+
+    def warm_up(self, names) -> None:
+        for name in names:
+            if self.is_registered(name):
+                self.get(name)
+            else:
+                print(f"Cannot warm up unknown model '{name}'.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self.resident_bytes(),
+                "loaded": {name: dict(info) for name, info in self._info.items()},
+                "failed": {
+                    name: {"error": failure["error"], "retry_in_seconds": max(round(failure["retry_at"] - time.time()), 0)}
+                    for name, failure in self._failed.items()
+                },
+                "registered": sorted(self._loaders),
+            }
+
+registry = ModelRegistry(memory_budget_bytes=settings.model_memory_budget_bytes)
+
+# --- Loaders ---
+
+def _load_spacy():
+    import spacy
+    import pytextrank  # noqa: F401  (registers the 'textrank' pipe)
+    inference.configure_torch()
+    try:
+        nlp = spacy.load(settings.spacy_model)
+    except OSError:
+        print(f"spaCy model not found. Please run 'python -m spacy download {settings.spacy_model}'")
+        raise
     nlp.add_pipe("textrank")
-    print("spaCy model 'en_core_web_trf' with pytextrank loaded successfully.")
-except OSError:
-    print("spaCy model not found. Please run 'python -m spacy download en_core_web_trf'")
-    nlp = None
-
-# --- NEW: Load a dictionary of embedding models ---
-embedding_models = {}
-try:
-    # The fast, default model
-    embedding_models['all-MiniLM-L6-v2'] = SentenceTransformer('all-MiniLM-L6-v2')
-    # The slower, higher-quality model
-    embedding_models['all-mpnet-base-v2'] = SentenceTransformer('all-mpnet-base-v2')
-    print("All SentenceTransformer models loaded successfully.")
-except Exception as e:
-    print(f"Error loading SentenceTransformer models: {e}")
-
-# Summarizer and Tokenizer
-summarizer = None
-summarizer_tokenizer = None
-try:
-    summarizer_model_name = "facebook/bart-large-cnn"
-    summarizer = pipeline("summarization", model=summarizer_model_name)
-    summarizer_tokenizer = AutoTokenizer.from_pretrained(summarizer_model_name)
-    print(f"Summarization model '{summarizer_model_name}' and its tokenizer loaded successfully.")
-except Exception as e:
-    print(f"Error loading summarization model/tokenizer: {e}")
-
-print("NLP models are ready.")
\ No newline at end of file
+    return nlp
+
+def _sentence_transformer_loader(model_name: str):
+    def load_float():
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(model_name, device="cpu" if inference.wants_int8("embedding") else None)
+
+    def load():
+        inference.configure_torch()
+        if not inference.wants_int8("embedding"):
+            return load_float()
+        # A SentenceTransformer is itself a torch module.
+        return inference.load_quantized(model_name, load_float, inference.quantize_linear, inference.embedding_agreement)
+    return load
+
+def _quantize_cross_encoder(model):
+    # Recent CrossEncoders are torch modules themselves, so a shallow copy
+    # would share its submodules with the float model (and then both would
+    # be int8, and the validation would compare int8 with int8).
+    quantized = copy.deepcopy(model)
+    quantized.model = inference.quantize_linear(quantized.model)
+    if not inference.has_float_linear(model.model):
+        raise RuntimeError("Quantizing the cross-encoder modified the float model.")
+    return quantized
+
+def _cross_encoder_loader(model_name: str):
+    def load_float():
+        from sentence_transformers import CrossEncoder
+        return CrossEncoder(model_name, device="cpu" if inference.wants_int8("cross_encoder") else None)
+
+    def load():
+        inference.configure_torch()
+        if not inference.wants_int8("cross_encoder"):
+            return load_float()
+        return inference.load_quantized(model_name, load_float, _quantize_cross_encoder, inference.cross_encoder_agreement)
+    return load
+
+def _summarization_pipeline(model):
+    from transformers import pipeline
+    return pipeline("summarization", model=model, tokenizer=settings.summarizer_model, device=-1)
+
+def _load_summarizer():
+    inference.configure_torch()
+    if not inference.wants_int8("summarizer"):
+        from transformers import pipeline
+        return pipeline("summarization", model=settings.summarizer_model)
+    # The pipeline object isn't cached on disk, only its (quantized) model.
+    return inference.load_quantized(
+        settings.summarizer_model,
+        lambda: _summarization_pipeline(settings.summarizer_model),
+        lambda pipe: _summarization_pipeline(inference.quantize_linear(pipe.model)),
+        inference.summary_agreement,
+        to_cache=lambda pipe: pipe.model,
+        from_cache=_summarization_pipeline,
+    )
+
+def _load_summarizer_tokenizer():
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(settings.summarizer_model)
+
+def _load_keybert():
+    from keybert import KeyBERT
+    model = get_embedding_model(settings.default_embedding_model)
+    if model is None:
+        raise RuntimeError(f"Default model {settings.default_embedding_model} could not be loaded.")
+    # Wraps the default embedding model, which it's registered as depending on.
+    return KeyBERT(model=model)
+
+registry.register("spacy", _load_spacy)
+registry.register("keybert", _load_keybert, depends_on=(settings.default_embedding_model,))
+registry.register("summarizer", _load_summarizer)
+registry.register("summarizer_tokenizer", _load_summarizer_tokenizer)
+for _name in settings.embedding_models:
+    registry.register(_name, _sentence_transformer_loader(_name))
+for _name in settings.cross_encoder_models:
+    registry.register(_name, _cross_encoder_loader(_name))
+
+# --- Accessors used by the rest of the code ---
+
+def get_nlp():
+    """The shared spaCy pipeline (with pytextrank), or None if unavailable."""
+    return registry.get("spacy")
+
+def is_embedding_model(model_name: str) -> bool:
+    return model_name in settings.embedding_models
+
+def get_embedding_model(model_name: str):
+    """A SentenceTransformer by name, or None if unavailable."""
+    if not is_embedding_model(model_name):
+        return None
+    return registry.get(model_name)
+
+def get_cross_encoder(model_name: str):
+    return registry.get(model_name)
+
+def get_summarizer():
+    return registry.get("summarizer")
+
+def get_summarizer_tokenizer():
+    return registry.get("summarizer_tokenizer")
+
+def get_keybert():
+    """The shared KeyBERT instance over the default embedding model."""
+    return registry.get("keybert")
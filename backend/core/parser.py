@@ -1,6 +1,39 @@
 # core/parser.py
+"""
+PDF text extraction.
+
+Pages are streamed one at a time as (page_number, text) pairs instead of
+being collected into one string, and large PDFs can have their page ranges
+fanned out across a process pool (settings.pdf_parallel_min_pages).
+
+load_pdf_text() returns the cleaned text of a whole PDF together with the
+character offset at which every page starts, and caches both on disk (by
+content hash when it is known), so the ingest pipeline and the analysis
+worker extract each upload only once and search results can be mapped back
+to page numbers without reparsing.
+
+With settings.incremental_reprocessing, the cache also records a
+fingerprint of every page's content stream and the resources it draws.
+When a new version of a PDF is loaded with the content hash of the previous
+one, only the pages whose fingerprint changed are extracted; the others
+keep their text.
+"""
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import fitz  # PyMuPDF
 
+from .config import settings
+from . import metrics
+from .processor import clean_text
+
+@metrics.timed("extract")
 def extract_text_from_pdf(file_path: str) -> str:
     """
     Extracts all text from a given PDF file and concatenates it.
@@ -11,10 +44,248 @@ def extract_text_from_pdf(file_path: str) -> str:
     Returns:
         A single string containing all the text from the PDF.
     """
+    return "".join(text for _, text in iter_pages(file_path))
+
+def iter_pages(file_path: str, start: int = 0, stop: int | None = None):
+    """
+    Yields (page_number, text) for the pages in [start, stop), one page at
+    a time. Page numbers are 1-based.
+    """
+    doc = fitz.open(file_path)
+    try:
+        stop = doc.page_count if stop is None else min(stop, doc.page_count)
+        for index in range(start, stop):
+            yield index + 1, doc.load_page(index).get_text()
+    finally:
+        doc.close() # It's good practice to close the document
+
+def _extract_range(file_path: str, start: int, stop: int) -> list[tuple[int, str]]:
+    # Runs in a pool process; the pages of a range travel back together.
+    return list(iter_pages(file_path, start, stop))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _extract_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn', like the job workers: the API process runs threads.
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.pdf_extract_workers or os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+def iter_pages_parallel(file_path: str, page_count: int, workers: int):
+    """
+    Like iter_pages(), but page ranges are extracted in a process pool.
+    Pages are still yielded in order, as soon as their range is done.
+    """
+    range_size = -(-page_count // (workers * 4))
+    pool = _extract_pool()
+    futures = [
+        pool.submit(_extract_range, file_path, start, min(start + range_size, page_count))
+        for start in range(0, page_count, range_size)
+    ]
+    for future in futures:
+        yield from future.result()
+
+def extract_pages(file_path: str, indices: list[int]) -> dict[int, str]:
+    """The text of the pages at the given 0-based indices, by index."""
     doc = fitz.open(file_path)
-    all_text = []
-    for page in doc:
-        all_text.append(page.get_text())
+    try:
+        return {index: doc.load_page(index).get_text() for index in indices}
+    finally:
+        doc.close()
+
+# An indirect reference ("12 0 R") inside a PDF object's source.
+_REFERENCE = re.compile(r"(\d+) \d+ R\b")
+
+# References that point back up the page tree (or from an annotation to its
+# page), which would make every page's fingerprint depend on every other page.
+_BACK_REFERENCE = re.compile(r"/(?:Parent|P)\s+\d+ \d+ R\b")
+
+def _object_digest(doc, xref: int, digests: dict[int, str], active: set[int]) -> str:
+    """
+    A hash of a PDF object and everything it references: its source with
+    every reference replaced by the referenced object's digest, plus its
+    stream. Objects with the same content hash the same whatever their
+    object numbers, so two pages drawing different form XObjects under the
+    same name (q /fzFrm0 Do Q) don't collide.
+    """
+    if xref in digests:
+        return digests[xref]
+    if xref in active:
+        return "cycle"
+    active.add(xref)
+    hasher = hashlib.sha1(_source_digest(doc, doc.xref_object(xref, compressed=True), digests, active).encode("utf-8"))
+    if doc.xref_is_stream(xref):
+        hasher.update(doc.xref_stream_raw(xref))
+    active.discard(xref)
+    digests[xref] = hasher.hexdigest()
+    return digests[xref]
+
+def _source_digest(doc, source: str, digests: dict[int, str], active: set[int]) -> str:
+    """An object's source with its references resolved to digests."""
+    source = _BACK_REFERENCE.sub("", source)
+    return _REFERENCE.sub(lambda match: _object_digest(doc, int(match.group(1)), digests, active), source)
+
+def page_fingerprints(file_path: str) -> list[str]:
+    """
+    A fingerprint of every page: a hash of what its text is extracted from
+    (the content stream, the resources it draws, resolved recursively, and
+    the page geometry), computed without extracting any text.
+    """
+    fingerprints = []
+    digests: dict[int, str] = {}
+    with fitz.open(file_path) as doc:
+        for page in doc:
+            hasher = hashlib.sha1(_object_digest(doc, page.xref, digests, set()).encode("utf-8"))
+            # Resources can be inherited from the page tree, which the page's
+            # own digest leaves out along with its /Parent.
+            xref = page.xref
+            while xref:
+                kind, value = doc.xref_get_key(xref, "Resources")
+                if kind != "null":
+                    hasher.update(_source_digest(doc, value, digests, set()).encode("utf-8"))
+                    break
+                kind, value = doc.xref_get_key(xref, "Parent")
+                xref = int(value.split()[0]) if kind == "xref" else 0
+            hasher.update(repr((tuple(page.rect), page.rotation)).encode("utf-8"))
+            fingerprints.append(hasher.hexdigest())
+    return fingerprints
+
+def stream_pages(file_path: str):
+    """
+    Yields (page_number, text) for every page, through the process pool when
+    the PDF has at least settings.pdf_parallel_min_pages pages.
+    """
+    with fitz.open(file_path) as doc:
+        page_count = doc.page_count
+    workers = settings.pdf_extract_workers or os.cpu_count() or 1
+    if settings.pdf_parallel_min_pages and page_count >= settings.pdf_parallel_min_pages and workers > 1:
+        return iter_pages_parallel(file_path, page_count, workers)
+    return iter_pages(file_path)
+
+class PdfText:
+    """The cleaned text of a PDF and the offset at which each page starts."""
+
+    def __init__(self, text: str, page_starts: list[int]):
+        self.text = text
+        # page_starts[i] is the offset in 'text' where page i + 1 begins.
+        self.page_starts = page_starts
+
+    def page_at(self, offset: int) -> int:
+        return page_at(self.page_starts, offset)
+
+    def pages(self) -> list[str]:
+        """The cleaned text of every page."""
+        ends = self.page_starts[1:] + [len(self.text)]
+        # Pages are joined with single spaces, which belong to no page.
+        return [self.text[start:end].rstrip(" ") for start, end in zip(self.page_starts, ends)]
+
+    def page_hashes(self) -> list[str]:
+        """A hash of every page's cleaned text (see core/search.py)."""
+        return [hashlib.sha1(page.encode("utf-8")).hexdigest() for page in self.pages()]
+
+def page_at(page_starts: list[int], offset: int) -> int:
+    """The 1-based page number a character offset falls on."""
+    return max(bisect.bisect_right(page_starts, offset), 1)
+
+def build_pdf_text(pages) -> PdfText:
+    """
+    Cleans (page_number, text) pairs and joins them with single spaces.
+    The result is the same as clean_text() over the whole document.
+    """
+    parts = []
+    length = 0
+    page_starts = []
+    for _, page_text in pages:
+        page_text = clean_text(page_text)
+        if page_text and parts:
+            parts.append(" ")
+            length += 1
+        page_starts.append(length)
+        if page_text:
+            parts.append(page_text)
+            length += len(page_text)
+    return PdfText("".join(parts), page_starts)
+
+def _text_cache_path(file_path: str, content_hash: str | None) -> str:
+    if content_hash:
+        # Content-addressed: the same PDF under another name hits too.
+        return os.path.join(settings.text_cache_directory, f"{content_hash}.json")
+    # A re-upload under the same name changes the size or mtime, and the key.
+    stat = os.stat(file_path)
+    key = f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return os.path.join(settings.text_cache_directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+def _read_text_cache(cache_path: str) -> dict | None:
+    try:
+        with open(cache_path, "rb") as f:
+            cached = json.loads(f.read())
+    except (OSError, ValueError):
+        return None
+    return cached if "text" in cached and "page_starts" in cached else None
+
+def _extract_changed_pages(file_path: str, fingerprints: list[str], previous: dict) -> PdfText | None:
+    """
+    Builds the text of a PDF from the pages of its previous version (a text
+    cache entry) wherever the page at the same index has the same
+    fingerprint, extracting only the others. None if the previous version
+    has no fingerprints, or if either version has two pages with the same
+    fingerprint, which can't be told apart and are extracted in full.
+    """
+    previous_fingerprints = previous.get("page_fingerprints")
+    if not previous_fingerprints:
+        return None
+    if len(set(fingerprints)) < len(fingerprints) or len(set(previous_fingerprints)) < len(previous_fingerprints):
+        return None
+    previous_pages = PdfText(previous["text"], previous["page_starts"]).pages()
+    changed = [
+        index for index, fingerprint in enumerate(fingerprints)
+        if index >= len(previous_fingerprints) or previous_fingerprints[index] != fingerprint
+    ]
+    extracted = extract_pages(file_path, changed)
+    print(f"Re-extracted {len(changed)} of {len(fingerprints)} pages of {file_path}; the others are unchanged.")
+    return build_pdf_text(
+        (index + 1, extracted[index] if index in extracted else previous_pages[index])
+        for index in range(len(fingerprints))
+    )
+
+def load_pdf_text(file_path: str, content_hash: str | None = None, previous_hash: str | None = None) -> PdfText:
+    """
+    Returns the cleaned text and page offsets of a PDF, extracting it only
+    if it isn't in the on-disk text cache yet.
+
+    Args:
+        content_hash: The PDF's content hash (core/content.py), if known.
+        previous_hash: The content hash of an earlier version of the same
+            document; pages that didn't change since are not extracted again.
+    """
+    cache_path = _text_cache_path(file_path, content_hash)
+    cached = _read_text_cache(cache_path)
+    metrics.cache_event("pdf_text", hit=cached is not None)
+    if cached is not None:
+        return PdfText(cached["text"], cached["page_starts"])
 
-    doc.close() # It's good practice to close the document
-    return "".join(all_text)
\ No newline at end of file
+    fingerprints = None
+    with metrics.timer("extract"):
+        pdf_text = None
+        if settings.incremental_reprocessing:
+            fingerprints = page_fingerprints(file_path)
+            previous = _read_text_cache(_text_cache_path(file_path, previous_hash)) if previous_hash else None
+            if previous is not None:
+                pdf_text = _extract_changed_pages(file_path, fingerprints, previous)
+        if pdf_text is None:
+            pdf_text = build_pdf_text(stream_pages(file_path))
+    try:
+        os.makedirs(settings.text_cache_directory, exist_ok=True)
+        tmp_path = f"{cache_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"text": pdf_text.text, "page_starts": pdf_text.page_starts, "page_fingerprints": fingerprints}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not cache extracted text of {file_path}: {e}")
+    return pdf_text
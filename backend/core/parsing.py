@@ -0,0 +1,280 @@
+# backend/core/parsing.py
+"""
+One spaCy pass per document, shared by every analysis that needs it.
+
+The transformer in 'en_core_web_trf' dominates the cost of a parse, and the
+tagger, parser, NER and TextRank components all read the same transformer
+output. So instead of calling nlp(...) once per analysis, callers ask for
+the capabilities they need ('sentences', 'ner', 'textrank'), the union of
+the required components is enabled, and the text is parsed once (in
+segments, through nlp.pipe).
+
+Parsed segments can be cached on disk (one DocBin per segment, keyed by
+its text), so the ingest pipeline and the analysis worker (a different
+process) share one parse. Given the page offsets of a document (and with
+settings.incremental_reprocessing), segments never span pages, so a new
+version of a document only parses the pages that changed.
+"""
+import hashlib
+import os
+from typing import NamedTuple
+
+from .config import settings
+from . import metrics
+from .models import get_nlp
+
+# The pipeline components each capability needs. Names that the loaded
+# pipeline doesn't have (e.g. 'tok2vec' on the trf model) are ignored.
+CAPABILITY_COMPONENTS = {
+    "sentences": ("transformer", "tok2vec", "parser", "senter"),
+    "ner": ("transformer", "tok2vec", "ner"),
+    "textrank": ("transformer", "tok2vec", "tagger", "attribute_ruler", "lemmatizer", "parser", "textrank"),
+}
+
+class Phrase(NamedTuple):
+    """A TextRank phrase merged across segments (see ParsedDocument.phrases)."""
+    text: str
+    rank: float
+    count: int
+    # (char offset of the segment, spaCy Span) of every occurrence.
+    chunks: list
+
+class ParsedDocument:
+    """
+    A text parsed as one or more segments. Character offsets returned by
+    the helpers below are relative to the full text.
+    """
+
+    def __init__(self, text: str, segments: list, components: tuple):
+        self.text = text
+        # (char offset of the segment, spaCy Doc) pairs, in order.
+        self.segments = segments
+        self.components = components
+
+    def sentences(self) -> list[tuple[int, int, str]]:
+        """(start, end, text) of every sentence, stripped of surrounding whitespace."""
+        sentences = []
+        for offset, doc in self.segments:
+            for sent in doc.sents:
+                sent_text = sent.text.strip()
+                if not sent_text:
+                    continue
+                start = offset + sent.start_char + (len(sent.text) - len(sent.text.lstrip()))
+                sentences.append((start, start + len(sent_text), sent_text))
+        return sentences
+
+    def entities(self) -> list:
+        return [ent for _, doc in self.segments for ent in doc.ents]
+
+    def phrases(self, limit: int = 10) -> list:
+        """
+        TextRank phrases of the whole text, best first.
+
+        TextRank ranks are only comparable within one graph, i.e. one
+        segment. When the text was parsed in several segments, each
+        segment's ranks are divided by their sum and weighted by the
+        segment's share of the text, and a phrase found in several segments
+        adds up its scores; the merged phrases are Phrase tuples.
+        """
+        if len(self.segments) == 1:
+            return list(self.segments[0][1]._.phrases[:limit])
+        total = sum(len(doc.text) for _, doc in self.segments) or 1
+        merged = {}
+        for offset, doc in self.segments:
+            rank_sum = sum(phrase.rank for phrase in doc._.phrases)
+            if not rank_sum:
+                continue
+            weight = len(doc.text) / total
+            for phrase in doc._.phrases:
+                key = phrase.text.lower()
+                text, rank, count, chunks = merged.get(key, (phrase.text, 0.0, 0, []))
+                merged[key] = Phrase(
+                    text, rank + weight * phrase.rank / rank_sum, count + phrase.count,
+                    chunks + [(offset, chunk) for chunk in phrase.chunks],
+                )
+        return sorted(merged.values(), key=lambda phrase: phrase.rank, reverse=True)[:limit]
+
+    def textrank_summary(self, limit_sentences: int, limit_phrases: int = 10) -> list[str]:
+        """
+        The limit_sentences sentences that cover the top phrases best. A
+        multi-segment text is scored over its merged phrases (see
+        phrases()): each sentence scores the ranks of the top phrases it
+        contains, and the best ones are returned in text order.
+        """
+        if len(self.segments) == 1:
+            summary = self.segments[0][1]._.textrank.summary(
+                limit_phrases=limit_phrases, limit_sentences=limit_sentences,
+            )
+            return [sent.text for sent in summary]
+        scores, texts = {}, {}
+        for phrase in self.phrases(limit=limit_phrases):
+            covered = set()
+            for offset, chunk in phrase.chunks:
+                sent = chunk.sent
+                key = offset + sent.start_char
+                if key not in covered:
+                    covered.add(key)
+                    scores[key] = scores.get(key, 0.0) + phrase.rank
+                    texts[key] = sent.text
+        best = sorted(scores, key=lambda key: (-scores[key], key))[:limit_sentences]
+        return [texts[key] for key in sorted(best)]
+
+def components_for(nlp, capabilities) -> tuple:
+    """The components of the loaded pipeline needed for a set of capabilities."""
+    wanted = set()
+    for capability in capabilities:
+        wanted.update(CAPABILITY_COMPONENTS[capability])
+    return tuple(name for name in nlp.pipe_names if name in wanted)
+
+def _split_span(text: str, max_chars: int) -> list[tuple[int, str]]:
+    segments = []
+    start = 0
+    while start < len(text):
+        end = min(start + max_chars, len(text))
+        if end < len(text):
+            # Prefer to cut after a full stop, then at any space.
+            cut = text.rfind(". ", start, end)
+            if cut <= start:
+                cut = text.rfind(" ", start, end)
+            if cut > start:
+                end = cut + 1
+        segments.append((start, text[start:end]))
+        start = end
+    return segments
+
+def split_segments(text: str, max_chars: int, boundaries=None) -> list[tuple[int, str]]:
+    """
+    Splits text into (offset, segment) pieces of at most ~max_chars, at
+    sentence-ish boundaries. With 'boundaries' (character offsets, e.g.
+    page starts), no piece spans one and pieces don't end in whitespace,
+    so a piece depends only on the text between two boundaries.
+    """
+    if not boundaries:
+        return _split_span(text, max_chars)
+    cuts = sorted({offset for offset in boundaries if 0 < offset < len(text)})
+    segments = []
+    for start, end in zip([0] + cuts, cuts + [len(text)]):
+        for offset, segment in _split_span(text[start:end], max_chars):
+            segment = segment.rstrip()
+            if segment:
+                segments.append((start + offset, segment))
+    return segments
+
+def _cache_path(segment: str, components: tuple) -> str:
+    segment_hash = hashlib.sha1(segment.encode("utf-8")).hexdigest()
+    components_key = hashlib.sha1(",".join(components).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(settings.parse_cache_directory, f"{segment_hash}.{components_key}.spacy")
+
+def _load_cached(nlp, segment: str, components: tuple):
+    from spacy.tokens import DocBin
+    path = _cache_path(segment, components)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        docs = list(DocBin().from_bytes(f.read()).get_docs(nlp.vocab))
+    if len(docs) != 1:
+        return None
+    # TextRank results are Python objects that aren't serialized; recompute
+    # them from the restored tags, which is cheap compared to the transformer.
+    if "textrank" in components:
+        return nlp.get_pipe("textrank")(docs[0])
+    return docs[0]
+
+def _store_cached(segment: str, components: tuple, doc) -> None:
+    from spacy.tokens import DocBin
+    path = _cache_path(segment, components)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    doc_bin = DocBin(store_user_data=False)
+    doc_bin.add(doc)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(doc_bin.to_bytes())
+    os.replace(tmp_path, path)
+
+def parse_text(
+    text: str, capabilities, cache: bool = False, cache_capabilities=None, boundaries=None,
+) -> ParsedDocument | None:
+    """
+    Parses a text once with only the components the capabilities need.
+
+    Args:
+        text: The text to parse.
+        capabilities: Any of 'sentences', 'ner', 'textrank'.
+        cache: Read/write the parsed segments from/to the on-disk parse cache.
+        cache_capabilities: Parse (and cache) for this wider set instead, so
+            that a later consumer in another process can reuse the parse.
+        boundaries: Offsets no segment may span, e.g. the page starts of a
+            document (ignored unless settings.incremental_reprocessing).
+
+    Returns:
+        A ParsedDocument, or None if the spaCy model isn't available.
+    """
+    return parse_texts(
+        [text], capabilities, cache=cache, cache_capabilities=cache_capabilities,
+        boundaries=[boundaries] if boundaries else None,
+    )[0]
+
+def parse_texts(texts: list[str], capabilities, cache: bool = False, cache_capabilities=None, boundaries=None) -> list:
+    """
+    Like parse_text() for several texts at once: the segments of all texts
+    that aren't cached go through a single nlp.pipe call, so the
+    transformer runs on full batches even when the texts are short (bulk
+    ingest, see ingest.py).
+
+    Args:
+        boundaries: A list of segment boundaries per text (see parse_text).
+
+    Returns:
+        A ParsedDocument per text (all None if the spaCy model isn't available).
+    """
+    nlp = get_nlp()
+    if nlp is None:
+        return [None] * len(texts)
+
+    components = components_for(nlp, cache_capabilities or capabilities)
+    # A segment cached for the full document report covers any subset of it.
+    cached_candidates = [
+        cached_components
+        for cached_components in dict.fromkeys([components, components_for(nlp, CAPABILITY_COMPONENTS)])
+        if set(components) <= set(cached_components)
+    ]
+    if not settings.incremental_reprocessing or boundaries is None:
+        boundaries = [None] * len(texts)
+    segmented = [
+        split_segments(text, settings.parse_segment_chars, text_boundaries)
+        for text, text_boundaries in zip(texts, boundaries)
+    ]
+
+    docs = {}
+    pending = []
+    for i, segments in enumerate(segmented):
+        for j, (_, segment) in enumerate(segments):
+            if cache:
+                for cached_components in cached_candidates:
+                    doc = _load_cached(nlp, segment, cached_components)
+                    if doc is not None:
+                        docs[i, j] = doc
+                        break
+                metrics.cache_event("parse", hit=(i, j) in docs)
+            if (i, j) not in docs:
+                pending.append((i, j))
+
+    if pending:
+        disabled = [name for name in nlp.pipe_names if name not in components]
+        with metrics.timer("parse"):
+            parsed_segments = nlp.pipe(
+                (segmented[i][j][1] for i, j in pending), disable=disabled, batch_size=settings.parse_batch_size,
+            )
+            for key, doc in zip(pending, parsed_segments):
+                docs[key] = doc
+        if cache:
+            for i, j in pending:
+                try:
+                    _store_cached(segmented[i][j][1], components, docs[i, j])
+                except Exception as e:
+                    print(f"Could not cache parse: {e}")
+
+    return [
+        ParsedDocument(text, [(offset, docs[i, j]) for j, (offset, _) in enumerate(segments)], components)
+        for i, (text, segments) in enumerate(zip(texts, segmented))
+    ]
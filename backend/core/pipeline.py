@@ -0,0 +1,245 @@
+# backend/core/pipeline.py
+"""
+Document ingestion pipeline used by /process.
+
+Each document goes through explicit stages, run in a bounded thread pool so
+the API's event loop is never blocked by parsing, the transformer pass or
+the embedding models:
+
+    parse -> chunk -> embed -> analyze
+
+After each stage the document's status is set to the stage it completed
+('parsed', 'chunked', 'embedded'). The full analysis is then queued as a
+durable job (core/jobs.py) for the worker processes, which set 'analyzing'
+and finally 'complete' or 'failed' ('cancelled' if the job is cancelled).
+
+The document row is the ingest job's durable record: cancel() marks a job
+that hasn't reached 'embedded' as 'cancelled', and the run stops at its
+next stage boundary. The process running a job holds a lease on it by
+keeping the row's updated_at fresh; recover() takes over, with a
+conditional UPDATE, only documents whose lease has run out (their process
+died), so several API processes can share the database.
+
+Work is keyed on the PDF's content hash (core/content.py): content that was
+embedded or analyzed before, under any filename, skips those stages.
+
+A new version of a document already processed is handled incrementally
+(settings.incremental_reprocessing): only its changed pages are extracted,
+parsed and embedded again, and the analysis reuses the cached parses,
+section summaries and embeddings of the unchanged ones.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from .config import settings
+from .database import SessionLocal, Document, update_document_status
+from .parser import load_pdf_text
+from .processor import preprocess_and_chunk
+from .engine import DOCUMENT_REPORT_TASKS
+from .search import generate_and_store_embeddings, prewarm_embeddings, reuse_stored_embeddings
+from .content import hash_file, find_analysis
+from . import jobs, store
+
+_executor = ThreadPoolExecutor(max_workers=settings.ingest_concurrency, thread_name_prefix="ingest")
+
+# Statuses of a document whose ingest job is still to finish.
+INGEST_STATUSES = ("queued", "parsed", "chunked")
+
+# Ingest jobs submitted by this process and not finished yet, whose leases
+# _keep_leases() extends.
+_owned_jobs: set[str] = set()
+_owned_lock = threading.Lock()
+_lease_thread = None
+
+class IngestCancelled(Exception):
+    """Raised between stages when the ingest job was cancelled or superseded by a newer one."""
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+def cancel(job_id: str) -> bool:
+    """
+    Cancels an ingest job that hasn't made its document searchable yet.
+    A running job stops at its next stage boundary.
+    """
+    db = SessionLocal()
+    try:
+        db_document = db.query(Document).filter(Document.job_id == job_id).first()
+        if db_document is None or db_document.status not in INGEST_STATUSES:
+            return False
+        db_document.status = "cancelled"
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+def cancel_analysis(doc_id: int, ingest_job_id: str | None) -> bool:
+    """
+    Marks a document whose analysis job was cancelled as 'cancelled'. It
+    stays searchable; /process analyzes it again.
+    """
+    return update_document_status(doc_id, "cancelled", job_id=ingest_job_id, statuses=("embedded", "analyzing"))
+
+def _lease_expired():
+    # Documents not heard from for a lease (or never, before updated_at existed).
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.job_lease_seconds)
+    return or_(Document.updated_at.is_(None), Document.updated_at < cutoff)
+
+def _keep_leases():
+    # Extends the leases of this process's ingest jobs, queued or running.
+    while True:
+        time.sleep(settings.job_lease_seconds / 3)
+        with _owned_lock:
+            owned = list(_owned_jobs)
+        if not owned:
+            continue
+        db = SessionLocal()
+        try:
+            db.query(Document).filter(
+                Document.job_id.in_(owned), Document.status.in_(INGEST_STATUSES)
+            ).update({Document.updated_at: datetime.utcnow()}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            print(f"INGEST: could not extend the leases of {len(owned)} jobs: {e}")
+        finally:
+            db.close()
+
+def recover() -> int:
+    """
+    Queues again, under new job ids, the documents left in an ingest stage
+    whose lease ran out (their process died), and returns how many there
+    were. Each one is taken over with a conditional UPDATE, so when several
+    processes recover at once only one of them runs it.
+    """
+    db = SessionLocal()
+    try:
+        stale = db.query(Document.id, Document.job_id).filter(
+            Document.status.in_(INGEST_STATUSES), _lease_expired(),
+        ).all()
+        pending = []
+        for doc_id, old_job_id in stale:
+            job_id = new_job_id()
+            won = db.query(Document).filter(
+                Document.id == doc_id, Document.job_id == old_job_id,
+                Document.status.in_(INGEST_STATUSES), _lease_expired(),
+            ).update({
+                Document.status: "queued", Document.job_id: job_id, Document.updated_at: datetime.utcnow(),
+            }, synchronize_session=False)
+            db.commit()
+            if won:
+                db_document = db.query(Document).filter(Document.id == doc_id).first()
+                pending.append((db_document.filename, doc_id, job_id, db_document.content_hash))
+    finally:
+        db.close()
+    for filename, doc_id, job_id, content_hash in pending:
+        print(f"INGEST JOB {job_id}: re-queuing {filename}, left unfinished by a process that stopped.")
+        submit(filename=filename, doc_id=doc_id, job_id=job_id, content_hash=content_hash)
+    return len(pending)
+
+def recover_periodically():
+    """Runs recover() once per lease period, forever."""
+    while True:
+        try:
+            recover()
+        except Exception as e:
+            print(f"INGEST: recovery failed: {e}")
+        time.sleep(settings.job_lease_seconds)
+
+def _advance(doc_id: int, job_id: str, status: str, **fields) -> None:
+    # Records a finished stage, unless the job was cancelled or superseded meanwhile.
+    if not update_document_status(doc_id, status, job_id=job_id, statuses=INGEST_STATUSES, **fields):
+        raise IngestCancelled(f"Ingest job {job_id} was cancelled or superseded.")
+
+def submit(filename: str, doc_id: int, job_id: str, content_hash: str | None = None, force: bool = False):
+    """
+    Queues a document for ingestion. Returns the Future of the run.
+
+    With force=True, stored embeddings and analysis results of the same
+    content are ignored and everything is recomputed.
+    """
+    global _lease_thread
+    with _owned_lock:
+        _owned_jobs.add(job_id)
+        if _lease_thread is None:
+            _lease_thread = threading.Thread(target=_keep_leases, name="ingest-leases", daemon=True)
+            _lease_thread.start()
+    future = _executor.submit(run_pipeline, filename, doc_id, job_id, content_hash, force)
+    future.add_done_callback(lambda _: _release(job_id))
+    return future
+
+def _release(job_id: str):
+    with _owned_lock:
+        _owned_jobs.discard(job_id)
+
+def run_pipeline(filename: str, doc_id: int, job_id: str, content_hash: str | None = None, force: bool = False):
+    file_path = os.path.join(settings.upload_directory, filename)
+    timings = {}
+    started = time.perf_counter()
+    try:
+        # Cancelled while waiting for a free ingest thread?
+        _advance(doc_id, job_id, "queued")
+        if content_hash is None:
+            # Uploaded before content hashes were recorded.
+            content_hash = hash_file(file_path)
+            _advance(doc_id, job_id, "queued", content_hash=content_hash)
+
+        if not force and reuse_stored_embeddings(filename, content_hash):
+            _advance(doc_id, job_id, "embedded")
+            timings["reuse"] = time.perf_counter() - started
+        else:
+            # The version stored before this one, whose unchanged pages are reused.
+            previous = store.read_manifest(filename, settings.default_embedding_model)
+            pdf_text = load_pdf_text(
+                file_path, content_hash=content_hash, previous_hash=previous["content_hash"] if previous else None,
+            )
+            _advance(doc_id, job_id, "parsed")
+            timings["parse"] = time.perf_counter() - started
+
+            # Parse once for everything the analysis report needs too; the worker
+            # picks the cached parse up instead of running the transformer again.
+            chunks, spans, sentences = preprocess_and_chunk(
+                pdf_text.text, parse_for=DOCUMENT_REPORT_TASKS, with_spans=True, with_sentences=True,
+                page_starts=pdf_text.page_starts,
+            )
+            _advance(doc_id, job_id, "chunked")
+            timings["chunk"] = time.perf_counter() - started - sum(timings.values())
+
+            generate_and_store_embeddings(
+                doc_id=filename, chunks=chunks, spans=spans,
+                page_starts=pdf_text.page_starts, content_hash=content_hash, sentences=sentences,
+                page_hashes=pdf_text.page_hashes(),
+            )
+            _advance(doc_id, job_id, "embedded")
+            timings["embed"] = time.perf_counter() - started - sum(timings.values())
+    except IngestCancelled:
+        print(f"INGEST JOB {job_id}: stopped for {filename}; it was cancelled or re-queued.")
+        return
+    except Exception as e:
+        print(f"INGEST JOB {job_id} FAILED for {filename}: {e}")
+        update_document_status(doc_id, "failed", job_id=job_id)
+        return
+
+    stage_report = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in timings.items())
+
+    if settings.prewarm_models:
+        prewarm_embeddings(doc_id=filename, model_names=settings.prewarm_models)
+
+    analysis_results = None if force else find_analysis(content_hash)
+    if analysis_results is not None:
+        update_document_status(doc_id, "complete", job_id=job_id, analysis_results=analysis_results)
+        print(f"INGEST JOB {job_id}: {filename} complete ({stage_report}); reused the analysis of identical content.")
+        return
+
+    print(f"INGEST JOB {job_id}: {filename} searchable ({stage_report}). Queuing analysis.")
+
+    jobs.enqueue(
+        "analyze_document",
+        {"filename": filename, "doc_id": doc_id, "ingest_job_id": job_id},
+        priority=jobs.PRIORITY_BULK,
+    )
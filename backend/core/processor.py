@@ -1,36 +1,173 @@
 # core/processor.py (Corrected Version)
 import re
-# Import the shared nlp instance from our new models.py file
-from .models import nlp
+from itertools import groupby
+# The shared spaCy pipeline comes from the lazy model registry
+from .models import get_nlp, get_embedding_model
+from .config import settings
+from .tokens import token_counter, token_budget
 
-def preprocess_and_chunk(text: str, chunk_size_sentences: int = 5) -> list[str]:
+def clean_text(text: str) -> str:
+    """Replaces runs of whitespace with a single space."""
+    return re.sub(r'\s+', ' ', text).strip()
+
+def group_sentences(sentences: list, chunk_size_sentences: int = 5) -> list[str]:
+    """
+    Groups (start, end, text) sentences into chunks of 'chunk_size_sentences'.
+    """
+    chunks = []
+    for i in range(0, len(sentences), chunk_size_sentences):
+        chunk = " ".join(sent for _, _, sent in sentences[i:i + chunk_size_sentences])
+        chunks.append(chunk)
+    return chunks
+
+def group_sentence_spans(sentences: list, chunk_size_sentences: int = 5) -> list[list[int]]:
+    """
+    The [start, end] character span of each chunk group_sentences() builds.
+    """
+    spans = []
+    for i in range(0, len(sentences), chunk_size_sentences):
+        group = sentences[i:i + chunk_size_sentences]
+        spans.append([group[0][0], group[-1][1]])
+    return spans
+
+def _split_long_sentence(start: int, text: str, count_tokens, max_tokens: int) -> list[tuple[int, int, int]]:
+    """Splits one over-long sentence at word boundaries into (start, end, tokens) pieces."""
+    words = list(re.finditer(r"\S+", text))
+    pieces = []
+    first, last_end, total = None, None, 0
+    for word, tokens in zip(words, count_tokens([word.group() for word in words])):
+        if first is not None and total + tokens > max_tokens:
+            pieces.append((start + first, start + last_end, total))
+            first, total = None, 0
+        if first is None:
+            first = word.start()
+        total += tokens
+        last_end = word.end()
+    if first is not None:
+        pieces.append((start + first, start + last_end, total))
+    return pieces
+
+def chunk_by_tokens(sentences: list, count_tokens, max_tokens: int, overlap_tokens: int = 0) -> list[list[int]]:
+    """
+    Packs consecutive (start, end, text) sentences into chunks of at most
+    'max_tokens' tokens; sentences longer than that are split between words.
+
+    Args:
+        count_tokens: Maps a list of texts to their token counts (core/tokens.py).
+        overlap_tokens: Each chunk starts with up to this many tokens of
+            whole sentences from the end of the previous one.
+
+    Returns:
+        The [start, end] character span of every chunk.
+    """
+    pieces = []
+    for (start, end, text), tokens in zip(sentences, count_tokens([text for _, _, text in sentences])):
+        if tokens <= max_tokens:
+            pieces.append((start, end, tokens))
+        else:
+            pieces.extend(_split_long_sentence(start, text, count_tokens, max_tokens))
+
+    # More overlap than half a chunk would mostly repeat the previous chunk.
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+    spans = []
+    i = 0
+    while i < len(pieces):
+        j, total = i, 0
+        while j < len(pieces) and (j == i or total + pieces[j][2] <= max_tokens):
+            total += pieces[j][2]
+            j += 1
+        spans.append([pieces[i][0], pieces[j - 1][1]])
+        if j == len(pieces):
+            break
+        # Step back over trailing pieces for the overlap, but always move
+        # forward and leave room for the next new piece.
+        k, overlap = j, 0
+        room = min(overlap_tokens, max_tokens - pieces[j][2])
+        while k - 1 > i and overlap + pieces[k - 1][2] <= room:
+            k -= 1
+            overlap += pieces[k][2]
+        i = k
+    return spans
+
+def chunk_bounds(sentences: list, options: dict) -> list[list[int]]:
+    """
+    The [start, end] spans of the chunks: token-budgeted when the options
+    carry 'max_tokens' and 'count_tokens', else 'chunk_size_sentences' sentences each.
+    With 'page_starts' in the options, the sentences of every page are
+    chunked on their own, so no chunk spans pages.
+    """
+    if options.get("page_starts"):
+        from .parser import page_at
+        page_starts = options["page_starts"]
+        options = {name: value for name, value in options.items() if name != "page_starts"}
+        spans = []
+        for _, page_sentences in groupby(sentences, key=lambda sentence: page_at(page_starts, sentence[0])):
+            spans.extend(chunk_bounds(list(page_sentences), options))
+        return spans
+    if options.get("max_tokens") and options.get("count_tokens"):
+        return chunk_by_tokens(
+            sentences, options["count_tokens"], options["max_tokens"], options.get("overlap_tokens", 0)
+        )
+    return group_sentence_spans(sentences, options.get("chunk_size_sentences", 5))
+
+def chunk_options(chunk_size_sentences: int = 5, model_name: str | None = None) -> dict:
+    """The chunking options of the analysis engine's 'chunk_spans' task (see chunk_bounds)."""
+    options = {"chunk_size_sentences": chunk_size_sentences}
+    if settings.chunking == "tokens":
+        model = get_embedding_model(model_name or settings.default_embedding_model)
+        if model is not None:
+            options.update(
+                max_tokens=token_budget(model), count_tokens=token_counter(model),
+                overlap_tokens=settings.chunk_overlap_tokens,
+            )
+    return options
+
+def preprocess_and_chunk(
+    text: str, chunk_size_sentences: int = 5, parse_for=None, with_spans: bool = False, model_name: str | None = None,
+    with_sentences: bool = False, page_starts: list | None = None,
+):
     """
     Cleans, segments, and chunks text.
 
+    With settings.chunking == "tokens" (the default), chunks are packed up to
+    the token budget of the embedding model (see core/tokens.py) with
+    settings.chunk_overlap_tokens of overlap; otherwise every chunk is
+    'chunk_size_sentences' sentences.
+
     Args:
         text: The raw text string.
         chunk_size_sentences: The number of sentences to include in each chunk.
+        model_name: The embedding model the chunks are sized for
+            (default: settings.default_embedding_model).
+        parse_for: Analysis tasks (see core/engine.py) to also run the parser
+            for and cache, so the background report reuses this parse.
+        with_spans: Also return the [start, end] span of every chunk in
+            the cleaned text.
+        with_sentences: Also return the (start, end, text) sentences of
+            the cleaned text.
+        page_starts: The offset of every page in the cleaned text; with
+            settings.incremental_reprocessing, chunks don't span pages.
 
     Returns:
-        A list of clean text chunks.
+        A list of clean text chunks, or a tuple of the chunks followed by
+        the spans and/or the sentences.
     """
-    # This function will now use the imported 'nlp' object
-    if nlp is None:
+    extras = [name for name, wanted in (("chunk_spans", with_spans), ("sentences", with_sentences)) if wanted]
+    if get_nlp() is None:
         # Handle case where model failed to load
         print("SpaCy model not available. Cannot process text.")
-        return []
-
-    # 1. Basic Cleaning
-    text = re.sub(r'\s+', ' ', text).strip()  # Replace multiple whitespaces with a single space
+        return tuple([[]] * (1 + len(extras))) if extras else []
 
-    # 2. Process text with spaCy for sentence segmentation
-    doc = nlp(text)
-    sentences = [sent.text.strip() for sent in doc.sents]
+    from .engine import run_analysis
 
-    # 3. Group sentences into chunks
-    chunks = []
-    for i in range(0, len(sentences), chunk_size_sentences):
-        chunk = " ".join(sentences[i:i + chunk_size_sentences])
-        chunks.append(chunk)
+    # 1. Basic Cleaning
+    text = clean_text(text)  # Replace multiple whitespaces with a single space
 
-    return chunks
\ No newline at end of file
+    # 2. Sentence segmentation (one shared, cached parse) and 3. grouping into chunks
+    results = run_analysis(
+        text, ["chunks", *extras], options=chunk_options(chunk_size_sentences, model_name),
+        cache=parse_for is not None, parse_for=parse_for, page_starts=page_starts,
+    )
+    if extras:
+        return (results["chunks"], *(results[name] for name in extras))
+    return results["chunks"]
@@ -0,0 +1,81 @@
+# backend/core/quantize.py
+"""
+Compact resident copies of embedding matrices.
+
+The float32 matrices stay on disk (core/store.py) and are only memory-mapped;
+what a process keeps resident per document can instead be an int8 copy
+with one float32 scale per row (about a quarter of the size). Searches
+score the compact copy with vectorized products, then rescore the best
+candidates exactly against the float32 rows, so rankings are essentially
+unchanged.
+
+There is no float16 option: NumPy converts float16 to float32 in scalar
+code, which made float16 scoring several times slower than float32 for
+only half the memory savings of int8.
+"""
+import numpy as np
+
+from . import ann
+
+STORAGE_TYPES = ("float32", "int8")
+
+# Rows are upcast to float32 this many at a time while scoring, which keeps
+# the temporary in cache and lets the product run through BLAS.
+SCORE_BLOCK_ROWS = 1024
+
+class QuantizedMatrix:
+    def __init__(self, codes: np.ndarray, scales: np.ndarray | None = None):
+        # int8 rows whose true value is codes * scale.
+        self.codes = codes
+        self.scales = scales
+        self.shape = codes.shape
+
+    @classmethod
+    def from_float(cls, matrix: np.ndarray, storage: str) -> "QuantizedMatrix":
+        if storage == "int8":
+            matrix = np.asarray(matrix, dtype=np.float32)
+            scales = np.abs(matrix).max(axis=1) / 127 if matrix.size else np.zeros(matrix.shape[0], dtype=np.float32)
+            scales[scales == 0] = 1.0
+            codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+            return cls(codes, scales.astype(np.float32))
+        raise ValueError(f"Unknown embedding storage '{storage}' (use one of {STORAGE_TYPES}).")
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def concatenate(cls, parts: list["QuantizedMatrix"]) -> "QuantizedMatrix":
+        return cls(np.concatenate([part.codes for part in parts]), np.concatenate([part.scales for part in parts]))
+
+    def take(self, rows) -> "QuantizedMatrix":
+        """The given rows (indices or a boolean mask), as a new matrix."""
+        return QuantizedMatrix(self.codes[rows], self.scales[rows])
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Approximate inner products of every row with a (dim,) query, or with
+        a (n, dim) matrix of queries, which gives a (rows, n) matrix.
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        scores = np.empty((self.shape[0],) + queries.shape[:-1], dtype=np.float32)
+        for start in range(0, self.shape[0], SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + SCORE_BLOCK_ROWS] = block @ queries.T
+        if self.scales is not None:
+            scores *= self.scales.reshape((-1,) + (1,) * (scores.ndim - 1))
+        return scores
+
+def rescored_top_k(quantized: QuantizedMatrix, exact: np.ndarray, query: np.ndarray, top_k: int, factor: int):
+    """
+    Picks top_k * factor candidates with the quantized scores and ranks them
+    by their exact float32 scores.
+
+    Returns:
+        (row indices, exact scores), best first.
+    """
+    approximate = quantized.scores(query)
+    candidates = np.sort(ann.top_k_indices(approximate, max(top_k * factor, top_k)))
+    candidate_scores = exact[candidates] @ query
+    order = ann.top_k_indices(candidate_scores, top_k)
+    return candidates[order], candidate_scores[order]
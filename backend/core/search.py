@@ -1,65 +1,705 @@
-# backend/core/search.py (Corrected)
-from .models import embedding_models # Import the dictionary of models
+# backend/core/search.py
+from .models import get_embedding_model, is_embedding_model, get_cross_encoder
+from .config import settings
+from . import store
+from .cache import LRUCache, SingleFlight
+from .ann import IVFIndex, top_k_indices as _top_k
+from .parser import page_at
+from .lexical import LexicalIndex
+from .quantize import QuantizedMatrix, rescored_top_k
+from .batching import encode_query, encode_queries, encode_bucketed, pool_spans
+from .inference import mode_tag
+from . import metrics
+import threading
+import time
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
-# This store now holds the DEFAULT embeddings only (from MiniLM)
-document_store = {}
+def _cached_bytes(value) -> int:
+    return _document_bytes(value) if isinstance(value, dict) else value.nbytes
 
-def generate_and_store_embeddings(doc_id: str, chunks: list[str]):
+# Per-process cache, bounded by settings.embedding_cache_bytes, of:
+# - documents loaded from the disk store (see core/store.py), keyed by
+#   ("document", doc_id). Entries hold the chunk texts and a read-only memory
+#   map of the DEFAULT model's embeddings, and are refreshed whenever the
+#   manifest version changes. With settings.embedding_storage set to 'int8',
+#   they also hold a compact copy of the embeddings that searches score
+#   first (core/quantize.py), and once loaded, the BM25 index.
+# - the embeddings of the document chunks under every OTHER model, keyed by
+#   (doc_id, model_name, version). Misses are filled from the disk store, or
+#   by encoding the chunks once and persisting the result so the other
+#   workers don't have to.
+embedding_cache = LRUCache(settings.embedding_cache_bytes, sizeof=_cached_bytes)
+_encode_flight = SingleFlight()
+
+# Corpus-wide ANN index over the default model's embeddings of every
+# processed document. It follows the store manifest, so documents embedded
+# by another worker show up after at most 'corpus_sync_interval' seconds.
+corpus_index = IVFIndex(
+    nlist=settings.corpus_nlist,
+    nprobe=settings.corpus_nprobe,
+    exact_threshold=settings.corpus_exact_threshold,
+    rescore_factor=settings.rescore_factor,
+)
+_corpus_sync_lock = threading.Lock()
+_corpus_synced_at = 0.0
+
+def _document_key(doc_id: str) -> tuple:
+    return ("document", doc_id)
+
+def evict_document(doc_id: str) -> None:
+    """Drops this process's loaded copy of a document; the next use reloads it from the store."""
+    embedding_cache.pop(_document_key(doc_id))
+
+def invalidate_document(doc_id: str, content_hash: str) -> None:
     """
-    Generates and stores embeddings using the FAST, DEFAULT model.
+    Takes a document out of search when it was re-uploaded with other
+    content, until the new version is embedded (see store.mark_stale).
+    Other processes drop it at their next load or corpus sync.
     """
-    default_model_name = 'all-MiniLM-L6-v2'
-    if default_model_name not in embedding_models:
-        print(f"Default model {default_model_name} not loaded.")
-        return
-    
-    # --- FIX: Select the default model from the dictionary ---
-    default_model = embedding_models[default_model_name]
-    print(f"Generating default embeddings for {len(chunks)} chunks using {default_model_name}")
+    if store.mark_stale(doc_id, content_hash):
+        evict_document(doc_id)
+        corpus_index.remove(doc_id)
 
-    embeddings = default_model.encode(chunks, show_progress_bar=True)
+def _require_model(model_name: str):
+    model = get_embedding_model(model_name)
+    if model is None:
+        raise ValueError(f"Model '{model_name}' could not be loaded.")
+    return model
 
-    document_store[doc_id] = {
-        "chunks": chunks,
-        "embeddings": embeddings,
-        "model_name": default_model_name # Track which model was used
-    }
+def _page_keys(spans: list, page_starts: list, page_hashes: list) -> list[tuple]:
+    """
+    (page hash, start, end) of every span, with the offsets relative to its
+    page: the same for the same span of an unchanged page in any version.
+    """
+    keys = []
+    for start, end in spans:
+        page = page_at(page_starts, start) - 1
+        keys.append((page_hashes[page], start - page_starts[page], end - page_starts[page]))
+    return keys
+
+def _previous_rows(doc_id: str) -> tuple[dict, dict]:
+    """
+    The stored sentence and chunk embeddings of a document's current version
+    by page key (see _page_keys), for its next version to reuse. Empty if
+    that version was stored without page hashes, or embedded in another
+    inference mode (int8 and float32 rows mustn't be mixed in one matrix).
+    """
+    entry = store.read_manifest(doc_id, settings.default_embedding_model)
+    if entry is None:
+        return {}, {}
+    sidecar = store.load_sidecar(entry["chunks_path"])
+    if sidecar.get("embedding_mode") != mode_tag("embedding"):
+        return {}, {}
+    page_starts, page_hashes = sidecar.get("page_starts"), sidecar.get("page_hashes")
+    if not page_starts or not page_hashes:
+        return {}, {}
+    sentence_rows = {}
+    if entry["sentences_path"] and sidecar.get("sentence_spans"):
+        matrix = store.load_matrix(entry["sentences_path"])
+        sentence_rows = dict(zip(_page_keys(sidecar["sentence_spans"], page_starts, page_hashes), matrix))
+    chunk_rows = {}
+    if sidecar.get("spans"):
+        matrix = store.load_matrix(entry["matrix_path"])
+        chunk_rows = dict(zip(_page_keys(sidecar["spans"], page_starts, page_hashes), matrix))
+    return sentence_rows, chunk_rows
+
+def _encode_reusing(model, texts: list[str], keys: list | None, previous: dict, kind: str) -> np.ndarray:
+    """
+    Encodes the texts whose key has no row in 'previous' (rows of the last
+    version, see _previous_rows) and copies the other rows from there.
+    """
+    missing = [i for i, key in enumerate(keys) if key not in previous] if keys and previous else list(range(len(texts)))
+    if len(missing) == len(texts):
+        return encode_bucketed(model, texts, show_progress_bar=True)
+    reused = len(texts) - len(missing)
+    metrics.cache_events.inc(reused, cache=f"page_{kind}_embeddings", result="hit")
+    metrics.cache_events.inc(len(missing), cache=f"page_{kind}_embeddings", result="miss")
+    print(f"Reusing {reused} of {len(texts)} {kind} embeddings from unchanged pages")
+    rows = np.empty((len(texts), len(next(iter(previous.values())))), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in previous:
+            rows[i] = previous[key]
+    if missing:
+        rows[missing] = encode_bucketed(model, [texts[i] for i in missing], show_progress_bar=True)
+    return rows
+
+def generate_and_store_embeddings(
+    doc_id: str, chunks: list[str], spans: list | None = None,
+    page_starts: list | None = None, content_hash: str | None = None, sentences: list | None = None,
+    embeddings=None, sentence_embeddings=None, page_hashes: list | None = None,
+):
+    """
+    Generates embeddings using the FAST, DEFAULT model and persists them to the store.
+    'spans' and 'page_starts' let search results report the page of a chunk.
+
+    Given the (start, end, text) 'sentences' of the text, every sentence is
+    encoded once and stored for the analysis (see get_sentence_embeddings);
+    with settings.chunk_embeddings == "pooled", the chunk embeddings are
+    pooled from them instead of encoded again.
+
+    'embeddings' (of the chunks) and 'sentence_embeddings' (of the
+    sentences) may be passed in when the caller has already encoded them,
+    e.g. in large batches across documents (ingest.py).
+
+    Given the 'page_hashes' of the text (core/parser.py), sentences and
+    chunks on pages that are unchanged since the version stored before take
+    their embeddings from it; only the changed pages are encoded.
+    """
+    default_model_name = settings.default_embedding_model
+    default_model = get_embedding_model(default_model_name)
+    if default_model is None:
+        raise RuntimeError(f"Default model {default_model_name} could not be loaded.")
+
+    previous_sentences, previous_chunks = {}, {}
+    if page_hashes and page_starts and settings.incremental_reprocessing:
+        previous_sentences, previous_chunks = _previous_rows(doc_id)
+
+    def page_keys(spans):
+        return _page_keys(spans, page_starts, page_hashes) if previous_sentences or previous_chunks else None
+
+    sentence_spans = None
+    if not sentences:
+        sentence_embeddings = None
+    else:
+        sentence_spans = [[start, end] for start, end, _ in sentences]
+        if sentence_embeddings is None:
+            print(f"Generating sentence embeddings for {len(sentences)} sentences using {default_model_name}")
+            sentence_embeddings = _encode_reusing(
+                default_model, [sentence for _, _, sentence in sentences],
+                page_keys(sentence_spans), previous_sentences, "sentence",
+            )
+        sentence_embeddings = store.normalize_rows(sentence_embeddings)
+
+    if embeddings is not None:
+        print(f"Storing {len(chunks)} precomputed chunk embeddings")
+    elif sentence_embeddings is not None and spans and settings.chunk_embeddings == "pooled":
+        embeddings, missing = pool_spans(sentence_spans, sentence_embeddings, spans)
+        if missing:
+            embeddings[missing] = store.normalize_rows(encode_bucketed(default_model, [chunks[i] for i in missing]))
+        print(f"Pooled {len(chunks) - len(missing)} of {len(chunks)} chunk embeddings from the sentences")
+    else:
+        print(f"Generating default embeddings for {len(chunks)} chunks using {default_model_name}")
+        embeddings = _encode_reusing(
+            default_model, chunks, page_keys(spans) if spans else None, previous_chunks, "chunk",
+        )
+
+    store.write_document(
+        doc_id=doc_id, model_name=default_model_name, chunks=chunks, embeddings=embeddings,
+        spans=spans, page_starts=page_starts, content_hash=content_hash,
+        lexical=LexicalIndex.build(chunks),
+        sentence_spans=sentence_spans, sentence_embeddings=sentence_embeddings, page_hashes=page_hashes,
+        embedding_mode=mode_tag("embedding"),
+    )
+    evict_document(doc_id)
+    doc_data = load_document(doc_id)
+    if doc_data is not None:
+        corpus_index.add(doc_id, doc_data["embeddings"], version=doc_data["version"])
     print(f"Successfully stored default embeddings for {doc_id}")
 
+def reuse_stored_embeddings(doc_id: str, content_hash: str | None) -> bool:
+    """
+    Makes a document searchable without encoding anything if its content has
+    been embedded before: its own current embeddings, or those of another
+    document with the same content hash (the store files are shared).
+
+    Returns:
+        True if the document is now searchable, False if it must be embedded.
+    """
+    if not content_hash:
+        return False
+    entry = store.read_manifest(doc_id, settings.default_embedding_model)
+    if entry is None or entry["content_hash"] != content_hash:
+        source = store.find_by_content(content_hash, settings.default_embedding_model)
+        if source is None or store.link_document(source["doc_id"], doc_id) is None:
+            return False
+        print(f"Reusing the stored embeddings of {source['doc_id']} for {doc_id} (same content).")
+    doc_data = load_document(doc_id)
+    if doc_data is None:
+        return False
+    corpus_index.add(doc_id, doc_data["embeddings"], version=doc_data["version"])
+    return True
+
+def get_sentence_embeddings(doc_id: str, content_hash: str | None = None) -> dict | None:
+    """
+    The stored embeddings of a document's sentences (default model, unit
+    length), as {(start, end): row} over the cleaned text, or None if it was
+    stored without them or from other content than 'content_hash'.
+    """
+    entry = store.read_manifest(doc_id, settings.default_embedding_model)
+    if entry is None or not entry.get("sentences_path"):
+        return None
+    if content_hash and entry["content_hash"] and entry["content_hash"] != content_hash:
+        return None
+    sentence_spans = store.load_sidecar(entry["chunks_path"]).get("sentence_spans")
+    if not sentence_spans:
+        return None
+    matrix = store.load_matrix(entry["sentences_path"])
+    return {(start, end): matrix[i] for i, (start, end) in enumerate(sentence_spans)}
+
+def load_document(doc_id: str) -> dict | None:
+    """
+    Returns the cached entry for a document, (re)loading it from the disk store
+    if this process has not seen it yet or another process re-embedded it.
+    Returns None for documents whose stored embeddings are stale.
+    """
+    entry = store.read_manifest(doc_id, settings.default_embedding_model)
+    if entry is None or entry["stale"]:
+        evict_document(doc_id)
+        return None
+
+    cached = embedding_cache.get(_document_key(doc_id))
+    if cached is not None and cached["version"] == entry["version"]:
+        return cached
+
+    quantized = None
+    if settings.embedding_storage != "float32":
+        quantized = QuantizedMatrix.from_float(store.read_matrix(entry["matrix_path"]), settings.embedding_storage)
+
+    sidecar = store.load_sidecar(entry["chunks_path"])
+    spans, page_starts = sidecar.get("spans"), sidecar.get("page_starts")
+    cached = {
+        "doc_id": doc_id,
+        "chunks": sidecar["chunks"],
+        "spans": spans,
+        # The page each chunk starts on, or None for documents stored without offsets.
+        "pages": [page_at(page_starts, start) for start, _ in spans] if spans and page_starts else None,
+        "embeddings": store.load_matrix(entry["matrix_path"]),
+        "quantized": quantized,
+        "model_name": entry["model_name"],
+        "version": entry["version"],
+        "content_hash": entry["content_hash"],
+        "chunks_path": entry["chunks_path"],
+        # The BM25 index, loaded on the first hybrid search (see get_lexical_index).
+        "lexical": None,
+    }
+    embedding_cache.put(_document_key(doc_id), cached)
+    return cached
+
+def _quantized(doc_data: dict, model_name: str) -> QuantizedMatrix | None:
+    """The compact copy of the embeddings of 'model_name', if one is resident."""
+    return doc_data.get("quantized") if model_name == doc_data["model_name"] else None
+
+def _dense_top_k(doc_data: dict, model_name: str, embeddings, query_embedding: np.ndarray, top_k: int):
+    """
+    The top_k chunks by cosine similarity, as (row indices, scores). Quantized
+    documents are scored approximately first and the best candidates exactly.
+    """
+    quantized = _quantized(doc_data, model_name)
+    if quantized is not None:
+        return rescored_top_k(quantized, embeddings, query_embedding, top_k, settings.rescore_factor)
+    # Stored rows are unit length, so cosine similarity is a dot product.
+    scores = embeddings @ query_embedding
+    order = _top_k(scores, top_k)
+    return order, scores[order]
+
+def _document_bytes(doc_data: dict) -> int:
+    memory = document_memory(doc_data["doc_id"], doc_data)
+    return memory["embeddings_resident_bytes"] + memory["chunk_text_bytes"] + memory["lexical_bytes"]
+
+def document_memory(doc_id: str, doc_data: dict) -> dict:
+    """Approximate bytes this process holds (or maps) for one loaded document."""
+    mapped = doc_data["embeddings"]
+    quantized = doc_data.get("quantized")
+    return {
+        "doc_id": doc_id,
+        "chunks": len(doc_data["chunks"]),
+        "storage": "float32" if quantized is None else settings.embedding_storage,
+        # Searches only touch the float32 matrix through the memory map (all of
+        # it unless a quantized copy is resident, then just rescored rows).
+        "embeddings_mapped_bytes": int(mapped.nbytes),
+        "embeddings_resident_bytes": int(quantized.nbytes if quantized is not None else mapped.nbytes),
+        "chunk_text_bytes": sum(len(chunk) for chunk in doc_data["chunks"]),
+        "lexical_bytes": doc_data["lexical"].nbytes() if doc_data["lexical"] is not None else 0,
+    }
+
+def memory_stats() -> dict:
+    """Per-document and total memory of the loaded documents and the embedding cache."""
+    documents = [
+        document_memory(key[1], value) for key, value in embedding_cache.items()
+        if isinstance(value, dict)
+    ]
+    totals = {
+        key: sum(d[key] for d in documents)
+        for key in ("embeddings_mapped_bytes", "embeddings_resident_bytes", "chunk_text_bytes", "lexical_bytes")
+    }
+    return {
+        "storage": settings.embedding_storage,
+        "documents": documents,
+        "totals": totals,
+        "embedding_cache": embedding_cache.stats(),
+    }
+
+def chunk_page(doc_data: dict, chunk_index: int) -> int | None:
+    pages = doc_data.get("pages")
+    return pages[chunk_index] if pages else None
+
+def get_lexical_index(doc_data: dict) -> LexicalIndex:
+    """
+    The document's BM25 index. Documents stored before lexical indexes
+    existed get theirs built (and stored) on first use.
+    """
+    if doc_data["lexical"] is None:
+        index = store.load_lexical(doc_data["chunks_path"])
+        if index is None:
+            metrics.reembed_fallbacks.inc(kind="lexical")
+            index = LexicalIndex.build(doc_data["chunks"])
+            try:
+                store.write_lexical(doc_data["chunks_path"], index)
+            except OSError as e:
+                print(f"Could not store the lexical index: {e}")
+        doc_data["lexical"] = index
+        embedding_cache.refresh(_document_key(doc_data["doc_id"]))
+    return doc_data["lexical"]
+
+def get_embeddings(doc_id: str, model_name: str, doc_data: dict | None = None):
+    """
+    Returns the (unit-length) chunk embeddings of a document under any model.
+
+    The default model's matrix comes straight from the document entry; other
+    models go through 'embedding_cache'. Concurrent misses for the same key
+    are collapsed so a document is only ever encoded once at a time.
+    """
+    if doc_data is None:
+        doc_data = load_document(doc_id)
+        if doc_data is None:
+            return None
+    if model_name == doc_data.get("model_name"):
+        return doc_data["embeddings"]
+
+    key = (doc_id, model_name, doc_data["version"])
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        return cached
+
+    def fill():
+        # Another request may have filled the cache while we waited.
+        cached = embedding_cache.get(key)
+        if cached is not None:
+            return cached
+        entry = store.read_manifest(doc_id, model_name)
+        if entry is None or entry["version"] != doc_data["version"]:
+            # A document with the same content may have encoded these chunks already.
+            entry = store.link_embeddings(doc_id, model_name, version=doc_data["version"])
+        if entry is not None and entry["version"] == doc_data["version"]:
+            print(f"Loading stored '{model_name}' embeddings for {doc_id}.")
+            embeddings = store.load_matrix(entry["matrix_path"])
+        else:
+            print(f"Encoding {len(doc_data['chunks'])} chunks of {doc_id} with '{model_name}'.")
+            metrics.reembed_fallbacks.inc(kind="embeddings", model=model_name)
+            embeddings = store.normalize_rows(encode_bucketed(_require_model(model_name), doc_data["chunks"]))
+            store.write_embeddings(doc_id, model_name, embeddings, version=doc_data["version"])
+        # Older versions of this document can never be hit again.
+        embedding_cache.discard(
+            lambda k: len(k) == 3 and k[0] == doc_id and k[1] == model_name and k[2] != doc_data["version"]
+        )
+        embedding_cache.put(key, embeddings)
+        return embeddings
+
+    return _encode_flight.do(key, fill)
+
+def prewarm_embeddings(doc_id: str, model_names: list[str]):
+    """
+    Fills the embedding cache (and the disk store) for extra models.
+    Meant to run as a background task right after a document is processed.
+    """
+    for model_name in model_names:
+        if not is_embedding_model(model_name):
+            print(f"Skipping pre-warm with unknown model '{model_name}'.")
+            continue
+        try:
+            get_embeddings(doc_id, model_name)
+        except Exception as e:
+            print(f"Pre-warming '{model_name}' embeddings for {doc_id} failed: {e}")
+
+@metrics.timed("search")
 def semantic_search(doc_id: str, query: str, model_name: str, top_k: int = 5):
     """
     Performs semantic search using a SPECIFIED model.
     """
-    if model_name not in embedding_models:
+    if not is_embedding_model(model_name):
         raise ValueError(f"Model '{model_name}' is not available.")
-    
-    if doc_id not in document_store:
+
+    doc_data = load_document(doc_id)
+    if doc_data is None:
         print(f"Error: Document '{doc_id}' not found in store.")
         return []
 
-    # Select the requested model from the dictionary
-    selected_model = embedding_models[model_name]
-    
-    doc_data = document_store[doc_id]
     doc_chunks = doc_data["chunks"]
-    
-    if model_name == doc_data.get("model_name"):
-        print(f"Performing search with pre-calculated '{model_name}' embeddings.")
-        doc_embeddings = doc_data["embeddings"]
-    else:
-        print(f"Performing on-the-fly re-embedding and search with '{model_name}'.")
-        doc_embeddings = selected_model.encode(doc_chunks, show_progress_bar=False)
-    
-    query_embedding = selected_model.encode([query])
-    similarities = cosine_similarity(query_embedding, doc_embeddings)[0]
-    top_k_indices = np.argsort(similarities)[::-1][:top_k]
+    if not doc_chunks:
+        return []
+
+    doc_embeddings = get_embeddings(doc_id, model_name, doc_data)
+
+    query_embedding = encode_query(model_name, query)
+    top_k_indices, similarities = _dense_top_k(doc_data, model_name, doc_embeddings, query_embedding, top_k)
 
     results = []
-    for idx in top_k_indices:
+    for idx, score in zip(top_k_indices, similarities):
         results.append({
             "chunk": doc_chunks[idx],
-            "score": float(similarities[idx])
+            "page": chunk_page(doc_data, idx),
+            "score": float(score)
+        })
+    return results
+
+@metrics.timed("rerank_search")
+def rerank_search(doc_id: str, query: str, rerank_model: str, top_k: int = 5, candidates: int = 50):
+    """
+    Two-stage search: recall 'candidates' chunks with the precomputed default
+    embeddings, then rescore only those with a stronger model.
+
+    Args:
+        rerank_model: A loaded embedding model (bi-encoder) or one of
+            settings.cross_encoder_models.
+
+    Returns:
+        A (results, stats) tuple; stats has the per-stage timings in
+        milliseconds and the number of candidates that were reranked.
+    """
+    is_cross_encoder = rerank_model in settings.cross_encoder_models
+    if not is_cross_encoder and not is_embedding_model(rerank_model):
+        raise ValueError(f"Model '{rerank_model}' is not available.")
+
+    started = time.perf_counter()
+    doc_data = load_document(doc_id)
+    if doc_data is None or not doc_data["chunks"]:
+        return [], {}
+    doc_chunks = doc_data["chunks"]
+
+    # --- Stage 1: recall with the stored default-model embeddings ---
+    query_embedding = encode_query(doc_data["model_name"], query)
+    candidate_indices, _ = _dense_top_k(
+        doc_data, doc_data["model_name"], doc_data["embeddings"], query_embedding, max(candidates, top_k)
+    )
+    recalled = time.perf_counter()
+
+    # --- Stage 2: rescore the candidates only ---
+    candidate_chunks = [doc_chunks[i] for i in candidate_indices]
+    if is_cross_encoder:
+        cross_encoder = get_cross_encoder(rerank_model)
+        if cross_encoder is None:
+            raise ValueError(f"Model '{rerank_model}' could not be loaded.")
+        with metrics.timer("rerank"):
+            scores = np.asarray(cross_encoder.predict([(query, chunk) for chunk in candidate_chunks]))
+    else:
+        model = _require_model(rerank_model)
+        # If the full matrix for this model is already cached, just look the rows up.
+        full_matrix = embedding_cache.get((doc_id, rerank_model, doc_data["version"]))
+        if full_matrix is not None:
+            candidate_embeddings = full_matrix[candidate_indices]
+        else:
+            candidate_embeddings = store.normalize_rows(encode_bucketed(model, candidate_chunks))
+        scores = candidate_embeddings @ encode_query(rerank_model, query)
+    order = _top_k(scores, top_k)
+    reranked = time.perf_counter()
+
+    results = [
+        {"chunk": candidate_chunks[i], "page": chunk_page(doc_data, candidate_indices[i]), "score": float(scores[i])}
+        for i in order
+    ]
+    stats = {
+        "candidates": len(candidate_indices),
+        "timings_ms": {
+            "retrieve": round((recalled - started) * 1000, 2),
+            "rerank": round((reranked - recalled) * 1000, 2),
+            "total": round((reranked - started) * 1000, 2),
+        },
+    }
+    return results, stats
+
+def _ranks(scores: np.ndarray, rows: np.ndarray) -> dict:
+    """{row: 1-based rank} of 'rows' ordered by descending score."""
+    order = rows[np.argsort(-scores[rows], kind="stable")]
+    return {int(row): rank for rank, row in enumerate(order, start=1)}
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    spread = values.max() - values.min() if values.size else 0
+    return (values - values.min()) / spread if spread > 0 else np.zeros_like(values)
+
+@metrics.timed("hybrid_search")
+def hybrid_search(
+    doc_id: str, query: str, model_name: str, top_k: int = 5,
+    fusion: str | None = None, alpha: float | None = None, lexical_candidates: int | None = None,
+):
+    """
+    Combines BM25 over the document's inverted index with dense scores.
+
+    Args:
+        fusion: 'rrf' (reciprocal rank fusion) or 'weighted' (min-max
+            normalised scores mixed with 'alpha', the dense weight).
+        lexical_candidates: Only score the top-N BM25 chunks densely. Defaults
+            to settings.hybrid_lexical_candidates for documents with at least
+            settings.hybrid_prune_min_chunks chunks; 0 disables pruning.
+
+    Returns:
+        A list of {"chunk", "page", "score", "dense_score", "bm25_score"} dicts.
+    """
+    if not is_embedding_model(model_name):
+        raise ValueError(f"Model '{model_name}' is not available.")
+    fusion = fusion or settings.hybrid_fusion
+    if fusion not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method '{fusion}'.")
+    alpha = settings.hybrid_alpha if alpha is None else alpha
+
+    doc_data = load_document(doc_id)
+    if doc_data is None or not doc_data["chunks"]:
+        return []
+    num_chunks = len(doc_data["chunks"])
+
+    bm25 = get_lexical_index(doc_data).score(query)
+    lexical_rows = np.flatnonzero(bm25)
+    if lexical_candidates is None:
+        lexical_candidates = settings.hybrid_lexical_candidates if num_chunks >= settings.hybrid_prune_min_chunks else 0
+
+    # Dense scores, either for every chunk or only for the lexical candidates.
+    embeddings = get_embeddings(doc_id, model_name, doc_data)
+    query_embedding = encode_query(model_name, query)
+    if lexical_candidates and lexical_rows.size:
+        # Sorted, so the rows are gathered from the memory map in file order.
+        dense_rows = np.sort(lexical_rows[_top_k(bm25[lexical_rows], lexical_candidates)])
+        dense = np.full(num_chunks, -np.inf, dtype=np.float32)
+        dense[dense_rows] = embeddings[dense_rows] @ query_embedding
+    else:
+        dense_rows = np.arange(num_chunks)
+        quantized = _quantized(doc_data, model_name)
+        dense = quantized.scores(query_embedding) if quantized is not None else embeddings @ query_embedding
+
+    # Fuse over the top of both rankings.
+    depth = max(settings.hybrid_depth, top_k)
+    dense_top = dense_rows[_top_k(dense[dense_rows], depth)]
+    lexical_top = lexical_rows[_top_k(bm25[lexical_rows], depth)] if lexical_rows.size else lexical_rows
+    candidates = np.union1d(dense_top, lexical_top)
+    if dense_rows.size == num_chunks and _quantized(doc_data, model_name) is not None:
+        # The dense scores were approximate; make the fused candidates' exact.
+        dense[candidates] = embeddings[candidates] @ query_embedding
+
+    if fusion == "rrf":
+        dense_ranks, lexical_ranks = _ranks(dense, dense_top), _ranks(bm25, lexical_top)
+        k = settings.hybrid_rrf_k
+        fused = np.array([
+            1 / (k + dense_ranks[row]) if row in dense_ranks else 0.0 for row in candidates.tolist()
+        ]) + np.array([
+            1 / (k + lexical_ranks[row]) if row in lexical_ranks else 0.0 for row in candidates.tolist()
+        ])
+    else:
+        dense_candidates = dense[candidates]
+        finite = np.isfinite(dense_candidates)
+        dense_norm = np.zeros_like(dense_candidates)
+        dense_norm[finite] = _min_max(dense_candidates[finite])
+        fused = alpha * dense_norm + (1 - alpha) * _min_max(bm25[candidates])
+
+    results = []
+    for i in _top_k(fused, top_k):
+        row = int(candidates[i])
+        results.append({
+            "chunk": doc_data["chunks"][row],
+            "page": chunk_page(doc_data, row),
+            "score": float(fused[i]),
+            "dense_score": float(dense[row]) if np.isfinite(dense[row]) else None,
+            "bm25_score": float(bm25[row]),
         })
-    return results
\ No newline at end of file
+    return results
+
+def sync_corpus_index(force: bool = False):
+    """
+    Brings the corpus index in line with the store manifest: adds new or
+    re-embedded documents and drops deleted or stale ones.
+    """
+    global _corpus_synced_at
+    with _corpus_sync_lock:
+        if not force and time.monotonic() - _corpus_synced_at < settings.corpus_sync_interval:
+            return
+        manifest = {e["doc_id"]: e for e in store.list_manifest(settings.default_embedding_model) if not e["stale"]}
+        indexed = corpus_index.versions()
+        for doc_id in indexed.keys() - manifest.keys():
+            corpus_index.remove(doc_id)
+        for doc_id, entry in manifest.items():
+            if indexed.get(doc_id) != entry["version"]:
+                doc_data = load_document(doc_id)
+                if doc_data is not None:
+                    corpus_index.add(doc_id, doc_data["embeddings"], version=doc_data["version"])
+        _corpus_synced_at = time.monotonic()
+
+@metrics.timed("corpus_search")
+def corpus_search(query: str, top_k: int = 10, nprobe: int | None = None, exact: bool = False):
+    """
+    Searches every processed document at once through the corpus ANN index.
+
+    Returns:
+        A list of {"filename", "chunk_index", "chunk", "page", "score"} dicts, best first.
+    """
+    sync_corpus_index()
+    query_embedding = encode_query(settings.default_embedding_model, query)
+    hits = corpus_index.search(query_embedding, top_k=top_k, nprobe=nprobe, exact=exact)
+
+    results = []
+    for doc_id, chunk_index, score in hits:
+        doc_data = load_document(doc_id)
+        if doc_data is None or chunk_index >= len(doc_data["chunks"]):
+            continue
+        results.append({
+            "filename": doc_id,
+            "chunk_index": chunk_index,
+            "chunk": doc_data["chunks"][chunk_index],
+            "page": chunk_page(doc_data, chunk_index),
+            "score": score,
+        })
+    return results
+
+@metrics.timed("batch_search")
+def batch_search(doc_ids: list[str], queries: list[str], model_name: str, top_k: int = 5):
+    """
+    Runs many queries against one or more documents at once.
+
+    The queries are encoded in one call and scored against the chunks of
+    each document with a single matrix multiply (of the quantized copy, if
+    resident, followed by exact rescoring of the best candidates).
+
+    Returns:
+        One list of {"filename", "chunk_index", "chunk", "page", "score"} dicts per
+        query, best first across all the documents.
+    """
+    if not is_embedding_model(model_name):
+        raise ValueError(f"Model '{model_name}' is not available.")
+
+    documents = []
+    for doc_id in dict.fromkeys(doc_ids):
+        doc_data = load_document(doc_id)
+        if doc_data is not None and doc_data["chunks"]:
+            documents.append((doc_id, doc_data, get_embeddings(doc_id, model_name, doc_data)))
+    if not documents or not queries:
+        return [[] for _ in queries]
+
+    query_matrix = encode_queries(model_name, queries)
+    blocks = []
+    for _, doc_data, embeddings in documents:
+        quantized = _quantized(doc_data, model_name)
+        blocks.append(quantized.scores(query_matrix) if quantized is not None else embeddings @ query_matrix.T)
+    # (total chunks, queries). Row i belongs to document owners[i], chunk i - starts[owners[i]].
+    scores = blocks[0] if len(blocks) == 1 else np.concatenate(blocks)
+    starts = np.cumsum([0] + [block.shape[0] for block in blocks[:-1]])
+    owners = np.repeat(np.arange(len(documents)), [block.shape[0] for block in blocks])
+    any_quantized = any(_quantized(doc_data, model_name) is not None for _, doc_data, _ in documents)
+    depth = top_k * settings.rescore_factor if any_quantized else top_k
+
+    results = []
+    for query_index, query_embedding in enumerate(query_matrix):
+        query_scores = scores[:, query_index]
+        hits = []
+        for row in _top_k(query_scores, depth):
+            doc_index = owners[row]
+            doc_id, doc_data, embeddings = documents[doc_index]
+            chunk_index = int(row - starts[doc_index])
+            score = query_scores[row]
+            if _quantized(doc_data, model_name) is not None:
+                score = embeddings[chunk_index] @ query_embedding
+            hits.append({
+                "filename": doc_id,
+                "chunk_index": chunk_index,
+                "chunk": doc_data["chunks"][chunk_index],
+                "page": chunk_page(doc_data, chunk_index),
+                "score": float(score),
+            })
+        hits.sort(key=lambda hit: hit["score"], reverse=True)
+        results.append(hits[:top_k])
+    return results
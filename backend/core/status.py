@@ -0,0 +1,133 @@
+# backend/core/status.py
+"""
+Cheap reads of a document's status for polling clients.
+
+Every change to a document's status, job or analysis results bumps its
+version (see core/database.py), which status responses carry as their
+ETag. A poll whose If-None-Match still matches is answered from a query of
+a few small columns, without loading or parsing the analysis results. The
+results are stored as JSON text (and gzip) and are spliced into responses
+as they are, never round-tripped through json.loads.
+
+The analysis runs in other processes, so changes are found by re-reading
+the version every settings.status_poll_interval seconds; that query is a
+single indexed row lookup.
+"""
+import json
+
+import anyio
+
+from .config import settings
+from .database import SessionLocal, Document
+
+# Statuses after which nothing changes until the document is re-queued.
+FINAL_STATUSES = ("complete", "failed", "cancelled")
+
+def _state(row, filename: str) -> dict:
+    return {
+        "doc_id": row.id, "filename": filename, "status": row.status,
+        # Rows from before versions were tracked have none.
+        "version": row.version or 0, "created_at": row.created_at,
+    }
+
+def snapshot(filename: str) -> dict | None:
+    """The document's id, status and version, or None if there is no such document."""
+    db = SessionLocal()
+    try:
+        row = db.query(Document.id, Document.status, Document.version, Document.created_at).filter(
+            Document.filename == filename
+        ).first()
+    finally:
+        db.close()
+    return _state(row, filename) if row is not None else None
+
+def etag(state: dict) -> str:
+    return f'"{state["doc_id"]}-{state["version"]}"'
+
+def etag_matches(if_none_match: str | None, state: dict) -> bool:
+    if not if_none_match:
+        return False
+    tag = etag(state)
+    return any(candidate.strip().removeprefix("W/") in (tag, "*") for candidate in if_none_match.split(","))
+
+def _envelope(state: dict) -> str:
+    return json.dumps({
+        "doc_id": state["doc_id"],
+        "filename": state["filename"],
+        "status": state["status"],
+        "version": state["version"],
+        "created_at": state["created_at"].isoformat() if state["created_at"] else None,
+    })
+
+def status_body(filename: str) -> tuple[dict, bytes] | None:
+    """
+    The full status response as JSON bytes: the snapshot plus, once the
+    document is complete, its stored analysis results (spliced in unparsed).
+    """
+    db = SessionLocal()
+    try:
+        row = db.query(
+            Document.id, Document.status, Document.version, Document.created_at, Document.analysis_results
+        ).filter(Document.filename == filename).first()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    state = _state(row, filename)
+    results = row.analysis_results if row.status == "complete" and row.analysis_results else "null"
+    body = f'{_envelope(state)[:-1]}, "analysis_results": {results}}}'
+    return state, body.encode("utf-8")
+
+def stored_results(filename: str) -> tuple[dict, bytes, bool] | None:
+    """
+    The stored analysis results of a complete document as (snapshot, bytes,
+    gzipped), preferring the gzip copy. None if there are none.
+    """
+    db = SessionLocal()
+    try:
+        row = db.query(
+            Document.id, Document.status, Document.version, Document.created_at,
+            Document.analysis_results, Document.analysis_results_gzip,
+        ).filter(Document.filename == filename).first()
+    finally:
+        db.close()
+    if row is None or row.status != "complete" or not row.analysis_results:
+        return None
+    state = _state(row, filename)
+    if row.analysis_results_gzip:
+        return state, row.analysis_results_gzip, True
+    return state, row.analysis_results.encode("utf-8"), False
+
+async def wait_for_change(filename: str, version: int, timeout: float) -> dict | None:
+    """
+    Waits until the document's version differs from 'version' (or it is
+    gone) and returns the new snapshot, or the unchanged one after 'timeout'.
+    """
+    deadline = anyio.current_time() + min(timeout, settings.status_max_wait_seconds)
+    while True:
+        state = await anyio.to_thread.run_sync(snapshot, filename)
+        if state is None or state["version"] != version or anyio.current_time() >= deadline:
+            return state
+        await anyio.sleep(settings.status_poll_interval)
+
+async def events(filename: str, version: int = -1):
+    """
+    Server-sent events: one 'status' event per version of the document
+    (starting with the current one, unless it is 'version'), until it is
+    complete or failed. If settings.status_max_wait_seconds pass without a
+    change, the stream ends with a comment and EventSource clients reconnect
+    with Last-Event-ID.
+    """
+    while True:
+        state = await wait_for_change(filename, version, settings.status_max_wait_seconds)
+        if state is None:
+            yield 'event: gone\ndata: {}\n\n'
+            return
+        if state["version"] == version:
+            # Nothing happened for a while; the client reconnects with Last-Event-ID.
+            yield ": idle\n\n"
+            return
+        version = state["version"]
+        yield f"id: {version}\nevent: status\ndata: {_envelope(state)}\n\n"
+        if state["status"] in FINAL_STATUSES:
+            return
@@ -0,0 +1,437 @@
+# backend/core/store.py
+"""
+Disk-backed embedding store shared by every API/worker process.
+
+Each document gets its own directory under settings.store_directory:
+
+    <doc dir>/chunks.v<N>.json          chunk text, character spans, page offsets and hashes (sidecar)
+    <doc dir>/lexical.v<N>.npz          BM25 inverted index over the chunks (core/lexical.py)
+    <doc dir>/<model>.v<N>.npy          one contiguous float32 (rows, dim) matrix per model
+    <doc dir>/<model>.sentences.v<N>.npy  embeddings of every sentence (default model only)
+
+Matrices are opened with np.load(mmap_mode="r"), so loading a document is a
+handful of syscalls and the pages are shared by the OS page cache across
+uvicorn workers. The 'embedding_sets' table in SQLite is the manifest that
+says which files are current for a (document, model) pair.
+
+Rows are L2-normalised at write time, so cosine similarity is a plain dot
+product over the mapped matrix with no temporary copies.
+
+Manifest entries record the content hash of the PDF they were computed
+from. Documents with identical content share one set of files (see
+link_document()), and a file is only deleted once no entry refers to it.
+"""
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import or_
+
+from .config import settings
+from .database import SessionLocal, EmbeddingSet
+from .lexical import LexicalIndex
+
+def _doc_dir(doc_id: str) -> str:
+    # Filenames can contain anything, so the directory name is a short digest.
+    return hashlib.sha1(doc_id.encode("utf-8")).hexdigest()[:16]
+
+def _model_slug(model_name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]+", "_", model_name)
+
+def _abs(rel_path: str) -> str:
+    return os.path.join(settings.store_directory, rel_path)
+
+def _atomic_write(rel_path: str, write) -> None:
+    """Writes through a temporary file and renames it into place."""
+    path = _abs(rel_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _remove_quietly(rel_path: str | None) -> None:
+    if not rel_path:
+        return
+    try:
+        os.remove(_abs(rel_path))
+    except FileNotFoundError:
+        pass
+
+def _row_files(row: EmbeddingSet) -> tuple:
+    return (row.matrix_path, row.chunks_path, row.sentences_path)
+
+def _remove_unreferenced(rel_paths) -> None:
+    """Deletes the files no manifest entry points to any more."""
+    rel_paths = {p for p in rel_paths if p}
+    if not rel_paths:
+        return
+    db = SessionLocal()
+    try:
+        referenced = set()
+        for row in db.query(EmbeddingSet).filter(or_(
+            EmbeddingSet.matrix_path.in_(rel_paths), EmbeddingSet.chunks_path.in_(rel_paths),
+            EmbeddingSet.sentences_path.in_(rel_paths),
+        )):
+            referenced.update(_row_files(row))
+    finally:
+        db.close()
+    # Readers that already mapped the old files keep them alive until they
+    # drop their mapping, so unlinking here is safe.
+    for rel_path in rel_paths - referenced:
+        _remove_quietly(rel_path)
+        if rel_path.endswith(".json"):
+            _remove_quietly(lexical_path(rel_path))
+
+def normalize_rows(embeddings) -> np.ndarray:
+    """Returns a C-contiguous float32 copy of the matrix with unit-length rows."""
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1) if matrix.size else matrix.reshape(0, 0)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _write_matrix(rel_path: str, matrix: np.ndarray) -> None:
+    _atomic_write(rel_path, lambda f: np.save(f, matrix, allow_pickle=False))
+
+def lexical_path(chunks_path: str) -> str:
+    """The lexical index belongs to a chunk file, not to a model."""
+    doc_dir, name = os.path.split(chunks_path)
+    return os.path.join(doc_dir, "lexical" + name[len("chunks"):-len(".json")] + ".npz")
+
+def write_lexical(chunks_path: str, index: LexicalIndex) -> None:
+    _atomic_write(lexical_path(chunks_path), index.save)
+
+def load_lexical(chunks_path: str) -> LexicalIndex | None:
+    """Loads the lexical index of a chunk file, or None if it was never built."""
+    try:
+        return LexicalIndex.load(_abs(lexical_path(chunks_path)))
+    except FileNotFoundError:
+        return None
+
+def _write_sidecar(
+    rel_path: str, chunks: list[str], spans: list | None, page_starts: list | None,
+    sentence_spans: list | None, page_hashes: list | None, embedding_mode: str | None,
+) -> None:
+    payload = json.dumps({
+        "chunks": chunks, "spans": spans, "page_starts": page_starts, "sentence_spans": sentence_spans,
+        "page_hashes": page_hashes, "embedding_mode": embedding_mode,
+    }).encode("utf-8")
+    _atomic_write(rel_path, lambda f: f.write(payload))
+
+def _next_version(db, doc_id: str, existing: list) -> int:
+    """
+    The next chunk version of a document. Files in its directory may still be
+    shared with other documents (see link_document()), so their versions are
+    never reused either.
+    """
+    doc_dir = _doc_dir(doc_id)
+    versions = [row.version for row in existing]
+    for (chunks_path,) in db.query(EmbeddingSet.chunks_path).filter(EmbeddingSet.chunks_path.like(f"{doc_dir}/%")):
+        match = re.search(r"\.v(\d+)\.json$", chunks_path)
+        if match:
+            versions.append(int(match.group(1)))
+    return max(versions, default=0) + 1
+
+def write_document(
+    doc_id: str, model_name: str, chunks: list[str], embeddings,
+    spans: list | None = None, page_starts: list | None = None, content_hash: str | None = None,
+    lexical: LexicalIndex | None = None, sentence_spans: list | None = None, sentence_embeddings=None,
+    page_hashes: list | None = None, embedding_mode: str | None = None,
+) -> dict:
+    """
+    Stores a freshly chunked document and its embeddings for one model.
+
+    The chunk sidecar changes, so matrices of any other model for this
+    document are stale and are dropped from the manifest.
+
+    Args:
+        doc_id: The document key (the uploaded filename).
+        model_name: The model that produced the embeddings.
+        chunks: The chunk texts, in row order.
+        embeddings: A (len(chunks), dim) array.
+        spans: Optional [start, end] character spans of each chunk.
+        page_starts: Optional character offset at which each page of the
+            source text starts (see core/parser.py).
+        content_hash: Hash of the PDF the chunks were extracted from.
+        lexical: The BM25 index of the chunks, stored next to them.
+        sentence_spans, sentence_embeddings: The [start, end] span and the
+            embedding of every sentence of the text, for analyses that
+            reuse them (see search.get_sentence_embeddings).
+        page_hashes: A hash of the text of every page, so that the next
+            version of the document can reuse the rows of unchanged pages.
+        embedding_mode: How the embeddings were computed ('int8' or
+            'float32', see inference.mode_tag), so rows are only reused
+            by a version embedded the same way.
+
+    Returns:
+        The manifest entry of the new embedding set.
+    """
+    matrix = normalize_rows(embeddings)
+    if matrix.shape[0] != len(chunks):
+        raise ValueError(f"Got {matrix.shape[0]} embeddings for {len(chunks)} chunks.")
+
+    db = SessionLocal()
+    try:
+        existing = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        version = _next_version(db, doc_id, existing)
+        doc_dir = _doc_dir(doc_id)
+        chunks_path = f"{doc_dir}/chunks.v{version}.json"
+        matrix_path = f"{doc_dir}/{_model_slug(model_name)}.v{version}.npy"
+
+        _write_sidecar(chunks_path, chunks, spans, page_starts, sentence_spans, page_hashes, embedding_mode)
+        if lexical is not None:
+            write_lexical(chunks_path, lexical)
+        sentences_path = None
+        if sentence_embeddings is not None:
+            sentences_path = f"{doc_dir}/{_model_slug(model_name)}.sentences.v{version}.npy"
+            _write_matrix(sentences_path, normalize_rows(sentence_embeddings))
+        _write_matrix(matrix_path, matrix)
+
+        stale_files = set()
+        for row in existing:
+            stale_files.update(_row_files(row))
+            db.delete(row)
+        db.flush()
+        entry = EmbeddingSet(
+            doc_id=doc_id, model_name=model_name,
+            matrix_path=matrix_path, chunks_path=chunks_path, sentences_path=sentences_path,
+            rows=int(matrix.shape[0]), dim=int(matrix.shape[1]),
+            version=version, content_hash=content_hash, updated_at=datetime.utcnow(),
+        )
+        db.add(entry)
+        db.commit()
+        result = _as_dict(entry)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    _remove_unreferenced(stale_files - {chunks_path, matrix_path, sentences_path})
+    return result
+
+def mark_stale(doc_id: str, content_hash: str | None) -> bool:
+    """
+    Marks the document's embedding sets stale if they were computed from
+    other content than 'content_hash' (and current again if they were
+    computed from it). Stale sets aren't searched but stay on disk.
+
+    Returns:
+        Whether the document has stale sets.
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        stale = False
+        for row in rows:
+            row.stale = row.content_hash != content_hash
+            stale = stale or row.stale
+        db.commit()
+        return stale
+    finally:
+        db.close()
+
+def find_by_content(content_hash: str, model_name: str) -> dict | None:
+    """Returns a manifest entry for 'model_name' computed from this content, if any."""
+    if not content_hash:
+        return None
+    db = SessionLocal()
+    try:
+        entry = db.query(EmbeddingSet).filter(
+            EmbeddingSet.content_hash == content_hash, EmbeddingSet.model_name == model_name
+        ).first()
+        return _as_dict(entry) if entry else None
+    finally:
+        db.close()
+
+def link_document(source_doc_id: str, doc_id: str) -> dict | None:
+    """
+    Makes 'doc_id' share every embedding set of 'source_doc_id' (same files,
+    no copies), replacing whatever 'doc_id' had before.
+
+    Returns:
+        The new entry of the source's first model, or None if the source
+        has nothing stored.
+    """
+    db = SessionLocal()
+    try:
+        source_rows = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == source_doc_id).all()
+        if not source_rows:
+            return None
+        # Only the source's current chunk set; another model's matrix may lag behind.
+        current = max(row.version for row in source_rows)
+        source_rows = [row for row in source_rows if row.version == current]
+
+        existing = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        version = _next_version(db, doc_id, existing)
+        stale_files = {p for row in existing for p in _row_files(row)}
+        for row in existing:
+            db.delete(row)
+        db.flush()
+        entries = [
+            EmbeddingSet(
+                doc_id=doc_id, model_name=row.model_name,
+                matrix_path=row.matrix_path, chunks_path=row.chunks_path, sentences_path=row.sentences_path,
+                rows=row.rows, dim=row.dim, version=version,
+                content_hash=row.content_hash, updated_at=datetime.utcnow(),
+            )
+            for row in source_rows
+        ]
+        db.add_all(entries)
+        db.commit()
+        result = _as_dict(entries[0])
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    _remove_unreferenced(stale_files)
+    return result
+
+def link_embeddings(doc_id: str, model_name: str, version: int) -> dict | None:
+    """
+    Points (doc_id, model_name) at the matrix another document sharing the
+    same chunk file already has for that model. Returns None if there is none
+    (or the document has been reprocessed since 'version').
+    """
+    db = SessionLocal()
+    try:
+        rows = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        current = [row for row in rows if row.version == version]
+        if not current:
+            return None
+        shared = db.query(EmbeddingSet).filter(
+            EmbeddingSet.chunks_path == current[0].chunks_path,
+            EmbeddingSet.model_name == model_name,
+            EmbeddingSet.doc_id != doc_id,
+        ).first()
+        if shared is None:
+            return None
+
+        entry = next((row for row in current if row.model_name == model_name), None)
+        if entry is None:
+            entry = EmbeddingSet(
+                doc_id=doc_id, model_name=model_name, chunks_path=current[0].chunks_path,
+                rows=shared.rows, version=version, content_hash=current[0].content_hash,
+            )
+            db.add(entry)
+        entry.matrix_path = shared.matrix_path
+        entry.dim = shared.dim
+        entry.updated_at = datetime.utcnow()
+        db.commit()
+        return _as_dict(entry)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def write_embeddings(doc_id: str, model_name: str, embeddings, version: int) -> dict | None:
+    """
+    Adds (or replaces) the matrix of another model over the document's current chunks.
+
+    'version' must be the chunk version the embeddings were computed from;
+    if the document has been reprocessed since, nothing is written and None
+    is returned.
+    """
+    matrix = normalize_rows(embeddings)
+    db = SessionLocal()
+    try:
+        rows = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        current = [row for row in rows if row.version == version]
+        if not current:
+            return None
+        if matrix.shape[0] != current[0].rows:
+            raise ValueError(f"Got {matrix.shape[0]} embeddings for {current[0].rows} chunks.")
+
+        matrix_path = f"{_doc_dir(doc_id)}/{_model_slug(model_name)}.v{version}.npy"
+        _write_matrix(matrix_path, matrix)
+
+        entry = next((row for row in current if row.model_name == model_name), None)
+        if entry is None:
+            entry = EmbeddingSet(
+                doc_id=doc_id, model_name=model_name, chunks_path=current[0].chunks_path,
+                rows=int(matrix.shape[0]), version=version, content_hash=current[0].content_hash,
+            )
+            db.add(entry)
+        entry.matrix_path = matrix_path
+        entry.dim = int(matrix.shape[1])
+        entry.updated_at = datetime.utcnow()
+        db.commit()
+        return _as_dict(entry)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def read_manifest(doc_id: str, model_name: str) -> dict | None:
+    """Returns the current manifest entry for (doc_id, model_name), or None."""
+    db = SessionLocal()
+    try:
+        entry = db.query(EmbeddingSet).filter(
+            EmbeddingSet.doc_id == doc_id, EmbeddingSet.model_name == model_name
+        ).first()
+        return _as_dict(entry) if entry else None
+    finally:
+        db.close()
+
+def list_manifest(model_name: str) -> list[dict]:
+    """Returns every manifest entry stored for one model."""
+    db = SessionLocal()
+    try:
+        return [_as_dict(e) for e in db.query(EmbeddingSet).filter(EmbeddingSet.model_name == model_name).all()]
+    finally:
+        db.close()
+
+def delete_document(doc_id: str) -> None:
+    """Removes every embedding set of a document, and its files."""
+    db = SessionLocal()
+    try:
+        rows = db.query(EmbeddingSet).filter(EmbeddingSet.doc_id == doc_id).all()
+        paths = {p for row in rows for p in _row_files(row)}
+        for row in rows:
+            db.delete(row)
+        db.commit()
+    finally:
+        db.close()
+    _remove_unreferenced(paths)
+
+def load_matrix(matrix_path: str) -> np.ndarray:
+    """Memory-maps a stored matrix read-only. No data is read until it is used."""
+    return np.load(_abs(matrix_path), mmap_mode="r", allow_pickle=False)
+
+def read_matrix(matrix_path: str) -> np.ndarray:
+    """Reads a stored matrix into memory (rather than mapping it)."""
+    return np.load(_abs(matrix_path), allow_pickle=False)
+
+def load_sidecar(chunks_path: str) -> dict:
+    """
+    Reads the chunk sidecar: {"chunks": [...], "spans": [...] | None,
+    "page_starts": [...] | None, "sentence_spans": [...] | None,
+    "page_hashes": [...] | None, "embedding_mode": str | None}.
+    """
+    with open(_abs(chunks_path), "rb") as f:
+        return json.loads(f.read())
+
+def _as_dict(entry: EmbeddingSet) -> dict:
+    return {
+        "doc_id": entry.doc_id,
+        "model_name": entry.model_name,
+        "matrix_path": entry.matrix_path,
+        "chunks_path": entry.chunks_path,
+        "sentences_path": entry.sentences_path,
+        "rows": entry.rows,
+        "dim": entry.dim,
+        "version": entry.version,
+        "content_hash": entry.content_hash,
+        "stale": bool(entry.stale),
+    }
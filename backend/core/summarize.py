@@ -0,0 +1,208 @@
+# backend/core/summarize.py
+"""
+Map-reduce abstractive summarization of whole documents.
+
+BART reads at most 1024 tokens, so a long document can't be summarized in
+one call. Instead the text is split into sections of at most
+settings.summary_section_tokens tokens (on sentence boundaries), every
+section is summarized (map), and the section summaries are joined and
+summarized again, recursively, until they fit in one final call (reduce).
+
+Sections are summarized in batches of similar length so little time goes
+to padding. Every section summary is cached on disk, keyed by the section
+text, so a reprocess or a retry after a failure only pays for sections it
+hasn't seen. Once settings.summary_time_budget_seconds has passed, the
+remaining sections are represented by their opening sentences instead.
+
+With settings.incremental_reprocessing, sections end at content-defined
+sentences, so after an edit the sections downstream of it line up with the
+previous version's again and hit the cache.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+
+from .config import settings
+from . import metrics
+from .inference import wants_int8
+from .models import get_summarizer, get_summarizer_tokenizer
+from .processor import chunk_by_tokens
+from .tokens import tokenizer_counter
+
+def _cache_path(text: str, max_length: int, min_length: int) -> str:
+    # int8 summaries differ from float32 ones, so each mode has its own entries.
+    model = f"{settings.summarizer_model} int8" if wants_int8("summarizer") else settings.summarizer_model
+    key = f"{model}|{max_length}|{min_length}|{text}"
+    return os.path.join(settings.summary_cache_directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+def _cached_summary(text: str, max_length: int, min_length: int) -> str | None:
+    try:
+        with open(_cache_path(text, max_length, min_length), "rb") as f:
+            return json.loads(f.read())["summary"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _store_summary(text: str, max_length: int, min_length: int, summary: str) -> None:
+    path = _cache_path(text, max_length, min_length)
+    try:
+        os.makedirs(settings.summary_cache_directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Could not cache section summary: {e}")
+
+def _split_sentences(text: str) -> list[tuple[int, int, str]]:
+    # Used when no parse is at hand: cut after sentence-ending punctuation.
+    return [(m.start(), m.end(), m.group()) for m in re.finditer(r"\S.*?(?:[.!?](?=\s)|$)", text)]
+
+def _is_anchor(sentence: str) -> bool:
+    """Whether a sentence may start a section: true for one in settings.summary_anchor_period."""
+    return int(hashlib.sha1(sentence.encode("utf-8")).hexdigest()[:8], 16) % settings.summary_anchor_period == 0
+
+def split_sections(text: str, count_tokens, max_tokens: int, sentences=None) -> list[str]:
+    """
+    Splits text into sections of at most max_tokens tokens, on sentence boundaries.
+
+    With settings.incremental_reprocessing, the sentences are first cut
+    into runs before every anchor sentence (see _is_anchor) reached with
+    at least 3/4 of max_tokens in the run, and each run is packed on its
+    own. Where a run starts depends only on the text since the previous
+    cut, so an edit moves the boundaries of the sections around it only.
+    """
+    sentences = sentences if sentences is not None else _split_sentences(text)
+    if not settings.incremental_reprocessing:
+        return [text[start:end] for start, end in chunk_by_tokens(sentences, count_tokens, max_tokens)]
+
+    counts = {}
+    def count_once(texts):
+        new = [t for t in dict.fromkeys(texts) if t not in counts]
+        if new:
+            counts.update(zip(new, count_tokens(new)))
+        return [counts[t] for t in texts]
+
+    runs, run, run_tokens = [], [], 0
+    for sentence, tokens in zip(sentences, count_once([sentence for _, _, sentence in sentences])):
+        if run and run_tokens >= max_tokens * 3 // 4 and _is_anchor(sentence[2]):
+            runs.append(run)
+            run, run_tokens = [], 0
+        run.append(sentence)
+        run_tokens += tokens
+    if run:
+        runs.append(run)
+    return [text[start:end] for run in runs for start, end in chunk_by_tokens(run, count_once, max_tokens)]
+
+def _lead(text: str, count_tokens, max_tokens: int) -> str:
+    """The opening sentences of a section, up to max_tokens tokens."""
+    sections = split_sections(text, count_tokens, max_tokens)
+    return sections[0] if sections else ""
+
+class SummaryRun:
+    """One map-reduce summarization, with its time budget and statistics."""
+
+    def __init__(self, summarizer, count_tokens, time_budget: float, check_cancelled=None):
+        self.summarizer = summarizer
+        self.count_tokens = count_tokens
+        self.deadline = time.monotonic() + time_budget if time_budget else None
+        self.check_cancelled = check_cancelled or (lambda: None)
+        self.stats = {"sections": 0, "cached": 0, "summarized": 0, "batches": 0, "skipped": 0, "levels": 0}
+
+    def out_of_time(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
+    def summarize_all(self, texts: list[str], max_length: int, min_length: int) -> list[str]:
+        """Summarizes every text, from the cache where possible, in length-sorted batches."""
+        summaries = [_cached_summary(text, max_length, min_length) for text in texts]
+        self.stats["cached"] += sum(summary is not None for summary in summaries)
+        for summary in summaries:
+            metrics.cache_event("summary", hit=summary is not None)
+        todo = [i for i, summary in enumerate(summaries) if summary is None]
+        lengths = dict(zip(todo, self.count_tokens([texts[i] for i in todo])))
+        todo.sort(key=lambda i: lengths[i], reverse=True)
+        # Short inputs can't produce a long summary; keep min_length below
+        # each one. It depends on the text alone, so the cache key stays
+        # (text, max_length, min_length), and a batch only holds texts that
+        # share it.
+        text_min_lengths = {i: min(min_length, max(lengths[i] // 2, 1)) for i in todo}
+        batches = []
+        for i in todo:
+            if (batches and len(batches[-1]) < settings.summary_batch_size
+                    and text_min_lengths[batches[-1][0]] == text_min_lengths[i]):
+                batches[-1].append(i)
+            else:
+                batches.append([i])
+
+        for batch in batches:
+            if self.out_of_time():
+                break
+            self.check_cancelled()
+            with metrics.timer("bart"):
+                outputs = self.summarizer(
+                    [texts[i] for i in batch], batch_size=len(batch), truncation=True,
+                    max_length=max_length, min_length=text_min_lengths[batch[0]], do_sample=False,
+                )
+            for i, output in zip(batch, outputs):
+                summaries[i] = output["summary_text"]
+                _store_summary(texts[i], max_length, min_length, summaries[i])
+            self.stats["batches"] += 1
+            self.stats["summarized"] += len(batch)
+
+        # Out of time: the sections that are left keep their opening sentences.
+        for i, summary in enumerate(summaries):
+            if summary is None:
+                summaries[i] = _lead(texts[i], self.count_tokens, max_length)
+                self.stats["skipped"] += 1
+        return summaries
+
+def summarize_document(
+    text: str, sentences=None, max_length: int = 400, min_length: int = 100,
+    time_budget: float | None = None, check_cancelled=None,
+) -> tuple[str | None, dict]:
+    """
+    Summarizes a text of any length with the 'summarizer' model.
+
+    Args:
+        sentences: (start, end, text) sentences of 'text' from an existing
+            parse; otherwise sentences are split on punctuation.
+        max_length, min_length: Token bounds of the final summary.
+        time_budget: Seconds after which the remaining sections are no longer
+            summarized (default settings.summary_time_budget_seconds; 0 = none).
+        check_cancelled: Called between batches; raises to abort.
+
+    Returns:
+        (summary, stats), or (None, {}) if the summarizer isn't available.
+    """
+    summarizer = get_summarizer()
+    tokenizer = get_summarizer_tokenizer()
+    if summarizer is None or tokenizer is None or not text.strip():
+        return None, {}
+
+    started = time.perf_counter()
+    count_tokens = tokenizer_counter(tokenizer)
+    run = SummaryRun(
+        summarizer, count_tokens,
+        settings.summary_time_budget_seconds if time_budget is None else time_budget, check_cancelled,
+    )
+    section_tokens = settings.summary_section_tokens
+
+    # Map: summarize the sections, then keep reducing until one call will do.
+    sections = split_sections(text, count_tokens, section_tokens, sentences)
+    run.stats["sections"] = len(sections)
+    while len(sections) > 1:
+        run.stats["levels"] += 1
+        summaries = run.summarize_all(sections, settings.summary_section_max_length, settings.summary_section_min_length)
+        joined = " ".join(summaries)
+        reduced = split_sections(joined, count_tokens, section_tokens)
+        if len(reduced) >= len(sections) or run.stats["levels"] >= settings.summary_max_levels:
+            # No progress (or too deep): the final call truncates instead.
+            sections = [joined]
+            break
+        sections = reduced
+
+    # Reduce: the final summary of whatever is left.
+    summary = run.summarize_all(sections, max_length, min_length)[0] if sections else ""
+    run.stats["seconds"] = round(time.perf_counter() - started, 2)
+    return summary, run.stats
@@ -0,0 +1,41 @@
+# backend/core/tokens.py
+"""
+Token counts under a model's own tokenizer.
+
+Chunks are sized in tokens rather than sentences (core/processor.py), so a
+chunk never exceeds what the model actually reads (anything past
+max_seq_length is silently truncated) and short chunks can be merged. The
+summarizer sizes its sections the same way (core/summarize.py).
+"""
+from .config import settings
+
+def token_counter(model):
+    """
+    Returns a function that maps a list of texts to their token counts
+    (without special tokens). Models without a tokenizer fall back to
+    counting whitespace-separated words.
+    """
+    return tokenizer_counter(getattr(model, "tokenizer", None))
+
+def tokenizer_counter(tokenizer):
+    """Like token_counter(), for a bare Hugging Face tokenizer (or None)."""
+    if tokenizer is None:
+        return lambda texts: [len(text.split()) for text in texts]
+
+    def count(texts):
+        if not texts:
+            return []
+        encoded = tokenizer(list(texts), add_special_tokens=False, verbose=False)["input_ids"]
+        return [len(ids) for ids in encoded]
+    return count
+
+def token_budget(model) -> int:
+    """
+    The chunk size in tokens: settings.chunk_max_tokens, capped at what the
+    model reads (its max_seq_length minus the [CLS]/[SEP] tokens).
+    """
+    model_limit = getattr(model, "max_seq_length", None)
+    model_limit = model_limit - 2 if model_limit else None
+    if settings.chunk_max_tokens and model_limit:
+        return min(settings.chunk_max_tokens, model_limit)
+    return settings.chunk_max_tokens or model_limit or 256
@@ -0,0 +1,151 @@
+# backend/core/uploads.py
+"""
+Bounded-memory upload path.
+
+The multipart/form-data body of an upload is read straight from the request
+stream and parsed as it arrives (python-multipart's streaming parser), so
+nothing is spooled before the size limit is checked, and a chunked request
+without a Content-Length is cut off as soon as it goes over
+settings.max_upload_bytes. The 'file' field is written in blocks of
+settings.upload_chunk_bytes into a temporary file in the upload directory,
+hashed incrementally on the way (core/content.py), and renamed into place
+only once it is complete, so a half-written PDF is never visible to
+/process. File I/O runs in a worker thread, and the next chunk of the body
+is only read once the previous one is on disk, so a slow disk slows the
+client down instead of buffering in memory.
+"""
+import os
+import uuid
+
+import anyio
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
+
+from .config import settings
+from . import content
+
+# Room for the multipart boundaries, part headers and any other form fields
+# on top of max_upload_bytes of file content.
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+class UploadTooLarge(ValueError):
+    pass
+
+class InvalidUpload(ValueError):
+    pass
+
+class _FilePart:
+    """
+    MultipartParser callbacks that pick the 'file' field out of a form:
+    its filename and content type once its headers are parsed, and its
+    content in 'pending' until the caller writes it out.
+    """
+    def __init__(self):
+        self.filename = None
+        self.content_type = None
+        self.done = False
+        self.pending = bytearray()
+        self._headers = {}
+        self._field = b""
+        self._value = b""
+        self._in_file = False
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": self._header_field,
+            "on_header_value": self._header_value,
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+        }
+
+    def _part_begin(self):
+        self._headers = {}
+        self._field = self._value = b""
+
+    def _header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field = self._value = b""
+
+    def _headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        # Only the first 'file' field is kept.
+        if options.get(b"name") != b"file" or self.filename is not None:
+            return
+        self._in_file = True
+        self.filename = os.path.basename(options.get(b"filename", b"").decode("utf-8", "replace"))
+        self.content_type = parse_options_header(self._headers.get(b"content-type", b""))[0].decode("latin-1")
+
+    def _part_data(self, data, start, end):
+        if self._in_file:
+            self.pending += data[start:end]
+
+    def _part_end(self):
+        if self._in_file:
+            self._in_file = False
+            self.done = True
+
+async def save_upload(request, directory: str) -> tuple[str, str, int]:
+    """
+    Writes the 'file' field of a multipart/form-data request into
+    'directory', under the filename the client gave it.
+
+    Raises InvalidUpload if the body isn't a form with a PDF 'file' field,
+    and UploadTooLarge (keeping nothing) as soon as more than
+    settings.max_upload_bytes of it have been received.
+
+    Returns:
+        The (filename, content_hash, size in bytes) of the upload.
+    """
+    form_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if form_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise InvalidUpload("Expected a multipart/form-data body.")
+    part = _FilePart()
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+    limit = settings.max_upload_bytes
+    tmp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+    hasher = content.new_hasher()
+    size = received = 0
+    try:
+        async with await anyio.open_file(tmp_path, "wb") as buffer:
+
+            async def flush(minimum: int):
+                nonlocal size
+                if len(part.pending) < max(minimum, 1):
+                    return
+                block = bytes(part.pending)
+                part.pending.clear()
+                size += len(block)
+                if limit and size > limit:
+                    raise UploadTooLarge(f"Uploads are limited to {limit} bytes.")
+                hasher.update(block)
+                await buffer.write(block)
+
+            async for chunk in request.stream():
+                received += len(chunk)
+                if limit and received > limit + FORM_OVERHEAD_BYTES:
+                    raise UploadTooLarge(f"Uploads are limited to {limit} bytes.")
+                parser.write(chunk)
+                if part.filename is not None and part.content_type != "application/pdf":
+                    raise InvalidUpload("Invalid file type.")
+                await flush(settings.upload_chunk_bytes)
+            parser.finalize()
+            await flush(0)
+        if not part.done or not part.filename:
+            raise InvalidUpload("The form has no complete 'file' field with a filename.")
+        await anyio.to_thread.run_sync(os.replace, tmp_path, os.path.join(directory, part.filename))
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+    return part.filename, hasher.hexdigest(), size
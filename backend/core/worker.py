@@ -1,21 +1,39 @@
 # backend/core/worker.py (Final Locked-in Version)
 import json
+import os
 from .database import SessionLocal, Document
-from .parser import extract_text_from_pdf
-from .models import nlp, summarizer, embedding_models, summarizer_tokenizer
-from .analysis import extract_entities, extract_keywords, generate_semantic_extractive_summary
-from keybert import KeyBERT
+from .config import settings
+from .parser import load_pdf_text
+from .summarize import summarize_document
+from .analysis import extract_keybert_keywords
+from .search import get_sentence_embeddings
+from .engine import run_analysis, DOCUMENT_REPORT_TASKS
 
-def analyze_entire_document(filename: str, doc_id: int):
+def analyze_entire_document(filename: str, doc_id: int, job_id: str | None = None, check_cancelled=None):
+    """
+    Builds the full analysis report of a document and stores it on its row.
+
+    Args:
+        job_id: The ingest job this analysis belongs to. If the document has
+            been re-queued since, the (stale) report is not written.
+        check_cancelled: Called between the expensive steps; it raises to
+            abort the analysis (see core/jobs.JobCancelled).
+
+    Raises whatever went wrong, so the job queue can retry it.
+    """
     print(f"BACKGROUND WORKER: Starting full analysis for doc_id: {doc_id} ({filename})")
+    check_cancelled = check_cancelled or (lambda: None)
     db = SessionLocal()
     db_document = db.query(Document).filter(Document.id == doc_id).first()
     
     try:
         if not db_document: return
+        if job_id is not None and db_document.job_id != job_id: return
 
-        file_path = f"./uploads/{filename}"
-        full_text = extract_text_from_pdf(file_path)
+        file_path = os.path.join(settings.upload_directory, filename)
+        # The text the ingest pipeline extracted (and cached), so its cached parse is reused.
+        pdf_text = load_pdf_text(file_path, content_hash=db_document.content_hash)
+        full_text = pdf_text.text
 
         if len(full_text) < 250:
             db_document.status = "complete"
@@ -23,42 +41,37 @@ def analyze_entire_document(filename: str, doc_id: int):
             db.commit()
             return
 
-        # --- NER, Keywords, and KeyBERT (Unchanged) ---
+        # --- NER, Keywords and the Extractive Summary, over one shared parse ---
         print(f"Performing NER, Keywords, and KeyBERT for {filename}...")
-        full_ner = extract_entities(full_text)
-        full_keywords = extract_keywords(full_text)
-        default_embedding_model = embedding_models.get('all-MiniLM-L6-v2')
-        keybert_keywords = []
-        if default_embedding_model:
-            kw_model = KeyBERT(model=default_embedding_model)
-            keybert_keywords_with_scores = kw_model.extract_keywords(full_text, keyphrase_ngram_range=(1, 3), stop_words='english', top_n=15)
-            keybert_keywords = [kw[0] for kw in keybert_keywords_with_scores]
+        # The sentence embeddings stored at /process are reused instead of encoding again.
+        sentence_embeddings = get_sentence_embeddings(filename, content_hash=db_document.content_hash)
+        report = run_analysis(
+            full_text, (*DOCUMENT_REPORT_TASKS, "sentences"),
+            options={"num_sentences": 12, "sentence_embeddings": sentence_embeddings}, cache=True,
+            page_starts=pdf_text.page_starts,
+        )
+        full_ner = report["ner"]
+        full_keywords = report["keywords"]
+        check_cancelled()
+        keybert_keywords = extract_keybert_keywords(
+            full_text, sentence_embeddings=sentence_embeddings, top_n=15, cache_key=filename,
+        )
         
+        check_cancelled()
         print(f"Performing final summarization for {filename}...")
         
         # === Extractive Summary (Using our best method) ===
-        extractive_summary = generate_semantic_extractive_summary(full_text, num_sentences=12)
-
-        # === Abstractive Summary (Using the robust "Intro + Conclusion" method) ===
-        abstractive_summary = "Could not generate abstractive summary."
-        if summarizer and summarizer_tokenizer:
-            intro_text = full_text[:2000]
-            conclusion_text = full_text[-2000:]
-            
-            prompt = f"Based on the following introduction and conclusion from a long document, please write a comprehensive, fluent summary paragraph that captures the main arguments and themes.\n\nINTRODUCTION:\n{intro_text}\n\nCONCLUSION:\n{conclusion_text}"
-
-            tokens = summarizer_tokenizer.encode(prompt)
-            if len(tokens) > 1024:
-                tokens = tokens[:1020]
-            truncated_prompt = summarizer_tokenizer.decode(tokens, skip_special_tokens=True)
+        extractive_summary = report["semantic_summary"]
 
-            final_summary_list = summarizer(truncated_prompt, 
-                                            max_length=400,
-                                            min_length=100, 
-                                            do_sample=False,
-                                            repetition_penalty=1.2)
-            if final_summary_list:
-                abstractive_summary = final_summary_list[0]['summary_text']
+        # === Abstractive Summary (map-reduce over the whole document) ===
+        abstractive_summary, summary_stats = summarize_document(
+            full_text, sentences=report["sentences"], max_length=400, min_length=100,
+            check_cancelled=check_cancelled,
+        )
+        if abstractive_summary is None:
+            abstractive_summary = "Could not generate abstractive summary."
+        else:
+            print(f"Abstractive summary for {filename}: {summary_stats}")
         
         analysis_results = {
             "ner": full_ner,
@@ -67,6 +80,8 @@ def analyze_entire_document(filename: str, doc_id: int):
             "summary": {"extractive": extractive_summary, "abstractive": abstractive_summary }
         }
         
+        db.refresh(db_document)
+        if job_id is not None and db_document.job_id != job_id: return
         db_document.analysis_results = json.dumps(analysis_results)
         db_document.status = "complete"
         db.commit()
@@ -75,7 +90,7 @@ def analyze_entire_document(filename: str, doc_id: int):
     except Exception as e:
         print(f"BACKGROUND WORKER FAILED for doc_id {doc_id}: {e}")
         db.rollback()
-        if db_document: db_document.status = "failed"; db.commit()
+        raise
     finally:
         db.close()
         print(f"BACKGROUND WORKER: DB session closed for doc_id {doc_id}.")
\ No newline at end of file
@@ -0,0 +1,508 @@
+# backend/ingest.py
+"""
+Bulk ingest of a directory (or a manifest) of PDFs, without the HTTP API.
+
+    python ingest.py /data/pdfs --recursive
+    python ingest.py --manifest files.txt --extract-workers 8 --no-analyze
+
+The documents flow through a pipeline of stages, each in its own thread and
+connected by bounded queues (--queue-size), so a slow stage holds back the
+ones before it instead of the whole backlog piling up in memory:
+
+    register  hash each PDF and copy it into settings.upload_directory
+    extract   text extraction in a pool of processes (core/parser.py)
+    segment   sentence segmentation of several documents per nlp.pipe call
+              (core/parsing.parse_texts), then chunking
+    embed     the sentences (and chunks) of several documents encoded
+              together, in length-sorted batches (core/batching.py)
+    commit    the Document rows of a batch inserted or updated in a single
+              transaction, and their analysis jobs queued in another
+
+Afterwards the documents are in the same state as after /upload/ and
+/process/: searchable, with their analysis report computed by the job
+workers (job_worker.py, or the API's own). Content that was processed
+before, under any filename, reuses its embeddings and report.
+
+Every committed document is appended to the checkpoint file (--checkpoint),
+and a run restarted with the same checkpoint skips the files it already
+ingested, unless they changed since. Documents embedded but not yet
+committed when a run stopped reuse their stored embeddings. At the end, a
+summary lists the documents, busy time and throughput of every stage.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from core.config import settings
+
+# Marks the end of a stage's output.
+_DONE = object()
+
+class StageStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.documents = 0
+        self.failed = 0
+        # Seconds spent working (summed over the processes, for 'extract').
+        self.busy = 0.0
+        self.counts = {}
+
+    def count(self, name: str, amount: int) -> None:
+        self.counts[name] = self.counts.get(name, 0) + amount
+
+class Checkpoint:
+    """
+    JSON lines of the files already ingested, keyed by their absolute path
+    and unchanged as long as their size and mtime are.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted write.
+                        continue
+                    self.done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+        self._file = open(path, "a", encoding="utf-8")
+
+    def is_done(self, path: str, size: int, mtime_ns: int) -> bool:
+        return self.done.get(path) == (size, mtime_ns)
+
+    def record(self, items: list[dict]) -> None:
+        for item in items:
+            self._file.write(json.dumps({
+                "path": item["path"], "size": item["size"], "mtime_ns": item["mtime_ns"],
+                "filename": item["filename"], "content_hash": item["content_hash"],
+            }) + "\n")
+            self.done[item["path"]] = (item["size"], item["mtime_ns"])
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+# --- Sources ---
+
+def _is_pdf(path: str) -> bool:
+    return path.lower().endswith(".pdf")
+
+def iter_sources(paths: list[str], manifest: str | None = None, recursive: bool = False):
+    """Yields the absolute path of every PDF in 'paths' (files or directories) and the manifest."""
+    for path in paths:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            if recursive:
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        if _is_pdf(name):
+                            yield os.path.join(root, name)
+            else:
+                for name in sorted(os.listdir(path)):
+                    if _is_pdf(name) and os.path.isfile(os.path.join(path, name)):
+                        yield os.path.join(path, name)
+        else:
+            yield path
+    if manifest:
+        # One path per line, relative to the manifest; '#' starts a comment.
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if line:
+                    yield os.path.join(base, line)
+
+def _copy_and_hash(source: str, destination: str) -> str:
+    """Copies a file into place (atomically) and returns its content hash."""
+    from core import content
+
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        return content.hash_file(source)
+    hasher = content.new_hasher()
+    tmp_path = f"{destination}.part-ingest{os.getpid()}"
+    try:
+        with open(source, "rb") as src, open(tmp_path, "wb") as dst:
+            for block in iter(lambda: src.read(content.HASH_BLOCK_SIZE), b""):
+                hasher.update(block)
+                dst.write(block)
+        os.replace(tmp_path, destination)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return hasher.hexdigest()
+
+# --- Stages ---
+
+def _take(inbox: queue.Queue, size: int) -> tuple[list, bool]:
+    """Up to 'size' items from 'inbox', and whether its end was reached."""
+    batch = []
+    while len(batch) < size:
+        item = inbox.get()
+        if item is _DONE:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+def _needs_work(item: dict) -> bool:
+    return not item.get("error") and not item.get("reused")
+
+def _release(filename: str) -> None:
+    # Nothing is searched in this process; don't keep every document loaded.
+    from core import search
+    search.evict_document(filename)
+    search.corpus_index.remove(filename)
+
+def run_stage(work, inbox: queue.Queue, outbox: queue.Queue, stats: StageStats, batch_size: int = 1, accepts=_needs_work):
+    """
+    Calls work(batch) on batches of up to 'batch_size' items from 'inbox'
+    and passes every item on to 'outbox'. Only the items 'accepts' returns
+    True for go into 'work' (by default, those that neither failed earlier
+    nor reuse stored embeddings). An exception fails the items of the
+    batch that have no error of their own.
+    """
+    finished = False
+    while not finished:
+        batch, finished = _take(inbox, batch_size)
+        active = [item for item in batch if accepts(item)]
+        if active:
+            started = time.perf_counter()
+            try:
+                work(active)
+            except Exception as e:
+                print(f"INGEST {stats.name}: batch failed: {e}")
+                for item in active:
+                    item.setdefault("error", f"{stats.name}: {e}")
+            stats.busy += time.perf_counter() - started
+            stats.documents += len(active)
+            stats.failed += sum(1 for item in active if item.get("error", "").startswith(f"{stats.name}:"))
+        for item in batch:
+            outbox.put(item)
+    outbox.put(_DONE)
+
+def register_stage(sources, outbox: queue.Queue, stats: StageStats, checkpoint: Checkpoint, force: bool, stop: threading.Event):
+    """Hashes and copies every source PDF into the upload directory."""
+    from core import search, store
+
+    os.makedirs(settings.upload_directory, exist_ok=True)
+    claimed = {}
+    for path in sources:
+        if stop.is_set():
+            break
+        started = time.perf_counter()
+        item = {"path": path}
+        try:
+            stat = os.stat(path)
+            item.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+            if checkpoint.is_done(path, stat.st_size, stat.st_mtime_ns):
+                stats.count("skipped", 1)
+                continue
+            filename = os.path.basename(path)
+            if claimed.setdefault(filename, path) != path:
+                raise ValueError(f"{claimed[filename]} is already ingested as {filename}")
+            item["filename"] = filename
+            item["content_hash"] = _copy_and_hash(path, os.path.join(settings.upload_directory, filename))
+            stats.count("bytes", stat.st_size)
+            previous = store.read_manifest(filename, settings.default_embedding_model)
+            if not force and search.reuse_stored_embeddings(filename, item["content_hash"]):
+                item["reused"] = True
+                stats.count("reused", 1)
+                _release(filename)
+            elif previous is not None:
+                # A new version: unchanged pages aren't extracted again, and
+                # the old one isn't searched meanwhile.
+                item["previous_hash"] = previous["content_hash"]
+                search.invalidate_document(filename, item["content_hash"])
+        except Exception as e:
+            item["error"] = f"register: {e}"
+            stats.failed += 1
+        stats.busy += time.perf_counter() - started
+        stats.documents += 1
+        outbox.put(item)
+    outbox.put(_DONE)
+
+def _init_extract_process() -> None:
+    # The pool is already one process per core; no nested pools per PDF.
+    settings.pdf_parallel_min_pages = 0
+
+def _extract(file_path: str, content_hash: str, previous_hash: str | None) -> tuple[str, list[int], list[str], float]:
+    from core.parser import load_pdf_text
+
+    started = time.perf_counter()
+    pdf_text = load_pdf_text(file_path, content_hash=content_hash, previous_hash=previous_hash)
+    return pdf_text.text, pdf_text.page_starts, pdf_text.page_hashes(), time.perf_counter() - started
+
+def extract_stage(inbox: queue.Queue, outbox: queue.Queue, stats: StageStats, workers: int):
+    """Extracts the text of the PDFs in a process pool, keeping their order."""
+    pool = ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_extract_process,
+    )
+    in_flight = deque()
+
+    def finish_oldest():
+        item, future = in_flight.popleft()
+        if future is not None:
+            stats.documents += 1
+            try:
+                item["text"], item["page_starts"], item["page_hashes"], seconds = future.result()
+                stats.busy += seconds
+                stats.count("pages", len(item["page_starts"]))
+            except Exception as e:
+                item["error"] = f"extract: {e}"
+                stats.failed += 1
+        outbox.put(item)
+
+    try:
+        while (item := inbox.get()) is not _DONE:
+            future = None
+            if _needs_work(item):
+                file_path = os.path.join(settings.upload_directory, item["filename"])
+                future = pool.submit(_extract, file_path, item["content_hash"], item.get("previous_hash"))
+            in_flight.append((item, future))
+            # Enough queued up to keep every process busy.
+            while len(in_flight) > 2 * workers or (in_flight and (in_flight[0][1] is None or in_flight[0][1].done())):
+                finish_oldest()
+        while in_flight:
+            finish_oldest()
+    finally:
+        pool.shutdown()
+    outbox.put(_DONE)
+
+def segment_batch(items: list[dict], stats: StageStats) -> None:
+    from core.engine import DOCUMENT_REPORT_TASKS, required_capabilities
+    from core.parsing import parse_texts
+    from core.processor import clean_text, preprocess_and_chunk
+
+    # One nlp.pipe pass over the batch, for exactly what preprocess_and_chunk()
+    # reads back from the parse cache below (and the analysis job later).
+    capabilities = required_capabilities(["chunks"])
+    parse_texts(
+        [clean_text(item["text"]) for item in items], capabilities, cache=True,
+        cache_capabilities=capabilities | required_capabilities(DOCUMENT_REPORT_TASKS),
+        boundaries=[item["page_starts"] for item in items],
+    )
+    for item in items:
+        try:
+            item["chunks"], item["spans"], item["sentences"] = preprocess_and_chunk(
+                item["text"], parse_for=DOCUMENT_REPORT_TASKS, with_spans=True, with_sentences=True,
+                page_starts=item["page_starts"],
+            )
+            stats.count("sentences", len(item["sentences"]))
+            stats.count("chunks", len(item["chunks"]))
+        except Exception as e:
+            item["error"] = f"segment: {e}"
+        del item["text"]
+
+def _split_rows(matrix, counts: list[int]) -> list:
+    rows, start = [], 0
+    for count in counts:
+        rows.append(matrix[start:start + count] if count else None)
+        start += count
+    return rows
+
+def embed_batch(items: list[dict], stats: StageStats) -> None:
+    from core.batching import encode_bucketed
+    from core.models import get_embedding_model
+    from core.search import generate_and_store_embeddings
+
+    model = get_embedding_model(settings.default_embedding_model)
+    if model is None:
+        raise RuntimeError(f"Default model {settings.default_embedding_model} could not be loaded.")
+
+    sentences = [sentence for item in items for _, _, sentence in item["sentences"]]
+    sentence_rows = _split_rows(encode_bucketed(model, sentences), [len(item["sentences"]) for item in items])
+    chunk_rows = [None] * len(items)
+    if settings.chunk_embeddings != "pooled":
+        chunks = [chunk for item in items for chunk in item["chunks"]]
+        chunk_rows = _split_rows(encode_bucketed(model, chunks), [len(item["chunks"]) for item in items])
+        stats.count("chunks_encoded", len(chunks))
+    stats.count("sentences_encoded", len(sentences))
+
+    for item, sentence_embeddings, embeddings in zip(items, sentence_rows, chunk_rows):
+        try:
+            generate_and_store_embeddings(
+                doc_id=item["filename"], chunks=item["chunks"], spans=item["spans"],
+                page_starts=item["page_starts"], content_hash=item["content_hash"], sentences=item["sentences"],
+                embeddings=embeddings, sentence_embeddings=sentence_embeddings, page_hashes=item["page_hashes"],
+            )
+            _release(item["filename"])
+        except Exception as e:
+            item["error"] = f"embed: {e}"
+        for key in ("chunks", "spans", "sentences", "page_starts", "page_hashes"):
+            item.pop(key, None)
+
+def commit_batch(items: list[dict], stats: StageStats, checkpoint: Checkpoint, analyze: bool, force: bool) -> None:
+    """
+    Inserts or updates the Document rows of a batch in one transaction,
+    queues their analysis reports (or reuses those of identical content)
+    and records them in the checkpoint.
+    """
+    from core import jobs, pipeline
+    from core.content import find_analysis
+    from core.database import SessionLocal, Document
+
+    analyses = {item["filename"]: None if force else find_analysis(item["content_hash"]) for item in items}
+    payloads = []
+    db = SessionLocal()
+    try:
+        rows = {
+            row.filename: row
+            for row in db.query(Document).filter(Document.filename.in_([item["filename"] for item in items]))
+        }
+        for item in items:
+            row = rows.get(item["filename"])
+            if row is None:
+                row = rows[item["filename"]] = Document(filename=item["filename"])
+                db.add(row)
+            analysis_results = analyses[item["filename"]]
+            row.content_hash = item["content_hash"]
+            row.status = "complete" if analysis_results is not None else "embedded"
+            row.analysis_results = analysis_results
+            # A new job id makes any report still queued for this document stale;
+            # without a new job (--no-analyze), a queued one still applies.
+            if analysis_results is not None or analyze:
+                row.job_id = pipeline.new_job_id()
+        db.flush()
+        if analyze:
+            payloads = [
+                {"filename": row.filename, "doc_id": row.id, "ingest_job_id": row.job_id}
+                for row in (rows[item["filename"]] for item in items)
+                if row.status == "embedded"
+            ]
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    jobs.enqueue_many("analyze_document", payloads, priority=jobs.PRIORITY_BULK)
+    checkpoint.record(items)
+    stats.count("committed", len(items))
+    stats.count("analysis_reused", sum(1 for results in analyses.values() if results is not None))
+    stats.count("analysis_queued", len(payloads))
+
+# --- Summary ---
+
+def summary(stages: list[StageStats], wall_seconds: float) -> str:
+    lines = [f"{'stage':<10} {'docs':>7} {'failed':>7} {'busy s':>9} {'docs/s':>8}  counts"]
+    for stage in stages:
+        rate = stage.documents / stage.busy if stage.busy else 0.0
+        counts = ", ".join(f"{name} {value}" for name, value in stage.counts.items())
+        lines.append(f"{stage.name:<10} {stage.documents:>7} {stage.failed:>7} {stage.busy:>9.2f} {rate:>8.2f}  {counts}")
+    committed = stages[-1].counts.get("committed", 0)
+    lines.append(f"{committed} documents in {wall_seconds:.1f}s ({committed / max(wall_seconds, 1e-9):.2f} docs/s overall).")
+    # The stage with the most work per unit of parallelism bounds the throughput.
+    busiest = max(stages, key=lambda stage: stage.busy)
+    lines.append(f"Busiest stage: {busiest.name}.")
+    return "\n".join(lines)
+
+def ingest(
+    sources, checkpoint: Checkpoint, extract_workers: int = 0, queue_size: int = 16,
+    segment_batch_size: int = 8, embed_batch_size: int = 16, commit_batch_size: int = 64,
+    analyze: bool = True, force: bool = False, stop: threading.Event | None = None,
+) -> list[StageStats]:
+    """
+    Runs the ingest pipeline over 'sources' (absolute PDF paths) and returns
+    the statistics of every stage. Setting 'stop' stops taking new files;
+    the ones already taken in are finished.
+    """
+    stop = stop or threading.Event()
+    extract_workers = extract_workers or os.cpu_count() or 1
+    stats = [StageStats(name) for name in ("register", "extract", "segment", "embed", "commit")]
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(4)]
+    finished = queue.Queue()
+
+    threads = [
+        threading.Thread(target=register_stage, args=(sources, queues[0], stats[0], checkpoint, force, stop)),
+        threading.Thread(target=extract_stage, args=(queues[0], queues[1], stats[1], extract_workers)),
+        threading.Thread(
+            target=run_stage,
+            args=(lambda items: segment_batch(items, stats[2]), queues[1], queues[2], stats[2], segment_batch_size),
+        ),
+        threading.Thread(
+            target=run_stage,
+            args=(lambda items: embed_batch(items, stats[3]), queues[2], queues[3], stats[3], embed_batch_size),
+        ),
+        threading.Thread(
+            target=run_stage,
+            args=(
+                lambda items: commit_batch(items, stats[4], checkpoint, analyze, force),
+                queues[3], finished, stats[4], commit_batch_size, lambda item: not item.get("error"),
+            ),
+        ),
+    ]
+    for thread, stage in zip(threads, stats):
+        thread.name = f"ingest-{stage.name}"
+        thread.daemon = True
+        thread.start()
+
+    while True:
+        try:
+            # Short waits, so Ctrl-C reaches the main thread.
+            item = finished.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        except KeyboardInterrupt:
+            if stop.is_set():
+                raise
+            print("INGEST: finishing the files already read; press Ctrl-C again to stop now.")
+            stop.set()
+            continue
+        if item is _DONE:
+            break
+        if item.get("error"):
+            print(f"INGEST: {item['path']} failed ({item['error']}).")
+    for thread in threads:
+        thread.join()
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory or manifest of PDFs.")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories of PDFs.")
+    parser.add_argument("--manifest", help="A file listing one PDF path per line.")
+    parser.add_argument("--recursive", action="store_true", help="Descend into subdirectories.")
+    parser.add_argument("--checkpoint", default="ingest.checkpoint.jsonl", help="Progress file to resume from.")
+    parser.add_argument("--extract-workers", type=int, default=0, help="Text extraction processes (0 = one per CPU).")
+    parser.add_argument("--queue-size", type=int, default=16, help="Documents buffered between two stages.")
+    parser.add_argument("--segment-batch", type=int, default=8, help="Documents per nlp.pipe call.")
+    parser.add_argument("--embed-batch", type=int, default=16, help="Documents encoded together.")
+    parser.add_argument("--commit-batch", type=int, default=64, help="Documents per database transaction.")
+    parser.add_argument("--no-analyze", action="store_true", help="Don't queue the analysis reports.")
+    parser.add_argument("--force", action="store_true", help="Recompute embeddings and reports of known content.")
+    args = parser.parse_args()
+    if not args.paths and not args.manifest:
+        parser.error("give at least one path or --manifest")
+
+    from core import database
+    database.create_db_and_tables()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    stop = threading.Event()
+    started = time.perf_counter()
+    print(f"INGEST: resuming after {len(checkpoint.done)} files." if checkpoint.done else "INGEST: starting.")
+    try:
+        stage_stats = ingest(
+            iter_sources(args.paths, args.manifest, args.recursive), checkpoint,
+            extract_workers=args.extract_workers, queue_size=args.queue_size,
+            segment_batch_size=args.segment_batch, embed_batch_size=args.embed_batch,
+            commit_batch_size=args.commit_batch, analyze=not args.no_analyze, force=args.force, stop=stop,
+        )
+    except KeyboardInterrupt:
+        # Committed documents are in the checkpoint; run again to resume.
+        print("INGEST: interrupted.")
+        raise SystemExit(130)
+    finally:
+        checkpoint.close()
+    print(summary(stage_stats, time.perf_counter() - started))
@@ -0,0 +1,144 @@
+# backend/job_worker.py
+"""
+Worker processes for the durable job queue (core/jobs.py).
+
+    python job_worker.py --workers 4
+
+Each process loads the NLP models once and then claims and runs jobs until
+it is stopped. The API starts settings.job_workers of these itself; run this
+script instead (with NLP_JOB_WORKERS=0 for the API) to scale them out
+separately, e.g. on another machine sharing the same database and store.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import traceback
+
+from core.config import settings
+
+def _handlers():
+    # Imported inside the worker process so the models are loaded there, once.
+    from core.analysis import run_analysis_tasks
+    from core.database import update_document_status
+    from core.pipeline import cancel_analysis
+    from core.worker import analyze_entire_document
+
+    def analyze_document(payload, check_cancelled):
+        # Skip analyses of documents that were re-queued since this job was created.
+        if not update_document_status(payload["doc_id"], "analyzing", job_id=payload.get("ingest_job_id")):
+            return None
+        analyze_entire_document(
+            filename=payload["filename"], doc_id=payload["doc_id"],
+            job_id=payload.get("ingest_job_id"), check_cancelled=check_cancelled,
+        )
+        return None
+
+    def analyze_document_failed(payload):
+        update_document_status(payload["doc_id"], "failed", job_id=payload.get("ingest_job_id"))
+
+    def analyze_document_cancelled(payload):
+        cancel_analysis(payload["doc_id"], payload.get("ingest_job_id"))
+
+    def analyze_text(payload, check_cancelled):
+        return run_analysis_tasks(payload["text"], payload["tasks"])
+
+    handlers = {"analyze_document": analyze_document, "analyze_text": analyze_text}
+    on_failed = {"analyze_document": analyze_document_failed}
+    on_cancelled = {"analyze_document": analyze_document_cancelled}
+    return handlers, on_failed, on_cancelled
+
+def run_job(job: dict, worker_id: str, handlers: dict, on_failed: dict, on_cancelled: dict):
+    from core import jobs
+
+    job_id = job["job_id"]
+    finished = threading.Event()
+    lost = threading.Event()
+
+    def keep_lease():
+        while not finished.wait(settings.job_lease_seconds / 3):
+            if not jobs.heartbeat(job_id, worker_id):
+                lost.set()
+                return
+
+    def check_cancelled():
+        if lost.is_set():
+            raise jobs.JobCancelled(f"Job {job_id} was cancelled or its lease was lost.")
+
+    def was_cancelled():
+        # Otherwise the lease expired and the job is another worker's now,
+        # which must not have its document changed under it.
+        current = jobs.get(job_id)
+        return current is not None and current["status"] == "cancelled"
+
+    heartbeat_thread = threading.Thread(target=keep_lease, daemon=True)
+    heartbeat_thread.start()
+    started = time.perf_counter()
+    try:
+        result = handlers[job["kind"]](job["payload"], check_cancelled)
+        if jobs.complete(job_id, worker_id, result):
+            print(f"JOB WORKER {worker_id}: {job['kind']} job {job_id} done in {time.perf_counter() - started:.1f}s.")
+        else:
+            print(f"JOB WORKER {worker_id}: {job['kind']} job {job_id} finished, but was cancelled or lost its lease meanwhile.")
+    except jobs.JobCancelled:
+        if was_cancelled():
+            print(f"JOB WORKER {worker_id}: {job['kind']} job {job_id} cancelled.")
+            if job["kind"] in on_cancelled:
+                on_cancelled[job["kind"]](job["payload"])
+        else:
+            print(f"JOB WORKER {worker_id}: {job['kind']} job {job_id} lost its lease; leaving it to its new worker.")
+    except Exception:
+        error = traceback.format_exc()
+        status = jobs.fail(job_id, worker_id, error)
+        print(f"JOB WORKER {worker_id}: {job['kind']} job {job_id} failed (attempt {job['attempts']}), now '{status}'.")
+        if status == "failed" and job["kind"] in on_failed:
+            on_failed[job["kind"]](job["payload"])
+    finally:
+        finished.set()
+
+def run_worker(stop_event=None):
+    """Claims and runs jobs until 'stop_event' is set (or forever)."""
+    from core import jobs
+    from core.inference import configure_torch
+
+    # Workers share the node's cores with the API and each other.
+    configure_torch(settings.job_worker_torch_threads or None)
+    handlers, on_failed, on_cancelled = _handlers()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"JOB WORKER {worker_id}: ready.")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            job = jobs.claim(worker_id, kinds=list(handlers))
+        except Exception as e:
+            print(f"JOB WORKER {worker_id}: could not claim a job: {e}")
+            job = None
+        if job is None:
+            time.sleep(settings.job_poll_interval)
+            continue
+        run_job(job, worker_id, handlers, on_failed, on_cancelled)
+
+def start_workers(count: int) -> list:
+    """Starts 'count' worker processes and returns them."""
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for i in range(count):
+        process = context.Process(target=run_worker, name=f"job-worker-{i}", daemon=True)
+        process.start()
+        processes.append(process)
+    return processes
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run job queue worker processes.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes.")
+    args = parser.parse_args()
+
+    from core import database
+    database.create_db_and_tables()
+
+    if args.workers == 1:
+        run_worker()
+    else:
+        for process in start_workers(args.workers):
+            process.join()
@@ -1,27 +1,60 @@
 # backend/main.py (Updated /search endpoint)
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 import uvicorn
 import os
-import json
-import numpy as np
-from pydantic import BaseModel
+import gzip
+import threading
+import time
+import anyio
+from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
 
-from core.parser import extract_text_from_pdf
-from core.processor import preprocess_and_chunk
-from core.search import generate_and_store_embeddings, document_store, semantic_search
-from core.analysis import extract_entities, extract_keywords, generate_summary
-from core.worker import analyze_entire_document
-from core import database
+from core.search import semantic_search, rerank_search, hybrid_search, corpus_search, batch_search, memory_stats, embedding_cache, invalidate_document
+from core.analysis import analyze_text as run_interactive_analysis, analysis_cache
+from core.batching import query_cache
+from core import database, pipeline, jobs, content, uploads, status, metrics
+from core.models import registry
 from core.database import SessionLocal, engine
+from core.config import settings
 
 database.create_db_and_tables()
 app = FastAPI(title="NLP Search Engine API")
 
+# --- Job queue worker processes (see job_worker.py) ---
+job_worker_processes = []
+
+@app.on_event("startup")
+def start_job_workers():
+    if settings.job_workers > 0:
+        import job_worker
+        job_worker_processes.extend(job_worker.start_workers(settings.job_workers))
+
+@app.on_event("startup")
+def warm_up_models():
+    # Load in the background so the API can answer right away.
+    if settings.warmup_models:
+        threading.Thread(target=registry.warm_up, args=(settings.warmup_models,), daemon=True).start()
+
+@app.on_event("startup")
+def recover_ingest_jobs():
+    # Documents whose ingest was interrupted by a restart, or by another API
+    # process sharing the database that stopped, once their lease runs out.
+    threading.Thread(target=pipeline.recover_periodically, name="ingest-recovery", daemon=True).start()
+
+@app.on_event("startup")
+def start_profiler():
+    metrics.start_profiler()
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    for process in job_worker_processes:
+        process.terminate()
+
 # --- CORS MIDDLEWARE ... (This section is unchanged)
 origins = ["http://localhost:5173", "http://localhost:3000"]
 app.add_middleware(
@@ -29,20 +62,86 @@ app.add_middleware(
     allow_origins=origins, allow_credentials=True, allow_methods=["*"], allow_headers=["*"],
 )
 
+# --- Instrumentation (see core/metrics.py) ---
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # Opt-in stage breakdown of a request, returned as a Server-Timing header.
+    traced = settings.trace_all_requests or request.headers.get("x-trace") == "1"
+    token = metrics.start_trace() if traced else None
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        stages = metrics.end_trace(token) if traced else []
+    seconds = time.perf_counter() - started
+    route = request.scope.get("route")
+    metrics.http_requests.observe(seconds, route=getattr(route, "path", "unmatched"), method=request.method)
+    if traced:
+        response.headers["Server-Timing"] = metrics.server_timing(stages, total=seconds)
+    return response
+
+def _collect_runtime_metrics():
+    families = [
+        ("nlp_job_queue_depth", "Jobs in the durable queue by status.", "gauge",
+         [({"status": job_status}, count) for job_status, count in jobs.queue_depth().items()]),
+    ]
+    models = registry.stats()
+    families.append(("nlp_model_resident_bytes", "Approximate memory of each loaded model.", "gauge",
+                     [({"model": name}, info["bytes"]) for name, info in models["loaded"].items()]))
+    families.append(("nlp_model_load_seconds", "Load time of each loaded model.", "gauge",
+                     [({"model": name}, info["load_seconds"]) for name, info in models["loaded"].items()]))
+    caches = {"query": query_cache, "embedding": embedding_cache, "analysis": analysis_cache}
+    stats = {name: cache.stats() for name, cache in caches.items()}
+    families.append(("nlp_lru_cache_lookups_total", "In-memory cache lookups by cache and result.", "counter",
+                     [({"cache": name, "result": result}, s[key]) for name, s in stats.items()
+                      for result, key in (("hit", "hits"), ("miss", "misses"))]))
+    families.append(("nlp_lru_cache_size", "Size of the in-memory caches (bytes for embedding, entries otherwise).", "gauge",
+                     [({"cache": name}, s["size"]) for name, s in stats.items()]))
+    totals = memory_stats()["totals"]
+    families.append(("nlp_document_memory_bytes", "Memory of the loaded documents by kind.", "gauge",
+                     [({"kind": kind.removesuffix("_bytes")}, value) for kind, value in totals.items()]))
+    return families
+
+metrics.register_collector(_collect_runtime_metrics)
+
 # --- Pydantic Models ... (This section is unchanged)
 class AnalysisTask(str, Enum):
     ner = "ner"
     keywords = "keywords"
     summary = "summary"
 
+class SearchMode(str, Enum):
+    dense = "dense"
+    rerank = "rerank"
+    hybrid = "hybrid"
+
+class FusionMethod(str, Enum):
+    rrf = "rrf"
+    weighted = "weighted"
+
 class AnalysisRequest(BaseModel):
     text: str
     tasks: List[AnalysisTask]
 
+# Largest number of results a search request may ask for.
+MAX_TOP_K = 1000
+# Largest candidate pools a search request may ask for: chunks rescored by
+# the cross-encoder (mode=rerank), and top BM25 chunks scored densely
+# (mode=hybrid).
+MAX_RERANK_CANDIDATES = 1000
+MAX_LEXICAL_CANDIDATES = 100_000
+
+class BatchSearchRequest(BaseModel):
+    queries: List[str]
+    filenames: List[str]
+    model_name: str = 'all-MiniLM-L6-v2'
+    top_k: int = Field(5, ge=1, le=MAX_TOP_K)
+
 class DocumentStatusResponse(BaseModel):
     doc_id: int
     filename: str
     status: str
+    version: int
     created_at: datetime
     analysis_results: Optional[dict] = None
     class Config:
@@ -60,116 +159,344 @@ def get_db():
 async def root():
     return {"message": "Server is running successfully!"}
 
-@app.post("/upload/")
-async def upload_pdf(file: UploadFile = File(...)):
-    # ... (This endpoint is unchanged)
-    UPLOAD_DIRECTORY = "./uploads"
+@app.get("/models")
+async def get_models():
+    """
+    Which models are loaded in this process, their load time and memory.
+    """
+    return registry.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Prometheus text exposition of this process's stage timings, cache and
+    fallback counters, request durations, queue depth and model memory.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profile")
+def get_profile(top: int = 50):
+    """
+    The most sampled (stage, stack) pairs of the sampling profiler, if
+    enabled with NLP_PROFILE_INTERVAL_MS.
+    """
+    if metrics.profiler is None:
+        raise HTTPException(status_code=404, detail="The sampling profiler is disabled (set NLP_PROFILE_INTERVAL_MS).")
+    return metrics.profiler.report(top)
+
+@app.get("/memory")
+def get_memory():
+    """
+    Memory held by the documents loaded in this process, per document and
+    in total, and the state of the embedding cache.
+    """
+    return memory_stats()
+
+# The body is parsed from the request stream (see core/uploads.py) rather
+# than declared as an UploadFile, which would spool all of it first; this
+# keeps the form in the OpenAPI schema.
+UPLOAD_FORM_SCHEMA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+@app.post("/upload/", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_pdf(request: Request, db: Session = Depends(get_db)):
+    """
+    Stores an uploaded PDF and records its content hash. A document whose
+    content changed loses its old analysis and drops out of search until it
+    is processed again; identical content (under any name) is reused by
+    /process instead of being processed again.
+    The file is streamed to disk in fixed-size blocks as the body arrives
+    (see core/uploads.py).
+    """
+    UPLOAD_DIRECTORY = settings.upload_directory
     if not os.path.exists(UPLOAD_DIRECTORY):
         os.makedirs(UPLOAD_DIRECTORY)
-    if file.content_type != "application/pdf":
-        raise HTTPException(status_code=400, detail="Invalid file type.")
-    file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
-    with open(file_path, "wb") as buffer:
-        buffer.write(await file.read())
-    return {"filename": file.filename, "status": "File uploaded successfully"}
-
-@app.post("/process/{filename}")
-async def process_document(filename: str, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
-    # ... (This endpoint is unchanged)
-    UPLOAD_DIRECTORY = "./uploads"
+    # Reject obviously oversized uploads before reading any of the body.
+    content_length = request.headers.get("content-length")
+    if content_length is not None and not content_length.strip().isdigit():
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header.")
+    if settings.max_upload_bytes and content_length and int(content_length) > settings.max_upload_bytes + uploads.FORM_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploads are limited to {settings.max_upload_bytes} bytes.")
+    try:
+        filename, content_hash, size = await uploads.save_upload(request, UPLOAD_DIRECTORY)
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except uploads.InvalidUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db_document = db.query(database.Document).filter(database.Document.filename == filename).first()
+    if not db_document:
+        db.add(database.Document(filename=filename, status="uploaded", content_hash=content_hash))
+    elif db_document.content_hash != content_hash:
+        db_document.status = "uploaded"
+        db_document.content_hash = content_hash
+        db_document.analysis_results = None
+    db.commit()
+    # The stored embeddings (and their pages) are of the previous file.
+    invalidate_document(filename, content_hash)
+
+    return {
+        "filename": filename,
+        "status": "File uploaded successfully",
+        "size": size,
+        "content_hash": content_hash,
+        "duplicate_of": content.find_duplicate(content_hash, filename),
+    }
+
+@app.post("/process/{filename}", status_code=202)
+async def process_document(filename: str, force: bool = False, db: Session = Depends(get_db)):
+    """
+    Queues a document for ingestion and returns immediately. Poll
+    /document/{filename}/status or /jobs/{job_id} for progress.
+    Content that was processed before is reused unless 'force' is set.
+    """
+    UPLOAD_DIRECTORY = settings.upload_directory
     file_path = os.path.join(UPLOAD_DIRECTORY, filename)
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="File not found.")
     
+    job_id = pipeline.new_job_id()
     db_document = db.query(database.Document).filter(database.Document.filename == filename).first()
     if not db_document:
-        db_document = database.Document(filename=filename, status="processing")
+        db_document = database.Document(filename=filename, status="queued", job_id=job_id)
         db.add(db_document)
         db.commit()
         db.refresh(db_document)
     else:
-        db_document.status = "processing"
-        db_document.analysis_results = None
+        db_document.status = "queued"
+        db_document.job_id = job_id
+        if force:
+            db_document.analysis_results = None
         db.commit()
     
-    background_tasks.add_task(analyze_entire_document, filename=filename, doc_id=db_document.id)
-    raw_text = extract_text_from_pdf(file_path)
-    chunks = preprocess_and_chunk(raw_text)
-    generate_and_store_embeddings(doc_id=filename, chunks=chunks)
+    pipeline.submit(
+        filename=filename, doc_id=db_document.id, job_id=job_id,
+        content_hash=db_document.content_hash, force=force,
+    )
     
-    return {"message": "...", "filename": filename, "doc_id": db_document.id, "status": db_document.status}
+    return {"message": "Document queued for processing.", "filename": filename, "doc_id": db_document.id, "job_id": job_id, "status": db_document.status}
 
-# In backend/main.py, replace the existing get_document_status function with this:
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, db: Session = Depends(get_db)):
+    """
+    Reports the state of a queued job, or the stage an ingest job has reached.
+    """
+    job = jobs.get(job_id)
+    if job:
+        return job
+    db_document = db.query(database.Document).filter(database.Document.job_id == job_id).first()
+    if not db_document:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"job_id": job_id, "filename": db_document.filename, "doc_id": db_document.id, "status": db_document.status}
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """
+    Cancels a queued or running job. An ingest job (from /process) can be
+    cancelled until its document is searchable; cancelling a document's
+    analysis job leaves it searchable, with status 'cancelled'.
+    """
+    job = jobs.get(job_id)
+    if jobs.cancel(job_id):
+        # A running analysis does the same once its worker notices; a queued
+        # one never reaches a worker.
+        if job["kind"] == "analyze_document":
+            pipeline.cancel_analysis(job["payload"]["doc_id"], job["payload"].get("ingest_job_id"))
+    elif not pipeline.cancel(job_id):
+        raise HTTPException(status_code=409, detail="Job not found or already finished.")
+    return {"job_id": job_id, "status": "cancelled"}
 
 @app.get("/document/{filename}/status", response_model=DocumentStatusResponse)
-async def get_document_status(filename: str, db: Session = Depends(get_db)):
+async def get_document_status(filename: str, request: Request, wait: float = 0):
     """
     Polls for the status of a document's full analysis.
+
+    Responses carry an ETag that changes with every status change. Send it
+    back as If-None-Match to get a bodiless 304 while nothing changed; with
+    'wait' > 0 the request is held for up to that many seconds (long-poll)
+    until something does. The analysis results are sent as stored.
     """
-    print(f"Polling status for: {filename}")
-    
-    db_document = db.query(database.Document).filter(database.Document.filename == filename).first()
+    state = await anyio.to_thread.run_sync(status.snapshot, filename)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
 
-    if not db_document:
+    if_none_match = request.headers.get("if-none-match")
+    if wait > 0 and status.etag_matches(if_none_match, state):
+        state = await status.wait_for_change(filename, state["version"], wait)
+        if state is None:
+            raise HTTPException(status_code=404, detail="Document not found.")
+    if status.etag_matches(if_none_match, state):
+        return Response(status_code=304, headers={"ETag": status.etag(state), "Cache-Control": "no-cache"})
+
+    found = await anyio.to_thread.run_sync(status.status_body, filename)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Document not found.")
+    state, body = found
+    return Response(
+        content=body, media_type="application/json",
+        headers={"ETag": status.etag(state), "Cache-Control": "no-cache"},
+    )
+
+@app.get("/document/{filename}/events")
+async def document_events(filename: str, request: Request):
+    """
+    Server-sent events with every status change of a document, until its
+    analysis is complete or failed.
+    """
+    if await anyio.to_thread.run_sync(status.snapshot, filename) is None:
         raise HTTPException(status_code=404, detail="Document not found.")
+    last_event_id = request.headers.get("last-event-id")
+    version = int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    return StreamingResponse(
+        status.events(filename, version), media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    parsed_results = None
-    if db_document.status == "complete" and db_document.analysis_results:
-        # Safely parse the JSON string from the database
-        try:
-            parsed_results = json.loads(db_document.analysis_results)
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON for document {filename}")
-            # This will ensure the app doesn't crash if the JSON is malformed
-            parsed_results = {"error": "Failed to decode analysis results."}
-
-
-    # --- THIS IS THE DEFINITIVE FIX for Pydantic V2 ---
-    # 1. Manually create a clean dictionary from the database object's attributes.
-    response_data = {
-        "doc_id": db_document.id,
-        "filename": db_document.filename,
-        "status": db_document.status,
-        "created_at": db_document.created_at,
-        "analysis_results": parsed_results # Use our safely parsed results
+@app.get("/document/{filename}/results")
+async def get_document_results(filename: str, request: Request):
+    """
+    The analysis results of a complete document, sent exactly as stored:
+    gzip-compressed if the client accepts it, with the status ETag.
+    """
+    found = await anyio.to_thread.run_sync(status.stored_results, filename)
+    if found is None:
+        raise HTTPException(status_code=404, detail="No analysis results for this document.")
+    state, body, gzipped = found
+    headers = {"ETag": status.etag(state), "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if status.etag_matches(request.headers.get("if-none-match"), state):
+        return Response(status_code=304, headers=headers)
+    if gzipped:
+        if "gzip" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = gzip.decompress(body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@app.get("/search")
+def search_corpus(
+    query: str,
+    top_k: int = Query(10, ge=1, le=MAX_TOP_K),
+    nprobe: Optional[int] = Query(None, ge=1),
+    exact: bool = False,
+):
+    """
+    Searches across every processed document. 'nprobe' trades recall for
+    latency once the corpus is large enough to use the ANN index; 'exact'
+    forces a brute-force scan.
+    """
+    if not query:
+        raise HTTPException(status_code=400, detail="Query parameter cannot be empty.")
+
+    results = corpus_search(query=query, top_k=top_k, nprobe=nprobe, exact=exact)
+    if not results:
+        raise HTTPException(status_code=404, detail="No relevant results found.")
+
+    return {"query": query, "model_used": settings.default_embedding_model, "results": results}
+
+@app.post("/search/batch")
+def search_batch(request: BatchSearchRequest):
+    """
+    Runs many queries against one or more documents; all queries are encoded
+    together and scored with a single matrix multiply.
+    """
+    if not request.queries or not all(request.queries):
+        raise HTTPException(status_code=400, detail="Queries cannot be empty.")
+    try:
+        results = batch_search(request.filenames, request.queries, request.model_name, top_k=request.top_k)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "model_used": request.model_name,
+        "results": [{"query": query, "results": hits} for query, hits in zip(request.queries, results)],
     }
-    
-    # 2. Use the dictionary to create and return the Pydantic response model.
-    #    This is the modern and most robust way to do this.
-    return DocumentStatusResponse(**response_data)
 
 # --- UPDATED /search ENDPOINT ---
 @app.get("/search/{filename}")
-async def search_in_document(filename: str, query: str, model_name: str = 'all-MiniLM-L6-v2'):
+def search_in_document(
+    filename: str,
+    query: str,
+    model_name: str = 'all-MiniLM-L6-v2',
+    mode: SearchMode = SearchMode.dense,
+    rerank_model: Optional[str] = None,
+    rerank_candidates: Optional[int] = Query(None, ge=1, le=MAX_RERANK_CANDIDATES),
+    fusion: Optional[FusionMethod] = None,
+    alpha: Optional[float] = Query(None, ge=0, le=1),
+    lexical_candidates: Optional[int] = Query(None, ge=1, le=MAX_LEXICAL_CANDIDATES),
+):
     """
     Performs semantic search, optionally with a specified model.
+    With mode=rerank, the default model recalls 'rerank_candidates' chunks and
+    'rerank_model' rescores only those; 'model_name' is ignored.
+    With mode=hybrid, BM25 and dense scores are fused ('fusion', 'alpha');
+    'lexical_candidates' limits dense scoring to the top BM25 chunks.
+    Declared sync so FastAPI runs it in its threadpool; a cold cache miss
+    encodes the document and must not block the event loop.
     """
     if not query:
         raise HTTPException(status_code=400, detail="Query parameter cannot be empty.")
     
+    stats = {}
     try:
-        results = semantic_search(doc_id=filename, query=query, model_name=model_name, top_k=5)
+        if mode == SearchMode.rerank:
+            rerank_model = rerank_model or settings.rerank_model
+            results, stats = rerank_search(
+                doc_id=filename, query=query, rerank_model=rerank_model, top_k=5,
+                candidates=rerank_candidates or settings.rerank_candidates,
+            )
+            model_name = f"{settings.default_embedding_model} -> {rerank_model}"
+        elif mode == SearchMode.hybrid:
+            results = hybrid_search(
+                doc_id=filename, query=query, model_name=model_name, top_k=5,
+                fusion=fusion.value if fusion else None, alpha=alpha, lexical_candidates=lexical_candidates,
+            )
+        else:
+            results = semantic_search(doc_id=filename, query=query, model_name=model_name, top_k=5)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
     if not results:
         raise HTTPException(status_code=404, detail="No relevant results found.")
 
-    return {"filename": filename, "query": query, "model_used": model_name, "results": results}
+    return {"filename": filename, "query": query, "model_used": model_name, "mode": mode, "results": results, **stats}
 
 @app.post("/analyze/")
 async def analyze_text(request: AnalysisRequest):
-    # ... (This endpoint is unchanged)
-    results = {}
-    if AnalysisTask.ner in request.tasks:
-        results["ner"] = extract_entities(request.text)
-    if AnalysisTask.keywords in request.tasks:
-        results["keywords"] = extract_keywords(request.text)
-    if AnalysisTask.summary in request.tasks:
-        results["summary"] = generate_summary(request.text)
+    """
+    Runs the requested analyses of a text (e.g. a search result chunk) off
+    the event loop, concurrently over one parse. Results are cached, and
+    identical requests in flight are computed once.
+    """
+    results = await run_interactive_analysis(request.text, [task.value for task in request.tasks])
     if not results:
         raise HTTPException(status_code=400, detail="No valid tasks requested.")
     return results
 
+@app.post("/analyze/jobs", status_code=202)
+async def queue_text_analysis(request: AnalysisRequest):
+    """
+    Queues an interactive analysis for the worker processes. It runs ahead
+    of any bulk document reports; fetch the result from /jobs/{job_id}.
+    """
+    if not request.tasks:
+        raise HTTPException(status_code=400, detail="No valid tasks requested.")
+    job_id = jobs.enqueue(
+        "analyze_text",
+        {"text": request.text, "tasks": [task.value for task in request.tasks]},
+        priority=jobs.PRIORITY_INTERACTIVE,
+    )
+    return {"job_id": job_id, "status": "queued"}
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file